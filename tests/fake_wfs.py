@@ -0,0 +1,107 @@
+import json
+import random
+import threading
+import time
+
+from wmsdump import json_codec
+from wmsdump.dumper import OGCServiceDumper
+from wmsdump.state import State
+
+LAYER_URL = 'http://localhost/ows'
+
+def make_point_feature(i, x, y):
+    return { 'type': 'Feature', 'id': f'a.{i}',
+             'geometry': { 'type': 'Point', 'coordinates': [ x, y ] },
+             'properties': { 'i': i } }
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        # small chunks, to go through the parsers the way a slow network would
+        for i in range(0, len(self.content), 64):
+            yield self.content[i:i + 64]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeWFS:
+    """
+    Stands in for a requests session talking to a WFS with a single layer of points,
+    answers GetFeature with the points in the bbox, paged with startIndex and maxFeatures/count.
+    """
+    def __init__(self, num_features, seed=1, delay=0, max_features=None):
+        rand = random.Random(seed)
+        self.features = [ make_point_feature(i, rand.uniform(-180, 180), rand.uniform(-90, 90))
+                          for i in range(num_features) ]
+        self.delay = delay
+        # the server side limit on the records in a response
+        self.max_features = max_features
+        self.requests = []
+        self.lock = threading.Lock()
+        self.held_after = None
+        self.release = threading.Event()
+
+    def hold_after(self, num_requests):
+        # requests beyond the first num_requests wait till release is set
+        self.held_after = num_requests
+
+    def get_features(self, params):
+        feats = self.features
+        if 'bbox' in params:
+            xmin, ymin, xmax, ymax = [ float(v) for v in params['bbox'].split(',')[:4] ]
+            feats = [ f for f in feats
+                      if xmin <= f['geometry']['coordinates'][0] <= xmax and
+                         ymin <= f['geometry']['coordinates'][1] <= ymax ]
+        start = int(params.get('startIndex', 0))
+        count = int(params.get('maxFeatures', params.get('count', len(feats))))
+        if self.max_features is not None:
+            count = min(count, self.max_features)
+        return feats[start:start + count]
+
+    def get_body(self, params):
+        with self.lock:
+            self.requests.append(dict(params))
+            held = self.held_after is not None and len(self.requests) > self.held_after
+        if held:
+            self.release.wait()
+        if self.delay:
+            time.sleep(self.delay)
+        data = { 'type': 'FeatureCollection', 'features': self.get_features(params) }
+        return json.dumps(data).encode('utf-8')
+
+    def get(self, url, params=None, **kwargs):
+        return FakeResponse(self.get_body(params))
+
+
+def get_state(mode='EXTENT'):
+    return State.from_dict(url=LAYER_URL, layername='a', service='WFS',
+                           version='1.0.0', operation='GetFeature', mode=mode)
+
+def round_trip(state, records):
+    # the state as a resumed run would read it back, along with the records already written
+    resumed = State.from_dict(**state.get_dict())
+    for record in records:
+        resumed.add_raw_feature_no_dedup(json_codec.dumps(record, resumed.encode_backend))
+    return resumed
+
+def get_dumper(session, state, records, mode='EXTENT', dumper_class=OGCServiceDumper, **kwargs):
+    # records is the list the dumped features are collected in, to check duplicates against
+    def get_nth(n):
+        return json_codec.dumps(records[n], state.encode_backend)
+    return dumper_class(LAYER_URL, 'a', 'WFS', retrieval_mode=mode, state=state,
+                        session=session, get_nth=get_nth, layer_bounds=False,
+                        requests_to_pause=None, **kwargs)
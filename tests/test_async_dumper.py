@@ -0,0 +1,127 @@
+import asyncio
+
+from unittest import IsolatedAsyncioTestCase, skipUnless
+
+from wmsdump.async_dumper import AsyncOGCServiceDumper, httpx_available
+from wmsdump.state import Extent
+
+from fake_wfs import FakeWFS, get_dumper, get_state
+
+if httpx_available:
+    import httpx
+
+
+class MockWFS:
+    """
+    Serves a FakeWFS through a httpx.MockTransport, errors can be queued up
+    to be raised for the next requests and requests can be held back.
+    """
+    def __init__(self, wfs):
+        self.wfs = wfs
+        self.errors = []
+        self.held_after = None
+        self.release = asyncio.Event()
+        self.num_requests = 0
+
+    async def handle(self, request):
+        self.num_requests += 1
+        if self.held_after is not None and self.num_requests > self.held_after:
+            await self.release.wait()
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return httpx.Response(200, content=self.wfs.get_body(dict(request.url.params)))
+
+    def get_client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+
+@skipUnless(httpx_available, 'httpx not installed')
+class TestAsyncDumper(IsolatedAsyncioTestCase):
+    def dump_sync(self, wfs, mode='EXTENT', **kwargs):
+        records = []
+        for feature in get_dumper(wfs, get_state(mode), records, mode=mode, batch_size=10, **kwargs):
+            records.append(feature)
+        return records
+
+    async def dump(self, server, mode='EXTENT', **kwargs):
+        records = []
+        async with server.get_client() as client:
+            dumper = get_dumper(client, get_state(mode), records, mode=mode, batch_size=10,
+                                dumper_class=AsyncOGCServiceDumper, **kwargs)
+            async for feature in dumper:
+                records.append(feature)
+        return records, dumper
+
+    async def test_extent(self):
+        expected = self.dump_sync(FakeWFS(300))
+        for concurrency in [ 1, 4 ]:
+            records, dumper = await self.dump(MockWFS(FakeWFS(300)), concurrency=concurrency)
+            self.assertEqual(records, expected)
+            self.assertEqual(dumper.state.explored_tree, { '0': Extent.EXPLORED.value })
+
+    async def test_offset(self):
+        wfs = FakeWFS(95)
+        for concurrency in [ 1, 3 ]:
+            records, dumper = await self.dump(MockWFS(wfs), mode='OFFSET', concurrency=concurrency)
+            self.assertEqual(records, wfs.features)
+            self.assertEqual(dumper.state.downloaded_count, 95)
+
+    async def test_tile_paging(self):
+        expected = self.dump_sync(FakeWFS(300), tile_depth=1)
+        records, dumper = await self.dump(MockWFS(FakeWFS(300)), tile_depth=1, concurrency=3)
+        self.assertEqual(records, expected)
+        self.assertEqual(dumper.state.tile_index, {})
+
+    async def test_early_exit(self):
+        server = MockWFS(FakeWFS(300))
+        # the first child comes back, the rest stay on the wire
+        server.held_after = 2
+        tasks = {}
+        def track_prefetch(dumper):
+            prefetch_envelope = dumper.prefetch_envelope
+            def prefetch(envelope, key):
+                tasks[key] = prefetch_envelope(envelope, key)
+                return tasks[key]
+            dumper.prefetch_envelope = prefetch
+
+        async with server.get_client() as client:
+            records = []
+            dumper = get_dumper(client, get_state(), records, batch_size=10, concurrency=2,
+                                dumper_class=AsyncOGCServiceDumper)
+            track_prefetch(dumper)
+            it = aiter(dumper)
+            async for feature in it:
+                records.append(feature)
+                if len(records) == 15:
+                    break
+            await it.aclose()
+
+        self.assertIsNone(dumper.tasks)
+        self.assertEqual(sorted(tasks.keys()), [ '00', '01', '02', '03' ])
+        self.assertFalse(tasks['00'].cancelled())
+        self.assertTrue(all(tasks[k].cancelled() for k in [ '01', '02', '03' ]))
+
+    async def test_transport_errors(self):
+        wfs = FakeWFS(50)
+        server = MockWFS(wfs)
+        server.errors = [ httpx.ConnectError('refused'), httpx.ReadError('reset') ]
+        records, _ = await self.dump(server, mode='OFFSET', retry_delay=0)
+        self.assertEqual(records, wfs.features)
+        self.assertEqual(server.num_requests, 8)
+
+        server = MockWFS(wfs)
+        server.errors = [ httpx.ConnectError('refused') ]
+        with self.assertRaises(httpx.ConnectError):
+            await self.dump(server, mode='OFFSET', retry_delay=0, max_attempts=1)
+
+    async def test_timeouts(self):
+        wfs = FakeWFS(50)
+        server = MockWFS(wfs)
+        server.errors = [ httpx.ReadTimeout('timed out') ]
+        records, dumper = await self.dump(server, mode='OFFSET', adaptive_batch_size=True,
+                                          min_batch_size=1, retry_delay=0)
+        self.assertEqual(records, wfs.features)
+        # shrunk on the timeout instead of retrying with the same count
+        self.assertEqual(dumper.sizer.failed_size, 10)
+        self.assertFalse(dumper.is_overload_error(httpx.ConnectError('refused')))
+        self.assertFalse(dumper.is_retryable_error(ValueError('bad')))
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from wmsdump.batch_sizer import BatchSizer
+
+class TestBatchSizer(TestCase):
+    def test_grows_on_fast_full_responses(self):
+        sizer = BatchSizer(1000, max_size=3000, confirmed=1000)
+        sizer.update(1000, 1000, 0.1)
+        self.assertEqual(sizer.size, 2000)
+        sizer.update(2000, 2000, 0.1)
+        self.assertEqual(sizer.size, 3000)
+
+    def test_no_growth_on_partial_responses(self):
+        sizer = BatchSizer(1000, max_size=3000, confirmed=1000)
+        sizer.update(1000, 10, 0.1)
+        self.assertEqual(sizer.size, 1000)
+
+    def test_shrinks_on_slow_responses(self):
+        sizer = BatchSizer(1000, min_size=100, target_latency=10, confirmed=1000)
+        sizer.update(1000, 1000, 20)
+        self.assertEqual(sizer.size, 750)
+
+    def test_shrink_on_failure(self):
+        sizer = BatchSizer(1000, min_size=300, confirmed=1000)
+        self.assertTrue(sizer.shrink(1000))
+        self.assertEqual(sizer.size, 500)
+        self.assertTrue(sizer.shrink(500))
+        self.assertEqual(sizer.size, 300)
+        self.assertFalse(sizer.shrink(300))
+        self.assertEqual(sizer.size, 300)
+
+    def test_growth_backs_off_from_failed_size(self):
+        sizer = BatchSizer(2000, confirmed=1000)
+        sizer.shrink(4000)
+        sizer.update(2000, 2000, 0.1)
+        self.assertEqual(sizer.size, 3000)
+
+    def test_saturation(self):
+        sizer = BatchSizer(1000, confirmed=1000)
+        self.assertTrue(sizer.is_saturated(1000, 1000))
+        self.assertFalse(sizer.is_saturated(1000, 999))
+
+    def test_cap_discovery(self):
+        sizer = BatchSizer(4000, confirmed=1000)
+        # ambiguous short responses are treated as full ones
+        self.assertTrue(sizer.is_saturated(4000, 1500))
+        self.assertIsNone(sizer.cap)
+        self.assertTrue(sizer.is_saturated(4000, 1500))
+        self.assertEqual(sizer.cap, 1500)
+        self.assertEqual(sizer.size, 1500)
+        self.assertFalse(sizer.is_saturated(1500, 20))
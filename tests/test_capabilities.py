@@ -3,7 +3,7 @@ import json
 from unittest import TestCase
 from pathlib import Path
 
-from wmsdump.capabilities import parse_capabilities
+from wmsdump.capabilities import parse_capabilities, CapabilitiesStreamParser
 from wmsdump.errors import WFSUnsupportedException, ServiceUnsupportedException
 
 class TestCapabilitiesParsing(TestCase):
@@ -85,3 +85,50 @@ class TestCapabilitiesParsing(TestCase):
 
         self.assertEqual(layer_list, [])
         self.assertEqual(service_info, {})
+
+    def test_wms_layer_info(self):
+        xml_txt = self.load_file('wms_capabilities.xml')
+
+        layer_info = {}
+        parse_capabilities('WMS', xml_txt, [], {}, layer_info)
+
+        bbox = [75.7645672614297, 30.860929930096614, 75.85453161674644, 30.944523331791164]
+        self.assertEqual(list(layer_info.keys()), ['nuis:AND_PB_UL10K', 'nuis:zoned_26june2014'])
+        self.assertEqual(layer_info['nuis:zoned_26june2014'], {
+            'title': 'zoned_26june2014',
+            'crs': ['EPSG:4326'],
+            'bbox': bbox,
+            'bboxes': [{ 'crs': 'EPSG:4326', 'bbox': bbox }],
+            'queryable': True,
+        })
+
+    def test_wfs_layer_info(self):
+        expected = self.load_json_file('wfs_capabilities.json')
+        xml_txt = self.load_file('wfs_capabilities.xml')
+
+        layer_info = {}
+        parse_capabilities('WFS', xml_txt, [], {}, layer_info)
+
+        self.assertEqual(list(layer_info.keys()), expected['layer_list'])
+        self.assertEqual(layer_info['cite:4_c'], {
+            'title': '004_c',
+            'crs': ['EPSG:4326'],
+            'bbox': [75.3555145263672, 32.8527717590332, 77.5539398193359, 35.0416717529297],
+            'bboxes': [],
+            'queryable': True,
+        })
+
+    def test_capabilities_chunked(self):
+        expected = self.load_json_file('wms_capabilities_sax_cleanup_bug.json')
+        data = self.load_file('wms_capabilities_sax_cleanup_bug.xml').encode('utf-8')
+
+        for chunk_size in [1, 100, len(data)]:
+            layer_list = []
+            service_info = {}
+            parser = CapabilitiesStreamParser('WMS', layer_list, service_info)
+            for i in range(0, len(data), chunk_size):
+                parser.feed(data[i:i + chunk_size])
+            parser.close()
+
+            self.assertEqual(layer_list, expected['layer_list'])
+            self.assertEqual(service_info, expected['service_info'])
@@ -0,0 +1,70 @@
+import threading
+
+from unittest import TestCase
+
+from fake_wfs import FakeWFS, get_dumper, get_state, round_trip
+
+
+class TestConcurrentExtent(TestCase):
+    def dump(self, session, concurrency, state=None, records=None, stop_after=None):
+        # returns the records along with the explored tree as it was at each of them
+        if state is None:
+            state = get_state()
+        if records is None:
+            records = []
+        trees = []
+        dumper = get_dumper(session, state, records, batch_size=10, concurrency=concurrency)
+        it = iter(dumper)
+        for feature in it:
+            records.append(feature)
+            trees.append(dict(state.explored_tree))
+            if stop_after is not None and len(records) >= stop_after:
+                it.close()
+                break
+        return records, trees, dumper
+
+    def test_same_as_sequential(self):
+        expected, expected_trees, _ = self.dump(FakeWFS(300), 1)
+        self.assertEqual(len(expected), 300)
+        for concurrency in [ 2, 4 ]:
+            records, trees, _ = self.dump(FakeWFS(300), concurrency)
+            self.assertEqual(records, expected)
+            self.assertEqual(trees, expected_trees)
+
+    def test_resume(self):
+        expected, _, _ = self.dump(FakeWFS(300), 1)
+
+        session = FakeWFS(300)
+        records, _, dumper = self.dump(session, 4, stop_after=55)
+        self.assertEqual(records, expected[:55])
+        # prefetched envelopes which weren't walked yet are fetched again
+        records, _, _ = self.dump(session, 4, state=round_trip(dumper.state, records), records=records)
+        self.assertEqual(records, expected)
+
+    def test_close(self):
+        session = FakeWFS(300)
+        # the first child comes back, the next two stay on the wire
+        session.hold_after(2)
+        futures = {}
+        records = []
+        dumper = get_dumper(session, get_state(), records, batch_size=10, concurrency=2)
+        prefetch_envelope = dumper.prefetch_envelope
+        def track_prefetch(envelope, key):
+            futures[key] = prefetch_envelope(envelope, key)
+            return futures[key]
+        dumper.prefetch_envelope = track_prefetch
+
+        it = iter(dumper)
+        for feature in it:
+            records.append(feature)
+            # into the first child, with the last one queued up behind the held requests
+            if len(records) == 15:
+                break
+        threading.Timer(0.1, session.release.set).start()
+        it.close()
+
+        self.assertIsNone(dumper.executor)
+        self.assertTrue(futures['03'].cancelled())
+        self.assertTrue(all(future.done() for future in futures.values()))
+        # the children after the first may not even have gone out
+        self.assertLessEqual(len(session.requests), 4)
@@ -0,0 +1,243 @@
+import tempfile
+
+from pathlib import Path
+from unittest import TestCase
+
+from wmsdump.cli import FileWriter
+from wmsdump.dedup_helper import DigestIndex, MIN_CAPACITY, get_dedup_path
+from wmsdump.state import Extent, get_state_from_files, get_state_path, get_key_str
+from wmsdump.state_db import get_state_from_db
+
+PARAMS = {
+    'url': 'http://localhost/ows',
+    'layername': 'a',
+    'service': 'WFS',
+    'version': '1.0.0',
+    'operation': 'GetFeature',
+    'sort_key': None,
+}
+
+def make_feature(i):
+    return { 'type': 'Feature', 'id': f'a.{i}', 'properties': { 'i': i }, 'geometry': None }
+
+
+class TestDigestIndex(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'out.geojsonl.dedup'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reopen(self):
+        index = DigestIndex(self.path)
+        count = MIN_CAPACITY
+        digests = [ index.hash(f'line {i}') for i in range(count) ]
+        for i, digest in enumerate(digests):
+            index.add(digest, i)
+        self.assertEqual(index.get(digests[10]), [ 10 ])
+        # nothing reaches the file before the sync
+        self.assertFalse(self.path.exists())
+        index.sync(count, 1000)
+        self.assertGreater(index.capacity, MIN_CAPACITY)
+        index.add(digests[0], count)
+        index.close()
+
+        index = DigestIndex(self.path)
+        self.assertEqual((index.lines, index.size), (count, 1000))
+        self.assertEqual(index.get(digests[0]), [ 0 ])
+        self.assertEqual(index.get(digests[count - 1]), [ count - 1 ])
+        self.assertEqual(index.get(index.hash('missing')), [])
+        index.remove()
+        self.assertFalse(self.path.exists())
+
+    def test_invalid(self):
+        self.path.write_bytes(b'not an index')
+        with self.assertLogs('wmsdump.dedup_helper', level='WARNING'):
+            index = DigestIndex(self.path)
+        self.assertEqual(index.lines, 0)
+        index.add(index.hash('a'), 0)
+        index.sync(1, 2)
+        index.close()
+        self.assertEqual(DigestIndex(self.path).get(index.hash('a')), [ 0 ])
+
+
+class TestExtentDedup(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = Path(self.tmp_dir.name) / 'out.geojsonl'
+        self.state_file = Path(self.tmp_dir.name) / 'out.geojsonl.state'
+        self.dedup_file = get_dedup_path(self.output_file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_state(self, verify_dedup=False, **params):
+        state = get_state_from_files(str(self.state_file), str(self.output_file),
+                                     mode='EXTENT', **PARAMS, **params)
+        if state is None:
+            return None, None
+        state.verify_dedup = verify_dedup
+        writer = FileWriter(self.output_file, verify_dedup, state.encode_backend)
+        state.store.flush_output = writer.flush
+        state.get_nth = writer.get
+        return state, writer
+
+    def add_features(self, state, writer, idxs):
+        added = []
+        for i in idxs:
+            feature = make_feature(i)
+            if state.add_feature(feature):
+                writer.write(feature, state.get_encoded(feature))
+                added.append(i)
+        return added
+
+    def close(self, state, writer):
+        writer.close()
+        state.store.close()
+
+    def test_resume(self):
+        state, writer = self.get_state()
+        state.update_coverage('0', Extent.OPEN)
+        self.assertEqual(self.add_features(state, writer, [ 0, 1, 2, 1 ]), [ 0, 1, 2 ])
+        state.update_coverage('00', Extent.EXPLORED)
+        self.add_features(state, writer, [ 3 ])
+        self.close(state, writer)
+        self.assertEqual(DigestIndex(self.dedup_file).lines, 4)
+
+        # written by a run which stopped before syncing the index
+        writer = FileWriter(self.output_file, False, state.encode_backend)
+        writer.write(make_feature(9))
+        writer.close()
+
+        state, writer = self.get_state()
+        self.assertEqual(state.current_count, 5)
+        self.assertEqual(self.add_features(state, writer, [ 9, 3, 4 ]), [ 4 ])
+        self.close(state, writer)
+        self.assertEqual(len(self.output_file.read_text().splitlines()), 6)
+
+        state, writer = self.get_state()
+        writer.close()
+        state.store.remove()
+        self.assertFalse(self.dedup_file.exists())
+
+    def test_mismatched_index(self):
+        state, writer = self.get_state()
+        state.update_coverage('0', Extent.OPEN)
+        self.add_features(state, writer, range(4))
+        self.close(state, writer)
+
+        # the output cut short after the index was synced
+        lines = self.output_file.read_text().splitlines(keepends=True)
+        self.output_file.write_text(''.join(lines[:2]) + lines[2][:5])
+
+        with self.assertLogs('wmsdump.state', level='WARNING'):
+            state, writer = self.get_state()
+        self.assertEqual(state.current_count, 2)
+        self.assertEqual(self.add_features(state, writer, range(4)), [ 2, 3 ])
+        self.close(state, writer)
+        self.assertEqual(DigestIndex(self.dedup_file).lines, 4)
+
+    def test_verify(self):
+        state, writer = self.get_state(verify_dedup=True)
+        state.update_coverage('0', Extent.OPEN)
+        self.add_features(state, writer, range(3))
+        # a different line under the digest of an existing one
+        digest = state.done.hash(state.encode_feature(make_feature(5)))
+        state.done.add(digest, 0)
+        self.assertEqual(self.add_features(state, writer, [ 5, 1 ]), [ 5 ])
+
+        state.verify_dedup = False
+        self.assertEqual(self.add_features(state, writer, [ 5, 6 ]), [ 6 ])
+        self.close(state, writer)
+
+
+def make_moved(i, props=None):
+    feature = make_feature(i)
+    feature['geometry'] = { 'type': 'Point', 'coordinates': [ i, i ] }
+    if props is not None:
+        feature['properties'] = props
+    return feature
+
+
+class TestDedupKey(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = Path(self.tmp_dir.name) / 'out.geojsonl'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_state(self, backend='json', verify_dedup=False, **params):
+        get_state_from = get_state_from_db if backend == 'sqlite' else get_state_from_files
+        state = get_state_from(get_state_path(self.output_file, backend), str(self.output_file),
+                               mode='EXTENT', **PARAMS, **params)
+        if state is None:
+            return None, None
+        state.verify_dedup = verify_dedup
+        writer = FileWriter(self.output_file, True, state.encode_backend, state.store.line_offsets)
+        state.store.flush_output = writer.flush
+        state.get_nth = writer.get
+        return state, writer
+
+    def close(self, state, writer):
+        writer.close()
+        state.store.close()
+
+    def add(self, state, writer, features):
+        added = 0
+        for feature in features:
+            if state.add_feature(feature):
+                writer.write(feature, state.get_encoded(feature))
+                added += 1
+        return added
+
+    def test_key_str(self):
+        feature = make_feature(1)
+        self.assertEqual(get_key_str(feature, 'id'), "id='a.1'")
+        self.assertEqual(get_key_str(feature, 'i'), 'i=1')
+        self.assertIsNone(get_key_str(feature, 'missing'))
+        self.assertIsNone(get_key_str({ 'type': 'Feature', 'properties': None }, 'i'))
+
+    def test_by_id(self):
+        state, writer = self.get_state(dedup_key='id')
+        state.update_coverage('0', Extent.OPEN)
+        self.assertEqual(self.add(state, writer, [ make_feature(1), make_moved(1), make_moved(2) ]), 2)
+        # without an id, compared by their contents
+        no_id = make_feature(3)
+        del no_id['id']
+        self.assertEqual(self.add(state, writer, [ no_id, dict(no_id), make_moved(3) ]), 2)
+        self.assertEqual(state.key_duplicates, 1)
+        self.close(state, writer)
+
+        writer = FileWriter(self.output_file, False, state.encode_backend)
+        writer.write(make_feature(4))
+        writer.close()
+
+        # the key in use goes with the extraction
+        self.assertEqual(self.get_state(), (None, None))
+        state, writer = self.get_state(dedup_key='id')
+        self.assertEqual(state.dedup_key, 'id')
+        self.assertEqual(state.current_count, 5)
+        self.assertEqual(self.add(state, writer, [ make_moved(4), no_id, make_moved(2), make_moved(5) ]), 1)
+        self.close(state, writer)
+
+    def test_by_property(self):
+        state, writer = self.get_state(verify_dedup=True, dedup_key='i')
+        state.update_coverage('0', Extent.OPEN)
+        features = [ make_moved(1), make_moved(2, { 'i': 1 }), make_moved(3, { 'i': 'x' }) ]
+        self.assertEqual(self.add(state, writer, features), 2)
+        # read back and compared
+        self.assertEqual(self.add(state, writer, [ make_moved(4, { 'i': 'x' }) ]), 0)
+        self.close(state, writer)
+
+    def test_db(self):
+        state, writer = self.get_state('sqlite', dedup_key='id')
+        state.update_coverage('0', Extent.OPEN)
+        self.assertEqual(self.add(state, writer, [ make_feature(1), make_moved(1), make_moved(2) ]), 2)
+        self.close(state, writer)
+
+        state, writer = self.get_state('sqlite', dedup_key='id')
+        self.assertEqual(self.add(state, writer, [ make_moved(2), make_moved(3) ]), 1)
+        self.close(state, writer)
+        self.assertEqual(self.get_state('sqlite'), (None, None))
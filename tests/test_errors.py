@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+import requests
+
+from wmsdump.errors import (
+    is_retryable, check_error_msg, RequestFailedException,
+    LayerMissingException, ZeroAreaException, UnknownServiceException
+)
+
+class TestRetryClassification(TestCase):
+    def test_known_exceptions(self):
+        self.assertFalse(is_retryable(LayerMissingException()))
+        self.assertFalse(is_retryable(ZeroAreaException()))
+
+    def test_status_codes(self):
+        for code in [ 408, 429, 500, 502, 503, 504 ]:
+            self.assertTrue(is_retryable(RequestFailedException(code, '')))
+        for code in [ 400, 401, 403, 404, 501 ]:
+            self.assertFalse(is_retryable(RequestFailedException(code, '')))
+
+    def test_network_errors(self):
+        self.assertTrue(is_retryable(requests.exceptions.ConnectionError()))
+        self.assertTrue(is_retryable(requests.exceptions.Timeout()))
+
+    def test_parse_errors(self):
+        self.assertFalse(is_retryable(ValueError('bad json')))
+
+    def test_unmapped_service_exceptions(self):
+        with self.assertRaises(LayerMissingException) as cm:
+            check_error_msg('Could not find layer a')
+        self.assertFalse(is_retryable(cm.exception))
+
+        # the server having trouble of its own, reported in a 200 response
+        with self.assertRaises(UnknownServiceException) as cm:
+            check_error_msg('java.sql.SQLException: canceling statement due to statement timeout')
+        self.assertTrue(is_retryable(cm.exception))
@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from wmsdump.state import ExtentState, Extent, TREE_VERSION, validate_state_dict
+
+PARAMS = {
+    'url': 'http://localhost/ows',
+    'layername': 'a',
+    'service': 'WFS',
+    'version': '1.0.0',
+    'operation': 'GetFeature',
+}
+
+OPEN = Extent.OPEN.value
+EXPLORED = Extent.EXPLORED.value
+
+
+def walk(state, key, depth, sizes):
+    # depth first, the way the dumpers go over the bounds
+    if depth == 0:
+        state.update_coverage(key, Extent.EXPLORED)
+        sizes.append(len(state.explored_tree))
+        return
+    state.update_coverage(key, Extent.OPEN, split_point=[0.5, 0.5])
+    for i in range(4):
+        walk(state, f'{key}{i}', depth - 1, sizes)
+    state.update_coverage(key, Extent.EXPLORED)
+
+
+class TestExploredTree(TestCase):
+    def test_collapsed(self):
+        state = ExtentState(tree_version=TREE_VERSION, **PARAMS)
+        sizes = []
+        walk(state, '0', 5, sizes)
+        self.assertEqual(len(sizes), 4 ** 5)
+        # the open path and the explored siblings along it
+        self.assertLessEqual(max(sizes), 1 + 4 * 5)
+        self.assertEqual(state.explored_tree, { '0': EXPLORED })
+        self.assertEqual(state.split_points, {})
+
+    def test_partial(self):
+        state = ExtentState(tree_version=TREE_VERSION, **PARAMS)
+        state.update_coverage('0', Extent.OPEN, split_point=[1.0, 1.0])
+        state.update_coverage('00', Extent.EXPLORED)
+        state.update_coverage('01', Extent.OPEN, tile_index=10)
+        state.update_coverage('010', Extent.EXPLORED)
+        state.update_coverage('011', Extent.OPEN)
+        self.assertEqual(state.explored_tree, { '0': OPEN, '00': EXPLORED, '01': OPEN,
+                                                '010': EXPLORED, '011': OPEN })
+
+        state.update_coverage('011', Extent.EXPLORED)
+        state.update_coverage('01', Extent.EXPLORED)
+        self.assertEqual(state.explored_tree, { '0': OPEN, '00': EXPLORED, '01': EXPLORED })
+        self.assertEqual(state.split_points, { '0': [1.0, 1.0] })
+        self.assertEqual(state.tile_index, {})
+
+    def test_old_tree(self):
+        explored_tree = {
+            '0': OPEN,
+            '00': EXPLORED, '000': EXPLORED, '001': EXPLORED, '0010': EXPLORED,
+            '01': OPEN, '010': EXPLORED, '011': OPEN,
+        }
+        split_points = { '0': [1.0, 1.0], '00': [2.0, 2.0], '001': [3.0, 3.0], '01': [4.0, 4.0] }
+        state = ExtentState(explored_tree=explored_tree, split_points=split_points, **PARAMS)
+        self.assertEqual(state.explored_tree, { '0': OPEN, '00': EXPLORED, '01': OPEN,
+                                                '010': EXPLORED, '011': OPEN })
+        self.assertEqual(state.split_points, { '0': [1.0, 1.0], '01': [4.0, 4.0] })
+
+        state_data = state.get_dict()
+        self.assertEqual(state_data['tree_version'], TREE_VERSION)
+        self.assertEqual(validate_state_dict(state_data), (True, None))
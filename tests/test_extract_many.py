@@ -0,0 +1,77 @@
+import logging
+import tempfile
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from unittest import TestCase
+from urllib.parse import urlparse, parse_qsl
+
+from click.testing import CliRunner
+
+from wmsdump.cli import main
+
+from fake_wfs import FakeWFS
+
+LAYER_MISSING = (Path(__file__).parent / 'samples' / 'layer_missing.xml').read_bytes()
+
+
+def serve_layers(layers):
+    # a WFS on localhost serving the FakeWFS layers by name
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            params = dict(parse_qsl(urlparse(self.path).query))
+            wfs = layers.get(params.get('typeName', None), None)
+            body = LAYER_MISSING if wfs is None else wfs.get_body(params)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestExtractMany(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.layers = { 'ws:a': FakeWFS(50, seed=1), 'b': FakeWFS(30, seed=2) }
+        self.server = serve_layers(self.layers)
+        # the command sets up logging on the root logger
+        root = logging.getLogger()
+        self.root_state = (root.level, list(root.handlers))
+
+    def tearDown(self):
+        root = logging.getLogger()
+        root.setLevel(self.root_state[0])
+        root.handlers = self.root_state[1]
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_layers(self):
+        tmp_path = Path(self.tmp_dir.name)
+        layer_list = tmp_path / 'layers.txt'
+        layer_list.write_text('# layers to extract\nws:a\n\nmissing\nb\n')
+        output_dir = tmp_path / 'out'
+        url = f'http://127.0.0.1:{self.server.server_port}/ows'
+
+        with self.assertLogs('wmsdump.cli', level='INFO') as logs:
+            result = CliRunner().invoke(main, [ 'extract-many', str(layer_list),
+                                                '-u', url, '-d', str(output_dir), '-m', 'EXTENT',
+                                                '--no-layer-bounds', '-b', '10', '-c', '2', '-w', '2',
+                                                '--pause-seconds', '0' ])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        for name, fname in [ ('ws:a', 'ws_a.geojsonl'), ('b', 'b.geojsonl') ]:
+            lines = (output_dir / fname).read_text().splitlines()
+            self.assertEqual(len(lines), len(self.layers[name].features))
+            self.assertFalse((output_dir / f'{fname}.state').exists())
+
+        # the missing layer doesn't hold up the others
+        self.assertIn('INFO:wmsdump.cli:extracted 2 of 3 layers', logs.output)
+        self.assertIn('ERROR:wmsdump.cli:incomplete: missing', logs.output)
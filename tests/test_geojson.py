@@ -0,0 +1,71 @@
+import json
+
+from unittest import TestCase
+from pathlib import Path
+
+from wmsdump.geojson_helper import GeoJSONStreamParser
+from wmsdump.errors import handle_error_xml, LayerMissingException
+
+FEATURES = [
+    { 'type': 'Feature', 'id': 'l.1',
+      'geometry': { 'type': 'Point', 'coordinates': [77.5, 12.9] },
+      'properties': { 'name': 'has "quotes", {braces} and [brackets] \\ ü' } },
+    { 'type': 'Feature', 'id': 'l.2',
+      'geometry': { 'type': 'LineString', 'coordinates': [[1.0, 2.0], [3.0, 4.0]] },
+      'properties': { 'note': ',{"type":"Feature"', 'nested': { 'features': [] } } },
+    { 'type': 'Feature', 'id': 'l.3', 'geometry': None, 'properties': {} },
+]
+
+def not_expected(data):
+    raise AssertionError('fallback not expected')
+
+def parse(data, chunk_size, fallback_fn=not_expected):
+    parser = GeoJSONStreamParser(fallback_fn)
+    feats = []
+    for i in range(0, len(data), chunk_size):
+        feats.extend(parser.feed(data[i:i + chunk_size]))
+    feats.extend(parser.close())
+    return feats
+
+
+class TestGeoJSONStreamParsing(TestCase):
+    def check(self, doc, **kwargs):
+        data = json.dumps(doc, **kwargs).encode('utf-8')
+        for chunk_size in [ 1, 3, 16, len(data) ]:
+            self.assertEqual(parse(data, chunk_size), doc['features'])
+
+    def test_compact(self):
+        doc = { 'type': 'FeatureCollection', 'features': FEATURES, 'totalFeatures': 3 }
+        self.check(doc, separators=(',', ':'), ensure_ascii=False)
+
+    def test_spaced(self):
+        doc = { 'type': 'FeatureCollection', 'features': FEATURES }
+        self.check(doc)
+
+    def test_indented(self):
+        doc = { 'type': 'FeatureCollection', 'features': FEATURES }
+        self.check(doc, indent=2)
+
+    def test_features_after_other_keys(self):
+        doc = { 'type': 'FeatureCollection',
+                'crs': { 'type': 'name', 'properties': { 'features': 'not these' } },
+                'name': 'features',
+                'features': FEATURES }
+        self.check(doc)
+
+    def test_no_features(self):
+        self.check({ 'type': 'FeatureCollection', 'features': [] })
+
+        with self.assertRaises(Exception):
+            parse(b'{"type": "FeatureCollection"}', 4)
+
+    def test_truncated(self):
+        data = json.dumps({ 'type': 'FeatureCollection', 'features': FEATURES }).encode('utf-8')
+        with self.assertRaises(Exception):
+            parse(data[:-30], 16)
+
+    def test_exception_report(self):
+        script_dir = Path(__file__).parent
+        data = (script_dir / 'samples' / 'layer_missing.xml').read_bytes()
+        with self.assertRaises(LayerMissingException):
+            parse(data, 16, fallback_fn=handle_error_xml)
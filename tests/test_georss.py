@@ -1,9 +1,12 @@
 import json
 
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 from pathlib import Path
 
-from wmsdump.georss_helper import georss_extract_features
+from wmsdump.georss_helper import (
+    georss_extract_features, GeoRSSStreamParser,
+    get_points_py, get_points_np, numpy_available
+)
 from wmsdump.errors import (
     LayerMissingException, GeoRSSUnsupportedException,
     SortKeyRequiredException
@@ -64,3 +67,26 @@ class TestGeorssParsing(TestCase):
 
     def test_merge_polygons(self):
         self.match_output('georss_merge_polygons.xml', 'georss_merge_polygons.geojsonl')
+
+    def test_merge_polygons_chunked(self):
+        data = self.load_file('georss_merge_polygons.xml').encode('utf-8')
+        expected = self.load_jsonl_file('georss_merge_polygons.geojsonl')
+        for chunk_size in [1, 3, 16, len(data)]:
+            parser = GeoRSSStreamParser()
+            feats = []
+            for i in range(0, len(data), chunk_size):
+                feats.extend(parser.feed(data[i:i + chunk_size]))
+            feats.extend(parser.close())
+            self.assertEqual(feats, expected)
+
+    def test_points_py(self):
+        self.assertEqual(get_points_py('10.5 77.25 11 78 12'), [[77.25, 10.5], [78.0, 11.0]])
+        with self.assertRaises(ValueError):
+            get_points_py('10.5  77.25')
+
+    @skipUnless(numpy_available, 'numpy not installed')
+    def test_points_np(self):
+        vals = '10.5 77.25 11 78 -0.1 1e-05 12'
+        self.assertEqual(get_points_np(vals), get_points_py(vals))
+        with self.assertRaises(ValueError):
+            get_points_np('10.5  77.25')
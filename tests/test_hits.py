@@ -0,0 +1,60 @@
+from unittest import TestCase
+from pathlib import Path
+
+from wmsdump.hits_helper import get_hits_count, supports_hits
+from wmsdump.dumper import OGCServiceDumper
+from wmsdump.state import ExtentState
+from wmsdump.errors import LayerMissingException
+
+
+class TestHitsParsing(TestCase):
+    def load_file(self, fname):
+        script_dir = Path(__file__).parent
+        file = script_dir / 'samples' / fname
+        return file.read_text()
+
+    def test_wfs_1_1_0(self):
+        xml_txt = '<?xml version="1.0" encoding="UTF-8"?>' \
+                  '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" ' \
+                  'numberOfFeatures="1234" timeStamp="2024-01-01T00:00:00.000Z"/>'
+        self.assertEqual(get_hits_count(xml_txt), 1234)
+
+    def test_wfs_2_0_0(self):
+        xml_txt = '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" ' \
+                  'numberMatched="56" numberReturned="0" timeStamp="2024-01-01T00:00:00.000Z"/>'
+        self.assertEqual(get_hits_count(xml_txt.encode('utf-8')), 56)
+
+    def test_unknown_count(self):
+        xml_txt = '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" ' \
+                  'numberMatched="unknown" numberReturned="0"/>'
+        self.assertIsNone(get_hits_count(xml_txt))
+
+    def test_no_count(self):
+        self.assertIsNone(get_hits_count('<FeatureCollection/>'))
+        self.assertIsNone(get_hits_count('{"type": "FeatureCollection"}'))
+
+    def test_layer_missing(self):
+        xml_txt = self.load_file('layer_missing.xml')
+        with self.assertRaises(LayerMissingException):
+            get_hits_count(xml_txt)
+
+
+class TestHitsVersion(TestCase):
+    def get_dumper(self, service_version):
+        state = ExtentState(url='http://localhost/ows', layername='a', service='WFS',
+                            version=service_version, operation='GetFeature')
+        return OGCServiceDumper('http://localhost/ows', 'a', 'WFS', service_version=service_version,
+                                retrieval_mode='EXTENT', probe_hits=True, layer_bounds=False,
+                                state=state, get_nth=lambda n: None)
+
+    def test_supported_versions(self):
+        self.assertFalse(supports_hits('1.0.0'))
+        self.assertTrue(supports_hits('1.1.0'))
+        self.assertTrue(supports_hits('2.0.0'))
+        self.assertFalse(supports_hits('latest'))
+
+    def test_probe_needs_version(self):
+        # resultType=hits would be ignored, and the features downloaded
+        with self.assertRaises(Exception):
+            self.get_dumper('1.0.0')
+        self.assertTrue(self.get_dumper('2.0.0').probe_hits)
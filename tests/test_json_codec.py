@@ -0,0 +1,75 @@
+import os
+import json
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from wmsdump import json_codec
+from wmsdump.state import ExtentState, State
+
+FEATURE = {
+    'type': 'Feature',
+    'geometry': { 'type': 'Point', 'coordinates': [77.123456789, 1e-07] },
+    'properties': { 'name': 'café', 'id': 12 }
+}
+
+
+class TestJSONCodec(TestCase):
+    def test_stdlib_matches_json(self):
+        self.assertEqual(json_codec.dumps(FEATURE, 'json'), json.dumps(FEATURE))
+        self.assertEqual(json_codec.loads(json.dumps(FEATURE), 'json'), FEATURE)
+
+    @skipUnless(json_codec.orjson_available, 'orjson not installed')
+    def test_orjson_round_trip(self):
+        f_str = json_codec.dumps(FEATURE, 'orjson')
+        self.assertEqual(json_codec.loads(f_str, 'orjson'), FEATURE)
+        self.assertEqual(json_codec.loads(f_str.encode('utf-8'), 'orjson'), FEATURE)
+        self.assertEqual(json_codec.normalize(json.dumps(FEATURE), 'orjson'), f_str)
+
+    @skipUnless(json_codec.orjson_available, 'orjson not installed')
+    def test_orjson_falls_back(self):
+        big = { 'id': 2**70 }
+        self.assertEqual(json_codec.dumps(big, 'orjson'), json.dumps(big))
+        self.assertEqual(json_codec.loads(b'\xef\xbb\xbf{"a": 1}', 'orjson'), { 'a': 1 })
+        with self.assertRaises(ValueError):
+            json_codec.loads('<xml/>', 'orjson')
+
+    def test_dedup_across_backends(self):
+        # output written with one backend, resumed with the other
+        other = 'json' if json_codec.get_backend() == 'orjson' else 'orjson'
+        if not json_codec.is_available(other):
+            other = json_codec.get_backend()
+        lines = [ json_codec.dumps(FEATURE, other) ]
+
+        state = ExtentState(json_backend=other)
+        state.encode_backend = json_codec.get_backend()
+        state.normalize_lines = other != state.encode_backend
+        state.get_nth = lambda n: lines[n]
+        for line in lines:
+            state.add_raw_feature_no_dedup(line)
+
+        self.assertFalse(state.add_feature(dict(FEATURE)))
+        self.assertTrue(state.add_feature({ 'type': 'Feature', 'properties': {} }))
+
+    def test_invalid_env(self):
+        with patch.dict(os.environ, { json_codec.BACKEND_ENV_VAR: 'simplejson' }):
+            with self.assertLogs('wmsdump.json_codec', level='WARNING'):
+                self.assertEqual(json_codec.get_default_backend(), 'json')
+
+    @skipUnless(json_codec.orjson_available, 'orjson not installed')
+    def test_unavailable_backend(self):
+        # output written with orjson, resumed without it
+        state = ExtentState(json_backend='orjson')
+        with patch.object(json_codec, 'orjson_available', False), \
+             patch.object(json_codec, 'default_backend', 'json'):
+            with self.assertLogs('wmsdump.state', level='WARNING'):
+                state.check_json_backend()
+        self.assertEqual((state.json_backend, state.encode_backend), ('orjson', 'json'))
+        self.assertTrue(state.normalize_lines)
+        state_data = state.get_dict()
+        self.assertEqual(state_data['json_backend'], 'orjson')
+
+        # and resumed with it again, the lines written in between still need re-encoding
+        state = State.from_dict(**state_data)
+        state.check_json_backend()
+        self.assertEqual((state.json_backend, state.encode_backend), ('orjson', 'orjson'))
+        self.assertTrue(state.normalize_lines)
@@ -3,8 +3,9 @@ import json
 from unittest import TestCase
 from pathlib import Path
 
-from wmsdump.kml_helper import kml_extract_features
+from wmsdump.kml_helper import kml_extract_features, KMLStreamParser
 from wmsdump.errors import LayerMissingException, KMLUnsupportedException
+from wmsdump.parse_helper import PoolParser, create_parse_pool, parse_getmap_response
 
 
 class TestKMLParsing(TestCase):
@@ -42,6 +43,46 @@ class TestKMLParsing(TestCase):
     def test_kml_linestrings(self):
         self.match_output('kml_linestrings.xml', 'kml_linestrings.geojsonl')
 
+    def test_kml_bytes(self):
+        xml_txt = self.load_file('kml_points.xml')
+        feats = kml_extract_features(xml_txt.encode('utf-8'), True, False)
+        self.assertEqual(feats, self.load_jsonl_file('kml_points.geojsonl'))
+
+    def test_kml_chunked(self):
+        data = self.load_file('kml_one_multigeometry.xml').encode('utf-8')
+        expected = self.load_jsonl_file('kml_one_multigeometry.geojsonl')
+        for chunk_size in [1, 3, 16, len(data)]:
+            parser = KMLStreamParser(True, False)
+            feats = []
+            for i in range(0, len(data), chunk_size):
+                feats.extend(parser.feed(data[i:i + chunk_size]))
+            feats.extend(parser.close())
+            self.assertEqual(feats, expected)
+
+    def test_kml_split_char_ref(self):
+        data = b'<kml><Placemark><name>a &#12345; b</name>' + \
+               b'<Point><coordinates>1,2</coordinates></Point></Placemark></kml>'
+        parser = KMLStreamParser(True, False)
+        pos = data.index(b'&#12') + 4
+        feats = parser.feed(data[:pos])
+        feats.extend(parser.feed(data[pos:]))
+        feats.extend(parser.close())
+        self.assertEqual(feats[0]['properties'], { 'name': 'a [#12345;] b' })
+
+    def test_kml_parse_pool(self):
+        data = self.load_file('kml_points.xml').encode('utf-8')
+        missing = self.load_file('layer_missing.xml').encode('utf-8')
+        with create_parse_pool(1) as pool:
+            parser = PoolParser(pool, parse_getmap_response, 'KML', True, False)
+            for i in range(0, len(data), 100):
+                self.assertEqual(parser.feed(data[i:i + 100]), [])
+            self.assertEqual(parser.close(), self.load_jsonl_file('kml_points.geojsonl'))
+
+            parser = PoolParser(pool, parse_getmap_response, 'KML', True, False)
+            parser.feed(missing)
+            with self.assertRaises(LayerMissingException):
+                parser.close()
+
     def test_layer_missing(self):
         xml_txt = self.load_file('layer_missing.xml')
         with self.assertRaises(LayerMissingException):
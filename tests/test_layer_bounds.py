@@ -0,0 +1,103 @@
+from unittest import TestCase
+from pathlib import Path
+
+from wmsdump.capabilities import find_layer_info
+from wmsdump.dumper import OGCServiceDumper, get_layer_bounds, get_global_bounds
+from wmsdump.state import ExtentState, validate_state_dict
+
+LONLAT_BBOX = [77.0, 12.0, 77.5, 12.5]
+BOUNDS = { 'xmin': 1.0, 'ymin': 2.0, 'xmax': 3.0, 'ymax': 4.0 }
+
+
+class TestLayerBounds(TestCase):
+    def assertBoundsAlmostEqual(self, got, expected):
+        for k in [ 'xmin', 'ymin', 'xmax', 'ymax' ]:
+            self.assertAlmostEqual(got[k], expected[k], places=3)
+
+    def test_lonlat(self):
+        self.assertBoundsAlmostEqual(get_layer_bounds(LONLAT_BBOX, 'EPSG:4326'),
+                                     { 'xmin': 76.995, 'ymin': 11.995, 'xmax': 77.505, 'ymax': 12.505 })
+
+    def test_web_mercator(self):
+        bounds = get_layer_bounds(LONLAT_BBOX, 'EPSG:3857')
+        # 77, 12 and 77.5, 12.5 are at 8571600.791, 1345708.408 and 8627260.536, 1402665.190
+        self.assertBoundsAlmostEqual(bounds, { 'xmin': 8571044.194, 'ymin': 1345138.841,
+                                               'xmax': 8627817.134, 'ymax': 1403234.758 })
+
+    def test_clamped(self):
+        self.assertEqual(get_layer_bounds([-180, -90, 180, 90], 'EPSG:4326'),
+                         get_global_bounds('EPSG:4326'))
+
+    def test_single_point(self):
+        bounds = get_layer_bounds([77.0, 12.0, 77.0, 12.0], 'EPSG:4326')
+        self.assertLess(bounds['xmin'], 77.0)
+        self.assertGreater(bounds['ymax'], 12.0)
+
+    def test_unusable(self):
+        self.assertIsNone(get_layer_bounds(None, 'EPSG:4326'))
+        self.assertIsNone(get_layer_bounds([10, 0, 5, 1], 'EPSG:4326'))
+        self.assertIsNone(get_layer_bounds([float('nan'), 0, 5, 1], 'EPSG:4326'))
+
+    def test_find_layer_info(self):
+        layer_info = { 'ws:a': 1, 'b': 2, 'ws1:c': 3, 'ws2:c': 4 }
+        self.assertEqual(find_layer_info(layer_info, 'ws:a'), 1)
+        self.assertEqual(find_layer_info(layer_info, 'a'), 1)
+        self.assertEqual(find_layer_info(layer_info, 'ws:b'), 2)
+        self.assertIsNone(find_layer_info(layer_info, 'c'))
+        self.assertIsNone(find_layer_info(None, 'a'))
+
+
+class TestInitialBounds(TestCase):
+    def get_state(self, layername='a', **params):
+        return ExtentState(url='http://localhost/ows', layername=layername, service='WFS',
+                           version='1.0.0', operation='GetFeature', **params)
+
+    def get_dumper(self, state, bounds=None, layer_bounds=False, url='http://localhost/ows'):
+        return OGCServiceDumper(url, state.layername, 'WFS',
+                                retrieval_mode='EXTENT', layer_bounds=layer_bounds,
+                                state=state, bounds=bounds, get_nth=lambda n: None)
+
+    def test_recorded_in_state(self):
+        state = self.get_state()
+        self.get_dumper(state, bounds=BOUNDS)
+        self.assertEqual(state.bounds, BOUNDS)
+
+        state_data = state.get_dict()
+        self.assertEqual(validate_state_dict(state_data), (True, None))
+        state_data.pop('mode')
+        self.assertEqual(ExtentState(**state_data).bounds, BOUNDS)
+
+    def test_resume(self):
+        dumper = self.get_dumper(self.get_state(explored_tree={ '0': 1 }, bounds=BOUNDS))
+        self.assertEqual(dumper.initial_bounds, BOUNDS)
+
+        with self.assertRaises(Exception):
+            self.get_dumper(self.get_state(explored_tree={ '0': 1 }, bounds=BOUNDS),
+                            bounds=get_global_bounds('EPSG:4326'))
+
+    def test_resume_without_recorded_bounds(self):
+        # older state files started from the CRS bounds
+        dumper = self.get_dumper(self.get_state(explored_tree={ '0': 1 }))
+        self.assertEqual(dumper.initial_bounds, get_global_bounds('EPSG:4326'))
+
+    def test_looked_up_on_iteration(self):
+        xml_txt = (Path(__file__).parent / 'samples' / 'wfs_capabilities.xml').read_bytes()
+        requests_made = []
+        def make_request(params, get_parser, giveup=None):
+            requests_made.append(params['request'])
+            parser = get_parser()
+            parser.feed(xml_txt)
+            return parser.close()
+
+        state = self.get_state(layername='cite:4_c')
+        # dumpers sharing the endpoint share the download
+        dumpers = [ self.get_dumper(state, layer_bounds=True, url='http://localhost/lookup/ows')
+                    for _ in range(2) ]
+        for dumper in dumpers:
+            self.assertIsNone(dumper.initial_bounds)
+            dumper.make_request = make_request
+            dumper.lookup_initial_bounds()
+            self.assertEqual(dumper.initial_bounds, get_layer_bounds(
+                [75.3555145263672, 32.8527717590332, 77.5539398193359, 35.0416717529297], 'EPSG:4326'))
+        self.assertEqual(requests_made, [ 'GetCapabilities' ])
+        self.assertEqual(state.bounds, dumpers[0].initial_bounds)
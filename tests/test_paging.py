@@ -0,0 +1,92 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from wmsdump.state import State
+
+from fake_wfs import FakeWFS, get_dumper, get_state
+
+
+class TestIterPages(TestCase):
+    def dump(self, session, state=None, records=None, stop_after=None, **kwargs):
+        if state is None:
+            state = get_state('OFFSET')
+        if records is None:
+            records = []
+        dumper = get_dumper(session, state, records, mode='OFFSET', batch_size=10, **kwargs)
+        it = iter(dumper)
+        for feature in it:
+            records.append(feature)
+            if stop_after is not None and len(records) >= stop_after:
+                it.close()
+                break
+        return records, dumper
+
+    def test_window_reset(self):
+        dumper = get_dumper(FakeWFS(0), get_state('OFFSET'), [], mode='OFFSET',
+                            batch_size=10, concurrency=3)
+        def fetch_page(start_index):
+            # the batch size drops to 5 while the page at 20 is being fetched,
+            # after the ones past it went out 10 apart
+            if start_index < 20:
+                return 10, list(range(start_index, start_index + 10))
+            dumper.batch_size = 5
+            num_features = 2 if start_index >= 40 else 5
+            return 5, list(range(start_index, start_index + num_features))
+
+        with dumper.worker_pool():
+            pages = list(dumper.iter_pages(fetch_page, 0))
+
+        self.assertEqual([ (feats[0], advance) for feats, advance in pages ],
+                         [ (0, 10), (10, 10), (20, 5), (25, 5), (30, 5), (35, 5), (40, 5) ])
+        self.assertEqual(pages[-1][0], [ 40, 41 ])
+
+    def test_server_cap(self):
+        # the server caps responses at 15, which the batch size only learns once it grows past it
+        session = FakeWFS(100, max_features=15)
+        records, dumper = self.dump(session, concurrency=2, adaptive_batch_size=True,
+                                    min_batch_size=1, max_batch_size=40)
+        self.assertEqual(records, session.features)
+        self.assertEqual(dumper.state.downloaded_count, 100)
+
+    def test_cancel_after_short_page(self):
+        dumper = get_dumper(FakeWFS(0), get_state('OFFSET'), [], mode='OFFSET', batch_size=10)
+        # a single worker behind a window of three, so that the pages after
+        # the one being fetched are still queued
+        dumper.window = 3
+        dumper.executor = ThreadPoolExecutor(max_workers=1)
+        futures = {}
+        submit = dumper.executor.submit
+        def track_submit(fn, start_index):
+            futures[start_index] = submit(fn, start_index)
+            return futures[start_index]
+        dumper.executor.submit = track_submit
+
+        release = threading.Event()
+        def fetch_page(start_index):
+            if start_index == 20:
+                release.wait()
+            num_features = 5 if start_index == 10 else 10
+            return 10, list(range(start_index, start_index + num_features))
+
+        pages = list(dumper.iter_pages(fetch_page, 0))
+        release.set()
+        dumper.executor.shutdown(wait=True)
+
+        self.assertEqual(pages, [ (list(range(0, 10)), 10), (list(range(10, 15)), 10) ])
+        self.assertEqual(sorted(futures.keys()), [ 0, 10, 20, 30 ])
+        self.assertFalse(futures[20].cancelled())
+        self.assertTrue(futures[30].cancelled())
+
+    def test_early_stop(self):
+        session = FakeWFS(100)
+        records, dumper = self.dump(session, concurrency=3, stop_after=25)
+        # only the pages which were fully handed out count as done,
+        # not the rest of the one being read or the ones prefetched after it
+        self.assertEqual(dumper.state.index_done_till, 20)
+        self.assertEqual(dumper.state.downloaded_count, 20)
+
+        state = State.from_dict(**dumper.state.get_dict())
+        records, _ = self.dump(session, state=state, records=records[:20], concurrency=3)
+        self.assertEqual(records, session.features)
@@ -1,5 +1,10 @@
-from unittest import TestCase
-from wmsdump.dumper import truncate_geometry
+import os
+import copy
+import time
+import random
+
+from unittest import TestCase, skipUnless
+from wmsdump.precision_helper import truncate_geometry, truncate_geometries, numpy_available
 
 p1 = [77.89824947, 21.91597942]
 t_p1 = [77.898, 21.916] 
@@ -113,3 +118,59 @@ class TestPrecision(TestCase):
         inp = self.get_inp(self.multigeom_inp)
         truncate_geometry(inp, 3)
         self.assertDictEqual(inp, self.multigeom_outp_3)
+
+
+def get_polygons(count, ring_size, seed=0):
+    rnd = random.Random(seed)
+    return [ { 'type': 'Polygon',
+               'coordinates': [[ [rnd.uniform(68, 97), rnd.uniform(8, 37)] for _ in range(ring_size) ]] }
+             for _ in range(count) ]
+
+class TestBatchPrecision(TestCase):
+    def check(self, geoms, precision):
+        expected = copy.deepcopy(geoms)
+        for geom in expected:
+            truncate_geometry(geom, precision)
+        truncate_geometries(geoms, precision)
+        # compared as text, so that -0.0 and 0.0 are told apart
+        self.assertEqual(repr(geoms), repr(expected))
+
+    def test_all_types(self):
+        t = TestPrecision()
+        t.setUp()
+        geoms = [ t.point_inp, t.multipoint_inp, t.linestring_inp, t.polygon_inp,
+                  t.multilinestring_inp, t.multipolygon_inp, t.multigeom_inp, None ]
+        # repeated to make the batch big enough for numpy
+        geoms = [ copy.deepcopy(g) for g in geoms * 4 ]
+        self.check(geoms, 3)
+        self.assertEqual(geoms[5], t.multipolygon_outp_3)
+        self.assertEqual(geoms[6], t.multigeom_outp_3)
+
+    def test_ties(self):
+        vals = [ 0.125, 0.375, 2.675, 1.0005, -0.0005, -2.5, 0.5, 1e16 + 2, 5e-324, -0.0001, 77.8982 ]
+        geoms = [ { 'type': 'LineString', 'coordinates': [ [v, v * 10] for v in vals ] * 4 } ]
+        for precision in [0, 2, 3, 8]:
+            self.check(copy.deepcopy(geoms), precision)
+
+    def test_irregular(self):
+        # these don't fit in one array and go the per geometry way
+        mixed_dims = [ { 'type': 'LineString', 'coordinates': [[1.23456, 2.34567, 3.0]] * 20 },
+                       { 'type': 'LineString', 'coordinates': [[1.23456, 2.34567]] * 20 } ]
+        self.check(mixed_dims, 2)
+        strings = [ { 'type': 'MultiPoint', 'coordinates': [['1.23456', '2.34567']] * 40 } ]
+        self.check(strings, 2)
+        self.check(get_polygons(10, 10), 0)
+
+    @skipUnless(numpy_available and os.environ.get('WMSDUMP_BENCHMARK'), 'set WMSDUMP_BENCHMARK to run')
+    def test_benchmark(self):
+        geoms = get_polygons(1000, 1000)
+        timings = {}
+        for name, fn in [ ('per geometry', lambda gs: [ truncate_geometry(g, 5) for g in gs ]),
+                          ('batch', lambda gs: truncate_geometries(gs, 5)) ]:
+            inp = copy.deepcopy(geoms)
+            start = time.perf_counter()
+            fn(inp)
+            timings[name] = time.perf_counter() - start
+        print(f'\ntruncating {len(geoms)} polygons: ' +
+              ', '.join(f'{k}: {v:.3f}s' for k, v in timings.items()))
+        self.assertLess(timings['batch'], timings['per geometry'])
@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+from wmsdump.props_helper import PropsExtractor, get_props_from_html
+
+def make_desc(items, title='layer'):
+    lis = ''.join(f'\n  <li><strong><span class="atr-name">{k}</span>:</strong> '
+                  f'<span class="atr-value">{v}</span></li>' for k, v in items)
+    return f'<h4>{title}</h4>\n\n<ul class="textattributes">\n  {lis}\n</ul>\n'
+
+
+class TestPropsExtractor(TestCase):
+    def check(self, extractor, content):
+        expected = get_props_from_html(content)
+        props = extractor.extract(content)
+        self.assertEqual(props, expected)
+        self.assertEqual(list(props.keys()), list(expected.keys()))
+        return props
+
+    def test_template(self):
+        extractor = PropsExtractor()
+        props = self.check(extractor, make_desc([('id', ' 12 '), ('name', 'A &amp; B'), ('note', 'x: y')]))
+        self.assertEqual(props, { 'id': '12', 'name': 'A & B', 'note': 'x: y' })
+        self.assertEqual(extractor.layout[0], ('id', 'name', 'note'))
+
+        # the next feature is matched against the remembered keys
+        self.check(extractor, make_desc([('id', '13'), ('name', '&lt;none&gt;'), ('note', '')]))
+        self.check(extractor, make_desc([('id', '14')]))
+        self.assertEqual(extractor.layout[0], ('id',))
+
+    def test_fallback(self):
+        extractor = PropsExtractor()
+        self.check(extractor, '')
+        self.check(extractor, 'plain text')
+        self.check(extractor, '<ul><li>no separator</li></ul>')
+        self.check(extractor, '<ul><li><b>a</b>: 1</li><li>b: 2</li></ul>')
+        self.check(extractor, make_desc([('a:b', '1')]))
+        self.check(extractor, make_desc([('a', '&foo; &amp')]))
+        self.check(extractor, make_desc([('a', '1'), ('a', '2')]))
+        self.assertEqual(extractor.extract('<ul><li>no separator</li></ul>'),
+                         { 'unparsed': '<ul><li>no separator</li></ul>' })
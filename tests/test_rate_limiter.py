@@ -0,0 +1,110 @@
+from unittest import TestCase
+from email.utils import format_datetime
+from datetime import datetime, timezone, timedelta
+
+from wmsdump.rate_limiter import (
+    RateLimiter, TokenBucket, HostConcurrencyLimiter, get_retry_after
+)
+from wmsdump.circuit_breaker import CircuitBreaker
+
+class TestRetryAfter(TestCase):
+    def test_seconds(self):
+        self.assertEqual(get_retry_after(429, {'Retry-After': '120'}), 120.0)
+        self.assertEqual(get_retry_after(503, {'Retry-After': ' 3 '}), 3.0)
+
+    def test_http_date(self):
+        when = datetime.now(timezone.utc) + timedelta(seconds=60)
+        secs = get_retry_after(429, {'Retry-After': format_datetime(when, usegmt=True)})
+        self.assertTrue(55 < secs <= 60)
+
+    def test_date_in_past(self):
+        when = datetime.now(timezone.utc) - timedelta(seconds=60)
+        self.assertEqual(get_retry_after(429, {'Retry-After': format_datetime(when, usegmt=True)}), 0.0)
+
+    def test_ignored(self):
+        self.assertIsNone(get_retry_after(500, {'Retry-After': '10'}))
+        self.assertIsNone(get_retry_after(429, {}))
+        self.assertIsNone(get_retry_after(429, {'Retry-After': 'soon'}))
+
+
+class TestTokenBucket(TestCase):
+    def test_burst_then_paced(self):
+        bucket = TokenBucket(10, 3)
+        waits = [ bucket.reserve() for _ in range(5) ]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 0.1, places=2)
+        self.assertAlmostEqual(waits[4], 0.2, places=2)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(None, 1)
+        self.assertEqual([ bucket.reserve() for _ in range(100) ], [0] * 100)
+
+    def test_defer(self):
+        bucket = TokenBucket(None, 1)
+        bucket.defer(30)
+        self.assertTrue(29 < bucket.reserve() <= 30)
+
+    def test_defer_with_rate(self):
+        bucket = TokenBucket(10, 5)
+        bucket.defer(2)
+        self.assertAlmostEqual(bucket.reserve(), 2.1, places=2)
+        self.assertAlmostEqual(bucket.reserve(), 2.2, places=2)
+
+
+class TestRateLimiter(TestCase):
+    def test_per_host(self):
+        limiter = RateLimiter(per_host={'slow.example.com': (1, 1)})
+        self.assertTrue(limiter.is_limited('https://slow.example.com/geoserver/ows'))
+        self.assertFalse(limiter.is_limited('https://fast.example.com/geoserver/ows'))
+
+        limiter.defer('https://slow.example.com/geoserver/ows', 30)
+        self.assertEqual(limiter.get_bucket('https://fast.example.com/ows').reserve(), 0)
+        self.assertTrue(limiter.get_bucket('https://slow.example.com/wms').reserve() > 29)
+
+
+class TestHostConcurrencyLimiter(TestCase):
+    def test_per_host(self):
+        limiter = HostConcurrencyLimiter(2)
+        with limiter.slot('http://a.com/ows'), limiter.slot('http://a.com/wms'):
+            sem = limiter.get_semaphore('http://a.com/ows')
+            self.assertFalse(sem.acquire(blocking=False))
+            other = limiter.get_semaphore('http://b.com/ows')
+            self.assertTrue(other.acquire(blocking=False))
+            other.release()
+        self.assertTrue(sem.acquire(blocking=False))
+        sem.release()
+
+    def test_unlimited(self):
+        limiter = HostConcurrencyLimiter()
+        with limiter.slot('http://a.com/ows'), limiter.slot('http://a.com/ows'):
+            pass
+        self.assertEqual(limiter.semaphores, {})
+
+
+class TestCircuitBreaker(TestCase):
+    def test_opens_after_threshold(self):
+        limiter = RateLimiter()
+        breaker = CircuitBreaker(limiter, threshold=3, cooldown=60)
+        url = 'https://down.example.com/ows'
+        breaker.record_failure(url)
+        breaker.record_failure(url)
+        self.assertEqual(limiter.get_bucket(url).reserve(), 0)
+        breaker.record_failure(url)
+        self.assertTrue(59 < limiter.get_bucket(url).reserve() <= 60)
+
+    def test_success_resets(self):
+        limiter = RateLimiter()
+        breaker = CircuitBreaker(limiter, threshold=2, cooldown=60)
+        url = 'https://flaky.example.com/ows'
+        breaker.record_failure(url)
+        breaker.record_success(url)
+        breaker.record_failure(url)
+        self.assertEqual(limiter.get_bucket(url).reserve(), 0)
+
+    def test_disabled(self):
+        limiter = RateLimiter()
+        breaker = CircuitBreaker(limiter, threshold=0)
+        url = 'https://down.example.com/ows'
+        for _ in range(10):
+            breaker.record_failure(url)
+        self.assertEqual(limiter.get_bucket(url).reserve(), 0)
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from wmsdump.split_helper import get_geometry_bounds, get_split_point
+
+ENVELOPE = { 'xmin': 0.0, 'ymin': 0.0, 'xmax': 100.0, 'ymax': 100.0 }
+
+def point_feature(x, y):
+    return { 'type': 'Feature', 'geometry': { 'type': 'Point', 'coordinates': [x, y] }, 'properties': {} }
+
+
+class TestSplitPoint(TestCase):
+    def test_geometry_bounds(self):
+        geom = { 'type': 'Polygon', 'coordinates': [[[1, 2], [5, 2], [5, 7], [1, 2]]] }
+        self.assertEqual(get_geometry_bounds(geom), [1, 2, 5, 7])
+
+        geom = { 'type': 'GeometryCollection', 'geometries': [
+            { 'type': 'Point', 'coordinates': [-1, 3, 10] },
+            { 'type': 'LineString', 'coordinates': [[2, 2], [4, 8]] },
+        ]}
+        self.assertEqual(get_geometry_bounds(geom), [-1, 2, 4, 8])
+
+        self.assertIsNone(get_geometry_bounds(None))
+
+    def test_median(self):
+        feats = [ point_feature(10 + i, 20 + i) for i in range(5) ]
+        self.assertEqual(get_split_point(ENVELOPE, feats), [12, 22])
+
+    def test_clamped_to_envelope(self):
+        feats = [ point_feature(0.1, 99.9) for i in range(5) ]
+        self.assertEqual(get_split_point(ENVELOPE, feats), [5.0, 95.0])
+
+    def test_not_enough_features(self):
+        feats = [ point_feature(10, 10), point_feature(500, 500), point_feature(600, 600) ]
+        self.assertIsNone(get_split_point(ENVELOPE, feats))
+        self.assertIsNone(get_split_point(ENVELOPE, []))
@@ -0,0 +1,154 @@
+import json
+import tempfile
+
+from pathlib import Path
+from unittest import TestCase
+
+from wmsdump.cli import FileWriter
+from wmsdump.state import Extent, get_state_path
+from wmsdump.state_db import get_state_from_db, get_db_files
+
+PARAMS = {
+    'url': 'http://localhost/ows',
+    'layername': 'a',
+    'service': 'WFS',
+    'version': '1.0.0',
+    'operation': 'GetFeature',
+    'sort_key': None,
+}
+
+def make_feature(i):
+    return { 'type': 'Feature', 'id': f'a.{i}', 'properties': { 'i': i }, 'geometry': None }
+
+def tile_keys(state):
+    return [ row[0] for row in state.store.conn.execute('SELECT key FROM tiles ORDER BY key') ]
+
+
+class TestStateDB(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = Path(self.tmp_dir.name) / 'out.geojsonl'
+        self.state_file = get_state_path(self.output_file, 'sqlite')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_state(self, mode):
+        state = get_state_from_db(self.state_file, str(self.output_file), mode=mode, **PARAMS)
+        if state is None:
+            return None, None
+        writer = FileWriter(self.output_file, True, state.encode_backend, state.store.line_offsets)
+        state.store.flush_output = writer.flush
+        state.get_nth = writer.get
+        return state, writer
+
+    def add_features(self, state, writer, idxs):
+        added = []
+        for i in idxs:
+            feature = make_feature(i)
+            if state.mode == 'OFFSET':
+                writer.write(feature)
+            elif state.add_feature(feature):
+                writer.write(feature, state.get_encoded(feature))
+                added.append(i)
+        return added
+
+    def close(self, state, writer):
+        writer.close()
+        state.store.close()
+
+    def test_extent_resume(self):
+        state, writer = self.get_state('EXTENT')
+        state.update_coverage('0', Extent.OPEN, split_point=[1.0, 2.0])
+        self.assertEqual(self.add_features(state, writer, [ 0, 1, 2, 1 ]), [ 0, 1, 2 ])
+        state.update_coverage('00', Extent.OPEN, tile_index=100)
+        state.update_tile_index('00', 100)
+        self.add_features(state, writer, [ 3 ])
+        self.close(state, writer)
+        # written after the last update, by a run which didn't get to record it
+        with open(self.output_file, 'a') as f:
+            f.write('{"type": "Feature", "id": "a.4"}\n')
+
+        state, writer = self.get_state('EXTENT')
+        self.assertEqual(state.explored_tree, { '0': 1, '00': 1 })
+        self.assertEqual(state.split_points, { '0': [1.0, 2.0] })
+        self.assertEqual(state.tile_index, { '00': 200 })
+        self.assertEqual(state.current_count, 5)
+        self.assertEqual(writer.count, 5)
+        self.assertEqual(writer.get(4), '{"type": "Feature", "id": "a.4"}')
+        self.assertEqual(self.add_features(state, writer, [ 2, 3, 5 ]), [ 5 ])
+        state.update_coverage('00', Extent.EXPLORED)
+        self.close(state, writer)
+        self.assertEqual(len(self.output_file.read_text().splitlines()), 6)
+
+        state, writer = self.get_state('EXTENT')
+        self.assertEqual(state.tile_index, {})
+        self.assertEqual(self.add_features(state, writer, [ 5, 6 ]), [ 6 ])
+        writer.close()
+        state.store.remove()
+        self.assertFalse(any(p.exists() for p in get_db_files(self.state_file)))
+
+    def test_output_behind_state(self):
+        state, writer = self.get_state('EXTENT')
+        state.update_coverage('0', Extent.OPEN)
+        self.add_features(state, writer, range(4))
+        state.update_coverage('00', Extent.EXPLORED)
+        self.close(state, writer)
+
+        # as if the last writes never made it to the disk
+        lines = self.output_file.read_text().splitlines(keepends=True)
+        self.output_file.write_text(''.join(lines[:2]) + lines[2][:5])
+
+        state, writer = self.get_state('EXTENT')
+        self.assertEqual(state.current_count, 2)
+        self.assertEqual(self.add_features(state, writer, range(4)), [ 2, 3 ])
+        self.close(state, writer)
+        self.assertEqual([ json.loads(line) for line in self.output_file.read_text().splitlines() ],
+                         [ make_feature(i) for i in range(4) ])
+
+    def test_offset_resume(self):
+        state, writer = self.get_state('OFFSET')
+        self.add_features(state, writer, range(10))
+        state.update(10, 10)
+        self.add_features(state, writer, range(10, 15))
+        self.close(state, writer)
+
+        # the records of the page which wasn't recorded are dropped
+        state, writer = self.get_state('OFFSET')
+        self.assertEqual(state.downloaded_count, 10)
+        self.assertEqual(len(self.output_file.read_text().splitlines()), 10)
+        self.close(state, writer)
+
+    def test_no_updates(self):
+        state, writer = self.get_state('EXTENT')
+        self.close(state, writer)
+        self.assertFalse(any(p.exists() for p in get_db_files(self.state_file)))
+        self.assertFalse(self.output_file.exists())
+
+    def test_mismatched_output(self):
+        state, writer = self.get_state('EXTENT')
+        state.update_coverage('0', Extent.OPEN)
+        self.add_features(state, writer, range(3))
+        state.update_coverage('00', Extent.EXPLORED)
+        self.close(state, writer)
+
+        self.output_file.write_text(self.output_file.read_text().replace('\n', ' \n'))
+        self.assertEqual(self.get_state('EXTENT'), (None, None))
+
+    def test_old_tree(self):
+        state, writer = self.get_state('EXTENT')
+        state.update_coverage('0', Extent.OPEN)
+        state.update_coverage('00', Extent.OPEN)
+        state.update_coverage('000', Extent.EXPLORED)
+        state.update_coverage('00', Extent.EXPLORED)
+        self.assertEqual(tile_keys(state), [ '0', '00' ])
+        # as written before explored subtrees were dropped
+        state.store.conn.execute("INSERT INTO tiles VALUES ('000', 2, NULL, NULL, NULL)")
+        state.store.conn.execute("DELETE FROM state WHERE name = 'tree_version'")
+        self.close(state, writer)
+
+        state, writer = self.get_state('EXTENT')
+        self.assertEqual(state.explored_tree, { '0': 1, '00': 2 })
+        self.assertEqual(tile_keys(state), [ '0', '00' ])
+        self.close(state, writer)
+
@@ -0,0 +1,123 @@
+import json
+import tempfile
+
+from pathlib import Path
+from unittest import TestCase
+
+from wmsdump.state import Extent, get_state_from_files, get_journal_path
+
+PARAMS = {
+    'url': 'http://localhost/ows',
+    'layername': 'a',
+    'service': 'WFS',
+    'version': '1.0.0',
+    'operation': 'GetFeature',
+    'sort_key': None,
+}
+
+
+class TestStateJournal(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = Path(self.tmp_dir.name) / 'out.geojsonl'
+        self.state_file = Path(self.tmp_dir.name) / 'out.geojsonl.state'
+        self.journal_file = get_journal_path(self.state_file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_state(self, mode, durability='flush', **params):
+        return get_state_from_files(str(self.state_file), str(self.output_file),
+                                    durability=durability, mode=mode, **(PARAMS | params))
+
+    def read_checkpoint(self):
+        return json.loads(self.state_file.read_text())
+
+    def test_extent_resume(self):
+        state = self.get_state('EXTENT')
+        state.update_coverage('0', Extent.OPEN)
+        # the first update writes out the checkpoint
+        self.assertEqual(self.read_checkpoint()['explored_tree'], { '0': 1 })
+
+        state.update_coverage('00', Extent.OPEN, split_point=[1.0, 2.0])
+        state.update_coverage('01', Extent.OPEN, tile_index=100)
+        state.update_tile_index('01', 100)
+        state.batch_size = 500
+        state.update_coverage('00', Extent.EXPLORED)
+        state.store.close()
+        self.assertEqual(len(self.journal_file.read_text().splitlines()), 4)
+
+        resumed = self.get_state('EXTENT')
+        expected = state.get_dict()
+        self.assertEqual(expected.pop('journal_seq'), 1)
+        self.assertEqual(resumed.get_dict(), expected | { 'journal_seq': 5 })
+        self.assertEqual(resumed.tile_index, { '01': 200 })
+        self.assertEqual(resumed.batch_size, 500)
+        # compacted into the checkpoint on resume
+        self.assertEqual(self.read_checkpoint(), resumed.get_dict())
+        self.assertEqual(self.journal_file.read_text(), '')
+
+        resumed.store.remove()
+        self.assertFalse(self.state_file.exists())
+        self.assertFalse(self.journal_file.exists())
+
+    def test_offset_resume(self):
+        state = self.get_state('OFFSET', durability='lazy')
+        for _ in range(3):
+            state.update(10, 10)
+        state.store.close()
+        self.output_file.write_text('{}\n' * 30)
+
+        resumed = self.get_state('OFFSET')
+        self.assertEqual(resumed.index_done_till, 30)
+        self.assertEqual(resumed.downloaded_count, 30)
+
+    def test_lazy_crash(self):
+        state = self.get_state('OFFSET', durability='lazy')
+        for _ in range(3):
+            state.update(10, 10)
+        # as if the process died with the last updates still buffered,
+        # after their records and part of the next page reached the output
+        self.output_file.write_text('{}\n' * 35 + '{')
+        self.assertGreater(state.store.pending_size, 0)
+
+        with self.assertLogs('wmsdump.state', level='WARNING') as logs:
+            resumed = self.get_state('OFFSET')
+        self.assertIn('records at the end of', logs.output[0])
+        self.assertEqual(resumed.index_done_till, 10)
+        self.assertEqual(resumed.downloaded_count, 10)
+        self.assertEqual(self.output_file.read_text(), '{}\n' * 10)
+
+        # cut short inside the last record the state accounts for
+        self.output_file.write_text('{}\n' * 9 + '{')
+        self.assertIsNone(self.get_state('OFFSET'))
+
+    def test_not_in_sync(self):
+        state = self.get_state('EXTENT')
+        state.update_coverage('0', Extent.OPEN)
+        state.update_coverage('00', Extent.EXPLORED)
+        state.store.close()
+        self.output_file.write_text('{}\n{')
+        files = { path: path.read_bytes() for path in Path(self.tmp_dir.name).iterdir() }
+
+        # the files are left as they were for the run they belong to
+        self.assertIsNone(self.get_state('EXTENT', url='http://localhost/other'))
+        self.assertEqual({ path: path.read_bytes() for path in Path(self.tmp_dir.name).iterdir() }, files)
+
+    def test_crash_leftovers(self):
+        state = self.get_state('EXTENT')
+        state.update_coverage('0', Extent.OPEN)
+        state.update_coverage('00', Extent.OPEN)
+        state.update_coverage('01', Extent.OPEN)
+        state.store.close()
+        records = self.journal_file.read_text()
+
+        state.update_coverage('00', Extent.EXPLORED)
+        state.store.checkpoint()
+        state.store.close()
+
+        # as if the process died between the checkpoint being renamed
+        # into place and the journal being emptied, with a record cut short
+        self.journal_file.write_text(records + '{"op": "cover')
+        resumed = self.get_state('EXTENT')
+        self.assertEqual(resumed.explored_tree, { '0': 1, '00': 2, '01': 1 })
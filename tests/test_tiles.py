@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from wmsdump.state import Extent
+
+from fake_wfs import FakeWFS, get_dumper, get_state, round_trip
+
+
+class TestTilePaging(TestCase):
+    def dump(self, session, state=None, records=None, stop_after=None):
+        if state is None:
+            state = get_state()
+        if records is None:
+            records = []
+        dumper = get_dumper(session, state, records, batch_size=10, tile_depth=1)
+        it = iter(dumper)
+        for feature in it:
+            records.append(feature)
+            if stop_after is not None and len(records) >= stop_after:
+                it.close()
+                break
+        return records, dumper
+
+    def test_paged(self):
+        session = FakeWFS(300)
+        records, dumper = self.dump(session)
+        self.assertEqual(sorted(r['id'] for r in records), sorted(f['id'] for f in session.features))
+        self.assertEqual(dumper.state.explored_tree, { '0': Extent.EXPLORED.value })
+        self.assertEqual(dumper.state.tile_index, {})
+        # the children of the root are paged through instead of being split
+        self.assertEqual(len(set(params['bbox'] for params in session.requests)), 5)
+        self.assertGreater(max(int(params.get('startIndex', 0)) for params in session.requests), 0)
+
+    def test_resume(self):
+        expected, _ = self.dump(FakeWFS(300))
+
+        session = FakeWFS(300)
+        # the root's 10, the tile's first page of 10 and one more page, into the one after
+        records, dumper = self.dump(session, stop_after=35)
+        self.assertEqual(dumper.state.tile_index, { '00': 20 })
+        self.assertEqual(dumper.state.explored_tree['00'], Extent.OPEN.value)
+
+        num_requests = len(session.requests)
+        records, dumper = self.dump(session, state=round_trip(dumper.state, records), records=records)
+        self.assertEqual(records, expected)
+        self.assertEqual(int(session.requests[num_requests]['startIndex']), 20)
+        self.assertEqual(dumper.state.tile_index, {})
@@ -1 +1,2 @@
 from wmsdump.dumper import OGCServiceDumper as OGCServiceDumper
+from wmsdump.async_dumper import AsyncOGCServiceDumper as AsyncOGCServiceDumper
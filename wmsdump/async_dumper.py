@@ -0,0 +1,384 @@
+import time
+import asyncio
+import logging
+
+from collections import deque
+from pprint import pformat
+
+httpx_available = True
+try:
+    import httpx
+except ImportError:
+    httpx_available = False
+
+from .state import Extent
+from .dumper import OGCServiceDumper
+from .capabilities import get_capabilities_params, get_cached_layer_info, cache_layer_info
+from .stream_helper import CHUNK_SIZE
+from .errors import ZeroAreaException
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOGCServiceDumper(OGCServiceDumper):
+    """
+    asyncio flavor of OGCServiceDumper, takes the same parameters
+    and is iterated with "async for". If a session is passed in it is
+    expected to be a httpx.AsyncClient, which can be shared between dumpers.
+    """
+
+    def __init__(self, *args, session=None, req_params={}, **kwargs):
+        if not httpx_available:
+            raise Exception('async dumping requires installing httpx')
+
+        self.owns_session = session is None
+        if session is None:
+            # match the requests defaults of following redirects and no timeout
+            session = httpx.AsyncClient(verify=req_params.get('verify', True),
+                                        follow_redirects=True,
+                                        timeout=None)
+
+        super().__init__(*args, session=session, req_params=req_params, **kwargs)
+
+        # ssl verification is a client level setting in httpx
+        self.request_args = { k:v for k,v in self.req_params.items() if k != 'verify' }
+
+        self.req_lock = asyncio.Lock()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.tasks = None
+
+    async def aclose(self):
+        if self.owns_session:
+            await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def make_request(self, params, get_parser, giveup=None):
+        logger.debug(pformat(params))
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            try:
+                await self.rate_limiter.async_wait(self.url)
+                async with self.semaphore:
+                    async with self.session.stream('GET', self.url, params=params,
+                                                   **self.request_args) as resp:
+                        if resp.is_error:
+                            await resp.aread()
+                            self.handle_failed_response(resp.status_code, resp.headers, resp.text)
+
+                        parser = get_parser()
+                        feats = []
+                        async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                            feats.extend(parser.feed(chunk))
+                # the connection is free for the next request while this one finishes parsing
+                if self.parse_pool is not None:
+                    feats.extend(await asyncio.get_running_loop().run_in_executor(None, parser.close))
+                else:
+                    feats.extend(parser.close())
+            except Exception as ex:
+                delay = self.handle_request_failure(ex, attempt, giveup)
+                await asyncio.sleep(delay)
+                continue
+
+            self.circuit_breaker.record_success(self.url)
+            return feats
+
+    async def pause_if_required(self):
+        if self.rate_limiter.is_limited(self.url):
+            return
+
+        async with self.req_lock:
+            self.req_count += 1
+
+            if self.req_count == self.requests_to_pause:
+                logger.info(f'pausing for {self.pause_seconds} secs')
+                await asyncio.sleep(self.pause_seconds)
+                self.req_count = 0
+
+    async def get_features(self, count, no_index=False, no_sort=False, start_index=None, giveup=None):
+        await self.pause_if_required()
+
+        params = self.get_params(count, no_index, no_sort, start_index)
+
+        logger.info(f'making a request for {count} records with '
+                    f'start_index: {self.get_start_index(start_index)}, '
+                    f'already_downloaded: {self.state.downloaded_count}')
+        feats = await self.make_request(params, self.get_response_parser, giveup)
+        self.post_process(feats)
+        return feats
+
+    async def get_bounded_features(self, bounds, count, key, giveup=None):
+        await self.pause_if_required()
+
+        params = self.get_bounded_params(bounds, count)
+
+        logger.info(f'making a request for {count} records with key={key}')
+        feats = await self.make_request(params, self.get_bounded_response_parser, giveup)
+        self.post_process(feats)
+        return feats
+
+    async def get_tile_features(self, bounds, count, key, start_index, giveup=None):
+        await self.pause_if_required()
+
+        params = self.get_tile_params(bounds, count, start_index)
+
+        logger.info(f'making a request for {count} records with key={key}, '
+                    f'start_index: {start_index}')
+        feats = await self.make_request(params, self.get_bounded_response_parser, giveup)
+        self.post_process(feats)
+        return feats
+
+    async def probe_envelope(self, envelope, count, key):
+        await self.pause_if_required()
+
+        params = self.get_hits_params(envelope, count)
+
+        logger.info(f'probing the number of records for key={key}')
+        hits = None
+        try:
+            hits = (await self.make_request(params, self.get_hits_parser, self.is_probe_rejected))[0]
+        except ZeroAreaException:
+            return 0
+        except Exception as ex:
+            self.handle_probe_failure(ex)
+
+        if hits is None:
+            self.disable_probing()
+        return hits
+
+    def is_retryable_error(self, ex):
+        if isinstance(ex, httpx.TransportError):
+            return True
+        return super().is_retryable_error(ex)
+
+    def is_overload_error(self, ex):
+        if isinstance(ex, httpx.TimeoutException):
+            return True
+        return super().is_overload_error(ex)
+
+    async def sized_request(self, fetch):
+        while True:
+            count = self.get_batch_size()
+            if self.sizer is None:
+                return count, await fetch(count, None)
+
+            start = time.monotonic()
+            try:
+                feats = await fetch(count, self.get_shrink_check(count))
+            except Exception as ex:
+                if self.is_overload_error(ex) and self.sizer.shrink(count):
+                    self.sync_batch_size()
+                    continue
+                raise
+            self.sizer.update(count, len(feats), time.monotonic() - start)
+            self.sync_batch_size()
+            return count, feats
+
+    async def fetch_envelope(self, envelope, key):
+        if self.is_tile(key):
+            return await self.fetch_tile_page(envelope, key, 0)
+
+        if self.probe_hits:
+            count = self.get_batch_size()
+            hits = await self.probe_envelope(envelope, count, key)
+            if hits is not None and hits >= count:
+                logger.info(f'key={key} has atleast {hits} records, splitting without fetching')
+                return count, None
+            if hits == 0:
+                return count, []
+
+        async def fetch(count, giveup):
+            try:
+                return await self.get_bounded_features(envelope, count, key, giveup=giveup)
+            except ZeroAreaException:
+                return []
+        return await self.sized_request(fetch)
+
+    async def fetch_page(self, start_index):
+        async def fetch(count, giveup):
+            return await self.get_features(count, start_index=start_index, giveup=giveup)
+        return await self.sized_request(fetch)
+
+    async def fetch_tile_page(self, envelope, key, start_index):
+        async def fetch(count, giveup):
+            try:
+                return await self.get_tile_features(envelope, count, key, start_index, giveup=giveup)
+            except ZeroAreaException:
+                return []
+        return await self.sized_request(fetch)
+
+    def start_task(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def prefetch_envelope(self, envelope, key):
+        if self.tasks is None:
+            return None
+
+        if self.get_envelope_status(key) != Extent.NOT_PRESENT:
+            return None
+
+        if not self.is_envelope_size_allowed(envelope):
+            return None
+
+        return self.start_task(self.fetch_envelope(envelope, key))
+
+    async def scrape_an_envelope(self, envelope, key, future=None):
+        status = self.get_envelope_status(key)
+        if status == Extent.EXPLORED:
+            return
+
+        if status == Extent.NOT_PRESENT:
+            features = None
+            if self.is_envelope_size_allowed(envelope):
+                if future is not None:
+                    count, features = await future
+                else:
+                    count, features = await self.fetch_envelope(envelope, key)
+
+                if features is not None:
+                    logger.info(f'got {len(features)} records for key={key}')
+
+                    for feature in features:
+                        yield feature
+                    if not self.is_saturated(count, len(features)):
+                        self.state.update_coverage(key, Extent.EXPLORED)
+                        return
+
+            if self.is_tile(key) and features is not None:
+                advance = self.get_page_advance(count, len(features), True)
+                self.state.update_coverage(key, Extent.OPEN, tile_index=advance)
+            else:
+                self.open_envelope(envelope, key, features)
+            status = Extent.OPEN
+
+        if status == Extent.OPEN and key in self.state.tile_index:
+            async for feature in self.page_tile(envelope, key):
+                yield feature
+            return
+
+        if status == Extent.OPEN:
+            envelopes, keys = self.get_child_envelopes(envelope, key)
+
+            futures = [ self.prefetch_envelope(e, k) for e, k in zip(envelopes, keys) ]
+
+            for child_envelope, new_key, child_future in zip(envelopes, keys, futures):
+                async for feature in self.scrape_an_envelope(child_envelope, new_key, child_future):
+                    yield feature
+
+            self.state.update_coverage(key, Extent.EXPLORED)
+
+    async def cancel_tasks(self):
+        tasks = list(self.tasks)
+        self.tasks = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def get_layer_info(self):
+        found, layer_info = get_cached_layer_info(self.url, self.service, self.service_version)
+        if found:
+            return layer_info
+
+        params = get_capabilities_params(self.service, self.service_version)
+        logger.info(f'getting capabilities from {self.url} for the extent of {self.layername}')
+        try:
+            layer_info = (await self.make_request(params, self.get_layer_info_parser))[0]
+        except Exception as ex:
+            logger.warning(f'Unable to read layer metadata from capabilities at {self.url}: {ex!r}')
+        return cache_layer_info(self.url, self.service, self.service_version, layer_info)
+
+    async def lookup_initial_bounds(self):
+        if self.initial_bounds is None:
+            self.set_layer_bounds(await self.get_layer_info())
+
+    async def iter_extent(self):
+        await self.lookup_initial_bounds()
+        if self.window > 1:
+            self.tasks = set()
+        self.start_parse_pool()
+        try:
+            async for feature in self.scrape_an_envelope(self.initial_bounds, "0"):
+                if self.state.add_feature(feature):
+                    yield feature
+        finally:
+            if self.tasks is not None:
+                await self.cancel_tasks()
+            self.stop_parse_pool()
+
+    async def iter_pages(self, fetch_page, start_index):
+        pending = deque()
+        next_index = start_index
+        while True:
+            while self.tasks is not None and len(pending) < self.window:
+                pending.append((next_index,
+                                self.start_task(fetch_page(next_index))))
+                next_index += self.get_batch_size()
+
+            if len(pending) > 0:
+                start_index, task = pending.popleft()
+                count, feats = await task
+            else:
+                count, feats = await fetch_page(start_index)
+
+            saturated = self.is_saturated(count, len(feats))
+            advance = self.get_page_advance(count, len(feats), saturated)
+
+            yield feats, advance
+
+            if not saturated:
+                for _, task in pending:
+                    task.cancel()
+                break
+
+            if len(pending) > 0 and pending[0][0] != start_index + advance:
+                for _, task in pending:
+                    task.cancel()
+                pending.clear()
+                next_index = start_index + advance
+
+            start_index += advance
+
+    async def page_tile(self, envelope, key):
+        async def fetch_page(start_index):
+            return await self.fetch_tile_page(envelope, key, start_index)
+
+        async for feats, advance in self.iter_pages(fetch_page, self.state.tile_index[key]):
+            logger.info(f'got {len(feats)} records for key={key}')
+            for feat in feats:
+                yield feat
+            self.state.update_tile_index(key, advance)
+
+        self.state.update_coverage(key, Extent.EXPLORED)
+
+    async def iter_offset(self):
+        if self.window > 1:
+            self.tasks = set()
+        self.start_parse_pool()
+        try:
+            async for feats, advance in self.iter_pages(self.fetch_page, self.state.index_done_till):
+                for feat in feats:
+                    yield feat
+
+                self.state.update(advance, len(feats))
+        finally:
+            if self.tasks is not None:
+                await self.cancel_tasks()
+            self.stop_parse_pool()
+
+    def __iter__(self):
+        raise TypeError('AsyncOGCServiceDumper should be iterated with "async for"')
+
+    def __aiter__(self):
+        if self.retrieval_mode == 'OFFSET':
+            return self.iter_offset()
+        return self.iter_extent()
@@ -0,0 +1,101 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class BatchSizer:
+    """
+    Picks the number of records to ask for in each request.
+    Grows the batch while full responses come back quickly, shrinks it
+    on slow responses and on timeouts/server errors.
+    """
+    def __init__(self, size,
+                 min_size=1,
+                 max_size=None,
+                 target_latency=10,
+                 confirmed=0,
+                 cap=None):
+        self.min_size = max(1, min_size)
+        self.max_size = max_size
+        self.target_latency = target_latency
+
+        # largest count which the server has been seen to fully serve
+        self.confirmed = confirmed
+        # limit on the number of records the server returns, when discovered
+        self.cap = cap
+        self.suspected_cap = None
+        # smallest count which has failed, growth backs off from it
+        self.failed_size = None
+
+        self.size = self.clamp(size)
+        self.lock = threading.Lock()
+
+    def clamp(self, size):
+        size = max(self.min_size, int(size))
+        if self.max_size is not None:
+            size = min(size, self.max_size)
+        if self.cap is not None:
+            size = min(size, self.cap)
+        return size
+
+    def set_size(self, size):
+        size = self.clamp(size)
+        if size != self.size:
+            logger.info(f'changing batch size from {self.size} to {size}')
+            self.size = size
+
+    def is_saturated(self, requested, got):
+        if got >= requested:
+            return True
+
+        if self.cap is not None and got >= self.cap:
+            return True
+
+        # a short response to a larger batch than has ever been fully served
+        # could just as well be the server quietly capping the results,
+        # play it safe and treat it as a full one. If the same count shows
+        # up twice, it is taken to be the server limit
+        with self.lock:
+            if requested > self.confirmed and got > 0 and got >= self.confirmed:
+                if self.suspected_cap == got:
+                    logger.info(f'server seems to cap responses at {got} records')
+                    self.cap = got
+                    self.set_size(self.size)
+                else:
+                    self.suspected_cap = got
+                return True
+
+        return False
+
+    def update(self, requested, got, elapsed):
+        with self.lock:
+            if got < requested:
+                return
+
+            self.confirmed = max(self.confirmed, requested)
+            if requested != self.size:
+                return
+
+            if elapsed < self.target_latency / 2:
+                self.grow()
+            elif elapsed > self.target_latency:
+                self.set_size(self.size * 0.75)
+
+    def grow(self):
+        new_size = self.size * 2
+        if self.failed_size is not None and new_size >= self.failed_size:
+            new_size = (self.size + self.failed_size) // 2
+        if new_size > self.size:
+            self.set_size(new_size)
+
+    def can_shrink_from(self, requested):
+        return requested > self.min_size
+
+    def shrink(self, requested):
+        with self.lock:
+            if not self.can_shrink_from(requested):
+                return False
+            if self.failed_size is None or requested < self.failed_size:
+                self.failed_size = requested
+            self.set_size(min(self.size, requested // 2))
+            return True
@@ -1,15 +1,17 @@
 import logging
+import threading
 
 from pprint import pformat
 
 import requests
-import xmltodict
 
-from .errors import check_error_msg, optionally_save_to_file
+from .stream_helper import (
+    CHUNK_SIZE, XMLStreamParser, local_name, optionally_save_stream_to_file
+)
 
 logger = logging.getLogger(__name__)
 
-def get_capabilities(url, service, service_version, namespace=None, **req_args):
+def request_capabilities(url, service, service_version, namespace=None, **req_args):
     query_params = {
         "service": service,
         "version": service_version,
@@ -20,87 +22,312 @@ def get_capabilities(url, service, service_version, namespace=None, **req_args):
 
     logger.info(f'Getting capabilities from {url}')
     logger.debug(pformat(query_params))
-    resp = requests.get(url, params=query_params, **req_args)
+    resp = requests.get(url, params=query_params, stream=True, **req_args)
     if not resp.ok:
+        resp.close()
         raise Exception(f'Unable to get capabilities from {url}')
+    return resp
+
+def get_capabilities(url, service, service_version, namespace=None, **req_args):
+    with request_capabilities(url, service, service_version,
+                              namespace=namespace, **req_args) as resp:
+        return resp.text
+
+WMS_ROOT_TAGS = [ 'WMT_MS_Capabilities', 'WMS_Capabilities' ]
+WFS_ROOT_TAGS = [ 'WFS_Capabilities' ]
+WMS_FORMAT_REQUESTS = [ 'GetMap', 'GetFeatureInfo' ]
+WFS_CRS_TAGS = [ 'SRS', 'DefaultSRS', 'OtherSRS', 'DefaultCRS', 'OtherCRS' ]
+
+def get_text(elem):
+    if elem is None or elem.text is None:
+        return None
+    txt = elem.text.strip()
+    if txt == '':
+        return None
+    return txt
+
+def find_child(elem, name):
+    for child in elem:
+        if local_name(child.tag) == name:
+            return child
+    return None
+
+def find_children(elem, names):
+    return [ child for child in elem if local_name(child.tag) in names ]
+
+def get_float_attrs(elem, names):
+    try:
+        return [ float(elem.get(n)) for n in names ]
+    except (TypeError, ValueError):
+        return None
+
+def get_corner(elem):
+    txt = get_text(elem)
+    if txt is None:
+        return None
+    try:
+        return [ float(v) for v in txt.split()[:2] ]
+    except ValueError:
+        return None
+
+def get_crs_list(elem, names):
+    crs_list = []
+    for child in find_children(elem, names):
+        txt = get_text(child)
+        # wms 1.1.1 allows for a space separated list in one SRS element
+        if txt is not None:
+            crs_list.extend(txt.split())
+    return crs_list
+
+def parse_queryable(val):
+    if val is None:
+        return None
+    return val.strip().lower() in [ '1', 'true' ]
+
+def get_wms_geographic_bbox(layer):
+    bbox_elem = find_child(layer, 'EX_GeographicBoundingBox')
+    if bbox_elem is not None:
+        vals = []
+        for name in [ 'westBoundLongitude', 'southBoundLatitude',
+                      'eastBoundLongitude', 'northBoundLatitude' ]:
+            try:
+                vals.append(float(get_text(find_child(bbox_elem, name))))
+            except (TypeError, ValueError):
+                return None
+        return vals
+
+    bbox_elem = find_child(layer, 'LatLonBoundingBox')
+    if bbox_elem is not None:
+        return get_float_attrs(bbox_elem, [ 'minx', 'miny', 'maxx', 'maxy' ])
+    return None
+
+def get_wms_bboxes(layer):
+    bboxes = []
+    for bbox_elem in find_children(layer, [ 'BoundingBox' ]):
+        crs = bbox_elem.get('CRS', bbox_elem.get('SRS', None))
+        bbox = get_float_attrs(bbox_elem, [ 'minx', 'miny', 'maxx', 'maxy' ])
+        if crs is None or bbox is None:
+            continue
+        bboxes.append({ 'crs': crs, 'bbox': bbox })
+    return bboxes
+
+def get_wfs_geographic_bbox(feature_type):
+    bbox_elem = find_child(feature_type, 'WGS84BoundingBox')
+    if bbox_elem is not None:
+        lower = get_corner(find_child(bbox_elem, 'LowerCorner'))
+        upper = get_corner(find_child(bbox_elem, 'UpperCorner'))
+        if lower is None or upper is None:
+            return None
+        return lower + upper
+
+    bbox_elem = find_child(feature_type, 'LatLongBoundingBox')
+    if bbox_elem is not None:
+        return get_float_attrs(bbox_elem, [ 'minx', 'miny', 'maxx', 'maxy' ])
+    return None
+
+def get_wfs_queryable(elem):
+    # the operations allowed are listed per feature type or for all of them in wfs 1.0
+    ops = find_child(elem, 'Operations')
+    if ops is None:
+        return None
+    return find_child(ops, 'Query') is not None
+
+
+class CapabilitiesStreamParser(XMLStreamParser):
+    """
+    Collects the layer names, the supported formats and the layer metadata
+    from a capabilities document in one pass as it is fed in. Layers are
+    dropped from the tree once read, so that memory use doesn't grow with
+    the size of the document.
+
+    layer_info gets an entry per layer with 'title', 'crs' (the ones
+    declared on the layer itself), 'bbox' ([minx, miny, maxx, maxy] in
+    lon/lat), 'bboxes' (as declared, in the axis order of their crs) and
+    'queryable'.
+    """
+    def __init__(self, service, layer_list, service_info, layer_info=None):
+        super().__init__()
+        self.service = service
+        self.layer_list = layer_list
+        self.service_info = service_info
+        self.layer_info = layer_info if layer_info is not None else {}
+        # (parent layer, its lon/lat bbox and queryable flag) inherited by the layers in it
+        self.parent_layer = None
+
+    def fix_chunk(self, chunk):
+        # names are to be read the way they were written
+        return chunk
+
+    def get_path(self):
+        return [ local_name(e.tag) for e in self.stack ]
+
+    def handle_end(self, elem, parent):
+        name = local_name(elem.tag)
+        depth = len(self.stack)
+        if self.service == 'WMS':
+            if self.root_tag in WMS_ROOT_TAGS:
+                self.handle_wms_end(name, depth, elem, parent)
+        elif self.root_tag in WFS_ROOT_TAGS:
+            self.handle_wfs_end(name, depth, elem, parent)
+        return []
+
+    def add_format(self, request_type, fmt):
+        if request_type not in self.service_info:
+            self.service_info[request_type] = []
+        self.service_info[request_type].append(fmt)
+
+    def handle_wms_end(self, name, depth, elem, parent):
+        # <root>/Capability/Layer/Layer/Name
+        if name == 'Name' and depth == 4:
+            if self.get_path()[1:] == [ 'Capability', 'Layer', 'Layer' ]:
+                txt = get_text(elem)
+                if txt is not None:
+                    self.layer_list.append(txt)
+            return
+
+        # <root>/Capability/Request/<GetMap|GetFeatureInfo>/Format
+        if name == 'Format' and depth == 4:
+            path = self.get_path()
+            if path[1:3] == [ 'Capability', 'Request' ] and path[3] in WMS_FORMAT_REQUESTS:
+                txt = get_text(elem)
+                if txt is not None:
+                    self.add_format(path[3], txt)
+            return
+
+        if name == 'Layer' and depth == 3 and self.get_path()[1:] == [ 'Capability', 'Layer' ]:
+            self.add_wms_layer_info(elem, parent)
+            parent.remove(elem)
+
+    def get_parent_layer_defaults(self, parent):
+        if self.parent_layer is None or self.parent_layer[0] is not parent:
+            self.parent_layer = (parent,
+                                 get_wms_geographic_bbox(parent),
+                                 parse_queryable(parent.get('queryable', None)))
+        return self.parent_layer[1:]
+
+    def add_wms_layer_info(self, layer, parent):
+        layer_name = get_text(find_child(layer, 'Name'))
+        if layer_name is None:
+            return
+
+        parent_bbox, parent_queryable = self.get_parent_layer_defaults(parent)
+
+        bbox = get_wms_geographic_bbox(layer)
+        queryable = parse_queryable(layer.get('queryable', None))
+        self.layer_info[layer_name] = {
+            'title': get_text(find_child(layer, 'Title')),
+            'crs': get_crs_list(layer, [ 'CRS', 'SRS' ]),
+            'bbox': bbox if bbox is not None else parent_bbox,
+            'bboxes': get_wms_bboxes(layer),
+            'queryable': bool(queryable if queryable is not None else parent_queryable),
+        }
+
+    def handle_wfs_end(self, name, depth, elem, parent):
+        # WFS_Capabilities/FeatureTypeList/FeatureType/Name
+        if name == 'Name' and depth == 3:
+            if self.get_path()[1:] == [ 'FeatureTypeList', 'FeatureType' ]:
+                txt = get_text(elem)
+                if txt is not None:
+                    self.layer_list.append(txt)
+            return
+
+        # WFS_Capabilities/Capability/Request/GetFeature/ResultFormat/<format>
+        if depth == 5 and self.get_path()[1:] == [ 'Capability', 'Request', 'GetFeature', 'ResultFormat' ]:
+            self.add_format('GetFeature', name)
+            return
+
+        if name == 'FeatureType' and depth == 2 and self.get_path()[1:] == [ 'FeatureTypeList' ]:
+            self.add_wfs_layer_info(elem, parent)
+            parent.remove(elem)
+
+    def add_wfs_layer_info(self, feature_type, parent):
+        layer_name = get_text(find_child(feature_type, 'Name'))
+        if layer_name is None:
+            return
+
+        queryable = get_wfs_queryable(feature_type)
+        if queryable is None:
+            queryable = get_wfs_queryable(parent)
+
+        self.layer_info[layer_name] = {
+            'title': get_text(find_child(feature_type, 'Title')),
+            'crs': get_crs_list(feature_type, WFS_CRS_TAGS),
+            'bbox': get_wfs_geographic_bbox(feature_type),
+            'bboxes': [],
+            'queryable': queryable,
+        }
+
+
+def parse_capabilities(service, xml_txt, layer_list, service_info, layer_info=None):
+    parser = CapabilitiesStreamParser(service, layer_list, service_info, layer_info)
+    # fed a piece at a time, the events of the whole document would pile up otherwise
+    for i in range(0, len(xml_txt), CHUNK_SIZE):
+        parser.feed(xml_txt[i:i + CHUNK_SIZE])
+    parser.close()
+
+
+class LayerInfoParser(CapabilitiesStreamParser):
+    """
+    CapabilitiesStreamParser for use as a response parser by the dumpers,
+    which hands over the layer metadata on close.
+    """
+    def __init__(self, service):
+        super().__init__(service, [], {})
+
+    def close(self):
+        super().close()
+        return [ self.layer_info ]
+
+def get_capabilities_params(service, service_version):
+    return {
+        "service": service,
+        "version": service_version,
+        "request": "GetCapabilities"
+    }
+
+
+# layer metadata by (url, service, version), so that layers extracted
+# from the same endpoint share one capabilities download
+layer_info_cache = {}
+layer_info_lock = threading.Lock()
+
+def get_cached_layer_info(service_url, service, service_version):
+    # returns whether the capabilities were looked at already, and the layer metadata from them
+    key = (service_url, service, service_version)
+    with layer_info_lock:
+        if key in layer_info_cache:
+            return True, layer_info_cache[key]
+    return False, None
+
+def cache_layer_info(service_url, service, service_version, layer_info):
+    # the download isn't held up by the lock, so another dumper could have got there first
+    key = (service_url, service, service_version)
+    with layer_info_lock:
+        return layer_info_cache.setdefault(key, layer_info)
+
+def find_layer_info(layer_info, layername):
+    if layer_info is None:
+        return None
+    if layername in layer_info:
+        return layer_info[layername]
+    # the names may or may not carry the namespace prefix, depending on the endpoint
+    local_layername = layername.split(':')[-1]
+    found = [ info for name, info in layer_info.items()
+              if name.split(':')[-1] == local_layername ]
+    if len(found) != 1:
+        return None
+    return found[0]
+
 
-    return resp.text
-
-def matches(path, expected):
-    got = [ p[0] for p in path ]
-    got = got[:len(expected)]
-    return got == expected
-
-def convert_item(item):
-    if not isinstance(item, dict):
-        return item
-    return item.get('#text', None)
-
-def parse_capabilities(service, xml_txt, layer_list, service_info):
-    exceptions = []
-
-    def process_error_2(path, item):
-        if matches(path, ['ServiceExceptionReport', 'ServiceException']):
-            item = convert_item(item)
-            if item is not None:
-                exceptions.append(item)
-        return True
-
-    def process_error_3(path, item):
-        if matches(path, ['ows:ExceptionReport', 'ows:Exception', 'ows:ExceptionText']):
-            item = convert_item(item)
-            if item is not None:
-                exceptions.append(item)
-        return True
-
-    def process_wms_5(path, item):
-        if matches(path, ['WMT_MS_Capabilities', 'Capability', 'Layer', 'Layer', 'Name']) or \
-           matches(path, ['WMS_Capabilities', 'Capability', 'Layer', 'Layer', 'Name']):
-            item = convert_item(item)
-            if item is not None:
-                layer_list.append(item)
-        for request_type in ['GetMap', 'GetFeatureInfo']:
-            if matches(path, ['WMT_MS_Capabilities', 'Capability', 'Request', request_type, 'Format']) or \
-               matches(path, ['WMS_Capabilities', 'Capability', 'Request', request_type, 'Format']):
-                item = convert_item(item)
-                if item is None:
-                    continue
-                if request_type not in service_info:
-                    service_info[request_type] = []
-                service_info[request_type].append(item)
-        return True
-
-    def process_wfs_6(path, item):
-        if matches(path, ['WFS_Capabilities', 'Capability', 'Request', 'GetFeature', 'ResultFormat']):
-            if 'GetFeature' not in service_info:
-                service_info['GetFeature'] = []
-            service_info['GetFeature'].append(path[-1][0])
-        return True
-
-    def process_wfs_4(path, item):
-        if matches(path, ['WFS_Capabilities', 'FeatureTypeList', 'FeatureType', 'Name']):
-            item = convert_item(item)
-            if item is not None:
-                layer_list.append(item)
-        return True
-
-    if service == 'WMS':
-        xmltodict.parse(xml_txt, item_depth=5, item_callback=process_wms_5)
-    else:
-        xmltodict.parse(xml_txt, item_depth=6, item_callback=process_wfs_6)
-        xmltodict.parse(xml_txt, item_depth=4, item_callback=process_wfs_4)
-
-    xmltodict.parse(xml_txt, item_depth=2, item_callback=process_error_2)
-    xmltodict.parse(xml_txt, item_depth=3, item_callback=process_error_3)
-
-    if len(exceptions) > 0:
-        check_error_msg(exceptions[0])
-
-
-def fill_layer_list(layer_list, service_info, service_url, service, service_version, namespace=None, **req_args):
-    xml_txt = get_capabilities(service_url, service, service_version, namespace=namespace, **req_args)
-    optionally_save_to_file(xml_txt)
-
-    logger.info('parsing capabilities')
-    parse_capabilities(service, xml_txt, layer_list, service_info)
+def fill_layer_list(layer_list, service_info, service_url, service, service_version,
+                    namespace=None, layer_info=None, **req_args):
+    # parsed as it downloads, big servers have capabilities running into the tens of MBs
+    with request_capabilities(service_url, service, service_version,
+                              namespace=namespace, **req_args) as resp:
+        parser = CapabilitiesStreamParser(service, layer_list, service_info, layer_info)
+        parser = optionally_save_stream_to_file(parser)
+        logger.info('parsing capabilities')
+        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+            parser.feed(chunk)
+    parser.close()
 
@@ -0,0 +1,43 @@
+import logging
+import threading
+
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    Counts consecutive retryable failures per host. Once the threshold is
+    crossed the host is considered down and all requests to it are held back
+    through the rate limiter for the cooldown period. Every failure after
+    that doubles the cooldown (up to max_cooldown) until a request succeeds.
+    A threshold of 0 switches the breaker off.
+    """
+    def __init__(self, rate_limiter, threshold=5, cooldown=60, max_cooldown=900):
+        self.rate_limiter = rate_limiter
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def record_success(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.failures.pop(host, None)
+
+    def record_failure(self, url):
+        if self.threshold <= 0:
+            return
+
+        host = urlparse(url).netloc
+        with self.lock:
+            count = self.failures.get(host, 0) + 1
+            self.failures[host] = count
+            if count < self.threshold:
+                return
+            secs = min(self.max_cooldown, self.cooldown * 2 ** (count - self.threshold))
+
+        logger.warning(f'{count} consecutive failures talking to {host}, '
+                       f'holding off all requests to it for {secs} secs')
+        self.rate_limiter.defer(url, secs)
@@ -1,23 +1,34 @@
+import os
 import re
-import json
 import logging
 
 from pprint import pprint
 from pathlib import Path
 
+from concurrent.futures import ThreadPoolExecutor
+
 import click
 import requests
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
-from wmsdump.state import get_state_from_files
+from wmsdump import json_codec
+from wmsdump.state import (
+    get_state_from_files, get_state_path,
+    STATE_DURABILITY, STATE_BACKENDS
+)
+from wmsdump.state_db import get_state_from_db
 from wmsdump.geoserver import get_layer_list_from_page
 from wmsdump.capabilities import fill_layer_list
+from wmsdump.hits_helper import supports_hits
 from wmsdump.dumper import (
     OGCServiceDumper, DEFAULTS,
     bbox_to_str, get_global_bounds
 )
 from wmsdump.logging import setup_logging
+from wmsdump.rate_limiter import RateLimiter, HostConcurrencyLimiter
+from wmsdump.circuit_breaker import CircuitBreaker
+from wmsdump.parse_helper import create_parse_pool
 from wmsdump.errors import (
     SortKeyRequiredException, InvalidSortKeyException,
     WFSUnsupportedException, KMLUnsupportedException,
@@ -54,26 +65,34 @@ def handle_layer_list(layer_list, output_file):
                 f.write('\n')
 
 class FileWriter:
-    def __init__(self, fname, keep_idx):
+    def __init__(self, fname, keep_idx, json_backend=None, line_offsets=None):
         self.file = Path(fname)
         self.fh = None
         self.keep_idx = keep_idx
+        self.json_backend = json_backend
         self.count = 0
         self.idx_map = {}
         if self.keep_idx:
-            self.init_idx()
+            if line_offsets is not None:
+                # kept in step with the file by the state store
+                self.idx_map = line_offsets
+                self.count = line_offsets.count
+                if self.count == 0:
+                    self.idx_map[0] = 0
+            else:
+                self.init_idx()
 
     def init_idx(self):
         self.idx_map[self.count] = 0
         if not self.file.exists():
             return
-        with open(self.file, 'r') as f:
+        with open(self.file, 'r', encoding='utf-8') as f:
             while True:
                 line = f.readline()
-                self.count += 1
-                self.idx_map[self.count] = f.tell()
                 if line == '':
                     break
+                self.count += 1
+                self.idx_map[self.count] = f.tell()
 
     def get(self, n):
         if not self.keep_idx or \
@@ -81,22 +100,35 @@ class FileWriter:
            not self.file.exists():
             return None
 
-        with open(self.file, 'r') as f:
+        # the line asked for could still be sitting in the write buffer
+        if self.fh is not None:
+            self.fh.flush()
+
+        with open(self.file, 'r', encoding='utf-8') as f:
             f.seek(self.idx_map[n])
             line = f.readline()
             line = line.strip('\n')
             return line
 
-    def write(self, feat):
+    def write(self, feat, feat_str=None):
         if self.fh is None:
-            self.fh = open(self.file, 'a')
+            self.fh = open(self.file, 'a', encoding='utf-8')
 
-        self.fh.write(json.dumps(feat))
+        if feat_str is None:
+            feat_str = json_codec.dumps(feat, self.json_backend)
+        self.fh.write(feat_str)
         self.fh.write('\n')
         if self.keep_idx:
             self.count += 1
             self.idx_map[self.count] = self.fh.tell()
 
+    def flush(self, sync=False):
+        if self.fh is None:
+            return
+        self.fh.flush()
+        if sync:
+            os.fsync(self.fh.fileno())
+
     def close(self):
         if self.fh is not None:
             self.fh.close()
@@ -267,97 +299,192 @@ def explore(geoserver_url, service_url, service, service_version, namespace, scr
     handle_layer_list(layer_list, output_file)
 
 
-@main.command()
-@click.argument('layername',
-                required=True)
-@click.argument('output-file',
-                type=click.Path(), required=False)
-@click.option('--output-dir', '-d',
-              type=click.Path(file_okay=False), default='.',
-              help='directory to write output files in. Only used when "output-file" is not given')
-@click.option('--geoserver-url', '-g',
-              help='Url of the geoserver endpoint.'
-                   ' service-url is assumed to be <geoserver_url>/[<layer_namespace>/]ows')
-@click.option('--service-url', '-u',
-              help='Url of the wms/wfs endpoint from which we can retrieve data. '
-                   'If not provided, will be derived from geoserver-url')
-@click.option('--service', '-s',
-              type=click.Choice(['WMS', 'WFS'], case_sensitive=False),
-              default='WFS', show_default=True,
-              help='service to use for extracting data, one of WFS or WMS')
-@click.option('--service-version', '-v',
-              help='the protocol version to use. defaults to'
-                   f' \'{DEFAULTS["wms_version"]}\' for WMS and \'{DEFAULTS["wfs_version"]}\' for WFS')
-@click.option('--retrieval-mode', '-m',
-              type=click.Choice(['OFFSET', 'EXTENT'], case_sensitive=False),
-              default=DEFAULTS['retrieval_mode'], show_default=True,
-              help='which method to use to batch record retrieval, OFFSET uses record offset paging, '
-                   'EXTENT uses bbox splitting and drilling down by spatial extent, '
-                   'when using GetFeatureInfo this will be overriden to EXTENT')
-@click.option('--operation', '-o',
-              type=click.Choice(['GetMap', 'GetFeatureInfo'], case_sensitive=False),
-              default=DEFAULTS['operation'], show_default=True,
-              help='which operation to use for querying a WMS endpoint')
-@click.option('--flavor', 
-              type=click.Choice(['Geoserver', 'QGISserver'], case_sensitive=False),
-              default=DEFAULTS['flavor'], show_default=True,
-              help='vendor of the WMS services, useful to specify for GetFeatureInfo based retrieval')
-@click.option('--sort-key', '-k',
-              help='key to use to do paged retrieval')
-@click.option('--batch-size', '-b',
-              type=int, default=DEFAULTS['batch_size'], show_default=True,
-              help='batch size to use for retrieval')
-@click.option('--pause-seconds', '-p',
-              type=int, default=DEFAULTS['pause_seconds'], show_default=True,
-              help='amount of time to pause between a batch of requests')
-@click.option('--requests-to-pause', 
-              type=int, default=DEFAULTS['requests_to_pause'], show_default=True,
-              help='number of requests to make before pausing for --pause-seconds')
-@click.option('--max-attempts', 
-              type=int, default=DEFAULTS['max_attempts'], show_default=True,
-              help='number of times to attempt a request before giving up')
-@click.option('--retry-delay', '-r',
-              type=int, default=DEFAULTS['retry_delay'], show_default=True,
-              help='number of secs to wait before retrying on failure.. '
-                   'for each failure the delay is incremented by the same number')
-@click.option('--geometry-precision', '-g',
-              type=int, default=DEFAULTS['geometry_precision'], show_default=True,
-              help='decimal point precision of geometry to be returned, '
-                   'truncation is done on client side. -1 means no truncation')
-@click.option('--getmap-format', '-f',
-              type=click.Choice(['KML', 'GEORSS'], case_sensitive=False),
-              default=DEFAULTS['getmap_format'], show_default=True,
-              help='which format to use while pulling using WMS GetMap')
-@click.option('--kml-strip-point/--no-kml-strip-point',
-              default=DEFAULTS['kml_strip_point'], show_default=True,
-              help='Whether to strip the points in polygons and linestring geomcollections')
-@click.option('--kml-keep-original-props/--no-kml-keep-original-props',
-              default=DEFAULTS['kml_keep_original_props'], show_default=True,
-              help='Whether to keep the original style related props in kml conversion')
-@click.option('--out-srs', 
-              default=DEFAULTS['out_srs'], show_default=True,
-              help='CRS to ask the server to return data in.. '
-                   'will be written out in the same CRS')
-@click.option('--bounds', 
-              help='bounds to restrict query to. defaults to CRS bounds. '
-                   f'format: "{EXPECTED_BOUNDS_FORMAT}"')
-@click.option('--max-box-dims',
-              help='when querying using EXTENT mode, maximum size of the bounding box to use.'
-                   f' format: {EXPECTED_MAX_BOX_FORMAT}')
-@click.option('--skip-index', 
-              type=int, default=0, show_default=True,
-              help='skip n elements in index.. useful to skip records causing failure. '
-                   'only applicable when using OFFSET based retrieval') 
-def extract(layername, output_file, output_dir,
-            geoserver_url, service_url,
-            service, service_version, flavor,
-            retrieval_mode, operation, out_srs,
-            sort_key, batch_size, geometry_precision, 
-            requests_to_pause, pause_seconds, max_attempts,
-            getmap_format, kml_strip_point,
-            kml_keep_original_props,
-            retry_delay, bounds,
-            max_box_dims, skip_index):
+EXTRACT_OPTIONS = [
+    click.option('--output-dir', '-d',
+                 type=click.Path(file_okay=False), default='.',
+                 help='directory to write output files in. Only used when "output-file" is not given'),
+    click.option('--geoserver-url', '-g',
+                 help='Url of the geoserver endpoint.'
+                      ' service-url is assumed to be <geoserver_url>/[<layer_namespace>/]ows'),
+    click.option('--service-url', '-u',
+                 help='Url of the wms/wfs endpoint from which we can retrieve data. '
+                      'If not provided, will be derived from geoserver-url'),
+    click.option('--service', '-s',
+                 type=click.Choice(['WMS', 'WFS'], case_sensitive=False),
+                 default='WFS', show_default=True,
+                 help='service to use for extracting data, one of WFS or WMS'),
+    click.option('--service-version', '-v',
+                 help='the protocol version to use. defaults to'
+                      f' \'{DEFAULTS["wms_version"]}\' for WMS and \'{DEFAULTS["wfs_version"]}\' for WFS'),
+    click.option('--retrieval-mode', '-m',
+                 type=click.Choice(['OFFSET', 'EXTENT'], case_sensitive=False),
+                 default=DEFAULTS['retrieval_mode'], show_default=True,
+                 help='which method to use to batch record retrieval, OFFSET uses record offset paging, '
+                      'EXTENT uses bbox splitting and drilling down by spatial extent, '
+                      'when using GetFeatureInfo this will be overriden to EXTENT'),
+    click.option('--operation', '-o',
+                 type=click.Choice(['GetMap', 'GetFeatureInfo'], case_sensitive=False),
+                 default=DEFAULTS['operation'], show_default=True,
+                 help='which operation to use for querying a WMS endpoint'),
+    click.option('--flavor', 
+                 type=click.Choice(['Geoserver', 'QGISserver'], case_sensitive=False),
+                 default=DEFAULTS['flavor'], show_default=True,
+                 help='vendor of the WMS services, useful to specify for GetFeatureInfo based retrieval'),
+    click.option('--sort-key', '-k',
+                 help='key to use to do paged retrieval'),
+    click.option('--batch-size', '-b',
+                 type=int, default=DEFAULTS['batch_size'], show_default=True,
+                 help='batch size to use for retrieval'),
+    click.option('--adaptive-batch-size/--no-adaptive-batch-size',
+                 default=DEFAULTS['adaptive_batch_size'], show_default=True,
+                 help='grow the batch size while responses are fast and shrink it on '
+                      'timeouts and server errors, starting from --batch-size'),
+    click.option('--min-batch-size',
+                 type=int, default=DEFAULTS['min_batch_size'], show_default=True,
+                 help='smallest batch size to shrink to when adapting the batch size'),
+    click.option('--max-batch-size',
+                 type=int, default=DEFAULTS['max_batch_size'], show_default=True,
+                 help='largest batch size to grow to when adapting the batch size'),
+    click.option('--target-latency',
+                 type=float, default=DEFAULTS['target_latency'], show_default=True,
+                 help='response time in secs above which the batch size is reduced '
+                      'when adapting the batch size'),
+    click.option('--pause-seconds', '-p',
+                 type=int, default=DEFAULTS['pause_seconds'], show_default=True,
+                 help='amount of time to pause between a batch of requests'),
+    click.option('--requests-to-pause', 
+                 type=int, default=DEFAULTS['requests_to_pause'], show_default=True,
+                 help='number of requests to make before pausing for --pause-seconds'),
+    click.option('--requests-per-second',
+                 type=float, default=DEFAULTS['requests_per_second'],
+                 help='maximum rate of requests to make to the server, when given this '
+                      'replaces the --pause-seconds/--requests-to-pause schedule'),
+    click.option('--burst',
+                 type=int, default=DEFAULTS['burst'], show_default=True,
+                 help='number of requests which can be made back to back '
+                      'without waiting when using --requests-per-second'),
+    click.option('--max-attempts', 
+                 type=int, default=DEFAULTS['max_attempts'], show_default=True,
+                 help='number of times to attempt a request before giving up'),
+    click.option('--retry-delay', '-r',
+                 type=int, default=DEFAULTS['retry_delay'], show_default=True,
+                 help='number of secs to wait before retrying on failure.. '
+                      'for each failure the delay is doubled, with some random jitter'),
+    click.option('--max-retry-delay',
+                 type=int, default=DEFAULTS['max_retry_delay'], show_default=True,
+                 help='upper limit in secs on the delay between retries'),
+    click.option('--breaker-threshold',
+                 type=int, default=DEFAULTS['breaker_threshold'], show_default=True,
+                 help='number of consecutive failures after which the server is considered down '
+                      'and all requests to it are held back. 0 switches this off'),
+    click.option('--breaker-cooldown',
+                 type=int, default=DEFAULTS['breaker_cooldown'], show_default=True,
+                 help='number of secs to hold back requests once the server is considered down, '
+                      'doubled on every further failure'),
+    click.option('--geometry-precision', '-g',
+                 type=int, default=DEFAULTS['geometry_precision'], show_default=True,
+                 help='decimal point precision of geometry to be returned, '
+                      'truncation is done on client side. -1 means no truncation'),
+    click.option('--getmap-format', '-f',
+                 type=click.Choice(['KML', 'GEORSS'], case_sensitive=False),
+                 default=DEFAULTS['getmap_format'], show_default=True,
+                 help='which format to use while pulling using WMS GetMap'),
+    click.option('--kml-strip-point/--no-kml-strip-point',
+                 default=DEFAULTS['kml_strip_point'], show_default=True,
+                 help='Whether to strip the points in polygons and linestring geomcollections'),
+    click.option('--kml-keep-original-props/--no-kml-keep-original-props',
+                 default=DEFAULTS['kml_keep_original_props'], show_default=True,
+                 help='Whether to keep the original style related props in kml conversion'),
+    click.option('--out-srs', 
+                 default=DEFAULTS['out_srs'], show_default=True,
+                 help='CRS to ask the server to return data in.. '
+                      'will be written out in the same CRS'),
+    click.option('--bounds', 
+                 help='bounds to restrict query to. defaults to CRS bounds, or the extent of the layer '
+                      'from capabilities when using EXTENT based retrieval. '
+                      f'format: "{EXPECTED_BOUNDS_FORMAT}"'),
+    click.option('--layer-bounds/--no-layer-bounds',
+                 default=DEFAULTS['layer_bounds'], show_default=True,
+                 help='when using EXTENT based retrieval without "--bounds", start from the extent of '
+                      'the layer advertised in capabilities instead of the CRS bounds'),
+    click.option('--max-box-dims',
+                 help='when querying using EXTENT mode, maximum size of the bounding box to use.'
+                      f' format: {EXPECTED_MAX_BOX_FORMAT}'),
+    click.option('--tile-depth',
+                 type=int,
+                 help='when using EXTENT based retrieval, boxes this many splits deep which still have '
+                      'too many records are paged through with startIndex instead of being split further. '
+                      'not applicable for GetFeatureInfo'),
+    click.option('--split-strategy',
+                 type=click.Choice(['QUAD', 'MEDIAN'], case_sensitive=False),
+                 default=DEFAULTS['split_strategy'], show_default=True,
+                 help='when using EXTENT based retrieval, how to split a box with too many records.. '
+                      'QUAD splits it into four equal quadrants, MEDIAN splits it at the median '
+                      'position of the records already returned for it'),
+    click.option('--probe-hits/--no-probe-hits',
+                 default=DEFAULTS['probe_hits'], show_default=True,
+                 help='when using WFS with EXTENT based retrieval, ask the server for the number of '
+                      'records in a box (resultType=hits) first, boxes with too many records are split '
+                      'without downloading them'),
+    click.option('--concurrency', '-c',
+                 type=int, default=DEFAULTS['concurrency'], show_default=True,
+                 help='number of requests to keep in flight in parallel. '
+                      'with OFFSET based retrieval this is the number of pages prefetched'),
+    click.option('--parse-workers', '-P',
+                 type=int, default=DEFAULTS['parse_workers'], show_default=True,
+                 help='number of processes to parse KML/GeoRSS responses with when using GetMap, '
+                      'the next requests go out while these are busy. 0 parses on the fetching threads'),
+    click.option('--state-durability',
+                 type=click.Choice(STATE_DURABILITY, case_sensitive=False),
+                 default=DEFAULTS['state_durability'], show_default=True,
+                 help='how hard to try to keep the progress in the state file across crashes.. '
+                      'fsync syncs every update to disk, flush hands every update over to the OS '
+                      'which is enough to survive the process dying, lazy writes updates out every second'),
+    click.option('--state-backend',
+                 type=click.Choice(STATE_BACKENDS, case_sensitive=False),
+                 default=DEFAULTS['state_backend'], show_default=True,
+                 help='where to keep the progress.. json keeps it in a .state file, sqlite in a '
+                      '.state.db database along with the hashes and offsets of the records written, '
+                      'which lets very large extractions resume without reading through the output file'),
+    click.option('--verify-dedup/--no-verify-dedup',
+                 default=DEFAULTS['verify_dedup'], show_default=True,
+                 help='when using EXTENT based retrieval, read back the record with the same digest to '
+                      'compare before dropping a record as a duplicate. Needs the output file to be read '
+                      'through on resume'),
+    click.option('--dedup-key',
+                 default=DEFAULTS['dedup_key'],
+                 help='when using EXTENT based retrieval, drop records with the same value of this as '
+                      'duplicates instead of comparing their contents.. "id" for the feature id, or the '
+                      'name of a property. records without it are compared by their contents. '
+                      'records sharing the key but differing otherwise, like the parts of a feature '
+                      'GetMap returns separately, are dropped too'),
+]
+
+def extract_options(f):
+    # options shared by the extract and extract-many commands
+    for option in reversed(EXTRACT_OPTIONS):
+        f = option(f)
+    return f
+
+
+def extract_layer(layername, output_file, output_dir,
+                  geoserver_url, service_url,
+                  service, service_version, flavor,
+                  retrieval_mode, operation, out_srs,
+                  sort_key, batch_size, adaptive_batch_size,
+                  min_batch_size, max_batch_size, target_latency,
+                  geometry_precision, 
+                  requests_to_pause, pause_seconds,
+                  requests_per_second, burst, max_attempts,
+                  getmap_format, kml_strip_point,
+                  kml_keep_original_props,
+                  retry_delay, max_retry_delay,
+                  breaker_threshold, breaker_cooldown, bounds, layer_bounds,
+                  max_box_dims, tile_depth, split_strategy, probe_hits, concurrency,
+                  parse_workers, state_durability, state_backend, verify_dedup, dedup_key,
+                  skip_index=0,
+                  session=None, rate_limiter=None,
+                  circuit_breaker=None, host_limiter=None, parse_pool=None):
 
     if service_version is None:
         service_version = DEFAULTS['wms_version'] if service == 'WMS' else DEFAULTS['wfs_version']
@@ -373,7 +500,7 @@ def extract(layername, output_file, output_dir,
     if geoserver_url is None and service_url is None:
         logger.error('Invalid invocation: '
                      'One of "--service-url" or "--geoserver-url" must be provided')
-        return
+        return False
 
     if output_file is None:
         output_file = re.sub(r'[^\w\d-]','_', layername) + '.geojsonl'
@@ -392,55 +519,110 @@ def extract(layername, output_file, output_dir,
             service_url = add_to_url(geoserver_url, f'{parts[0]}/ows')
         else:
             logger.error(f'{layername} is of unexpected format.. has more than one ":"')
-            return
+            return False
 
-    if bounds is None:
-        bounds = get_global_bounds(out_srs)
-        logger.info(f'working with bounds: {bbox_to_str(bounds, None)}')
-    else:
+    # left to the dumper to work out when not given
+    if bounds is not None:
         try:
             bounds = get_bounds_from_str(bounds, out_srs)
         except Exception:
             logger.error(f'Invalid bounds string: "{bounds}"')
-            return
+            return False
 
     if retrieval_mode == 'EXTENT' and max_box_dims is not None:
         try:
             max_box_dims = get_box_dims(max_box_dims)
         except Exception:
             logger.error(f'Invalid max box dimensions string: "{max_box_dims}"')
-            return
+            return False
 
 
     logger.info(f'working with {service_url=} and {layername=}, '
                 f'{service=} and {operation=}, mode={retrieval_mode}')
 
-    state_file = output_file + '.state'
-
-    state = get_state_from_files(state_file, output_file,
-                                 url=service_url,
-                                 layername=layername,
-                                 service=service,
-                                 version=service_version,
-                                 operation=operation,
-                                 mode=retrieval_mode,
-                                 sort_key=sort_key)
-    if state is None:
-        return
-
     if skip_index != 0 and retrieval_mode != 'OFFSET':
         logger.error('skip-index can\'t be used for non OFFSET based retrieval')
-        return
+        return False
+
+    if concurrency < 1:
+        logger.error('concurrency should be atleast 1')
+        return False
+
+    if parse_workers < 0:
+        logger.error('parse-workers can\'t be negative')
+        return False
+
+    if tile_depth is not None:
+        if retrieval_mode != 'EXTENT':
+            logger.error('tile-depth can only be used with EXTENT based retrieval')
+            return False
+        if operation == 'GetFeatureInfo':
+            logger.error('tile-depth can\'t be used with GetFeatureInfo')
+            return False
+        if tile_depth < 0:
+            logger.error('tile-depth can\'t be negative')
+            return False
+
+    if dedup_key is not None and retrieval_mode != 'EXTENT':
+        logger.error('dedup-key can only be used with EXTENT based retrieval')
+        return False
+
+    if probe_hits and service != 'WFS':
+        logger.error('probe-hits can only be used with WFS')
+        return False
+
+    if probe_hits and not supports_hits(service_version):
+        logger.error(f'probe-hits needs WFS version 1.1.0 or later, not {service_version}.. '
+                     'use "--service-version 1.1.0"?')
+        return False
 
     if skip_index < 0:
         logger.error('skip index can\'t be negative')
-        return
+        return False
+
+    state_file = get_state_path(output_file, state_backend)
+    for other_backend in STATE_BACKENDS:
+        if other_backend != state_backend and \
+           Path(get_state_path(output_file, other_backend)).exists():
+            logger.error(f'{output_file} was being extracted with the {other_backend} state backend.. '
+                         f'use "--state-backend {other_backend}" to resume it')
+            return False
+
+    get_state = get_state_from_db if state_backend == 'sqlite' else get_state_from_files
+    state = get_state(state_file, output_file,
+                      url=service_url,
+                      layername=layername,
+                      service=service,
+                      version=service_version,
+                      operation=operation,
+                      mode=retrieval_mode,
+                      sort_key=sort_key,
+                      dedup_key=dedup_key,
+                      durability=state_durability)
+    if state is None:
+        return False
+
+    if retrieval_mode == 'EXTENT' and bounds is not None and \
+       state.bounds is not None and state.bounds != bounds:
+        logger.error(f'bounds given: {bbox_to_str(bounds, None)} not the same as the ones '
+                     f'the extraction started with: {bbox_to_str(state.bounds, None)}')
+        state.store.close()
+        return False
 
     if skip_index > 0:
         state.update(skip_index, 0)
 
+    # records are only read back to compare them when the hashes aren't exact
+    keep_idx = False
+    if retrieval_mode == 'EXTENT':
+        state.verify_dedup = verify_dedup
+        keep_idx = verify_dedup or not state.done.exact
+    line_offsets = state.store.line_offsets
     writer = FileWriter(output_file,
-                        keep_idx=(retrieval_mode == 'EXTENT'))
+                        keep_idx=(keep_idx or line_offsets is not None),
+                        json_backend=state.encode_backend,
+                        line_offsets=line_offsets)
+    state.store.flush_output = writer.flush
 
     dumper = OGCServiceDumper(service_url, layername, service,
                               service_version=service_version,
@@ -448,11 +630,20 @@ def extract(layername, output_file, output_dir,
                               retrieval_mode=retrieval_mode,
                               flavor=flavor,
                               batch_size=batch_size,
+                              adaptive_batch_size=adaptive_batch_size,
+                              min_batch_size=min_batch_size,
+                              max_batch_size=max_batch_size,
+                              target_latency=target_latency,
                               sort_key=sort_key,
                               state=state,
                               requests_to_pause=requests_to_pause,
                               pause_seconds=pause_seconds,
+                              requests_per_second=requests_per_second,
+                              burst=burst,
                               retry_delay=retry_delay,
+                              max_retry_delay=max_retry_delay,
+                              breaker_threshold=breaker_threshold,
+                              breaker_cooldown=breaker_cooldown,
                               max_attempts=max_attempts,
                               geometry_precision=geometry_precision,
                               getmap_format=getmap_format,
@@ -460,16 +651,32 @@ def extract(layername, output_file, output_dir,
                               kml_keep_original_props=kml_keep_original_props,
                               out_srs=out_srs,
                               bounds=bounds,
+                              layer_bounds=layer_bounds,
                               max_box_dims=max_box_dims,
+                              tile_depth=tile_depth,
+                              split_strategy=split_strategy,
+                              probe_hits=probe_hits,
+                              concurrency=concurrency,
+                              parse_workers=parse_workers,
+                              parse_pool=parse_pool,
+                              session=session,
+                              rate_limiter=rate_limiter,
+                              circuit_breaker=circuit_breaker,
+                              host_limiter=host_limiter,
                               get_nth=writer.get,
                               req_params=req_params)
 
+    done = False
     dump_samples = False
     try:
         for feat in dumper:
-            writer.write(feat)
-        Path(state_file).unlink()
+            writer.write(feat, state.get_encoded(feat))
+        if retrieval_mode == 'EXTENT' and state.dedup_key is not None:
+            logger.info(f'dropped {state.key_duplicates} records as duplicates of ones '
+                        f'with the same {state.dedup_key}')
+        state.store.remove()
         logger.info('Done!!!')
+        done = True
     except SortKeyRequiredException:
         logger.error('failed to iterate over records as no sorting key is specified. '
                      'use "--sort-key/-k"?')
@@ -495,6 +702,7 @@ def extract(layername, output_file, output_dir,
                      'check available layers using the "explore" command')
     finally:
         writer.close()
+        state.store.close()
 
     if dump_samples:
         logger.info('dumping a couple of records to inspect and pick a sorting key')
@@ -502,5 +710,99 @@ def extract(layername, output_file, output_dir,
         for feat in feats:
             pprint(feat['properties'])
 
+    return done
+
+
+@main.command()
+@click.argument('layername',
+                required=True)
+@click.argument('output-file',
+                type=click.Path(), required=False)
+@extract_options
+@click.option('--skip-index', 
+              type=int, default=0, show_default=True,
+              help='skip n elements in index.. useful to skip records causing failure. '
+                   'only applicable when using OFFSET based retrieval') 
+def extract(**params):
+    extract_layer(**params)
+
+
+def read_layer_list(layer_list_file):
+    layers = []
+    with open(layer_list_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            layers.append(line)
+    return layers
+
+
+@main.command('extract-many')
+@click.argument('layer-list-file',
+                type=click.Path(exists=True, dir_okay=False), required=True)
+@extract_options
+@click.option('--layer-workers', '-w',
+              type=int, default=4, show_default=True,
+              help='number of layers to extract in parallel')
+@click.option('--host-concurrency',
+              type=int,
+              help='maximum number of requests in flight to a host across all the layers')
+def extract_many(layer_list_file, layer_workers, host_concurrency, **params):
+    if layer_workers < 1:
+        logger.error('layer-workers should be atleast 1')
+        return
+
+    if host_concurrency is not None and host_concurrency < 1:
+        logger.error('host-concurrency should be atleast 1')
+        return
+
+    layers = read_layer_list(layer_list_file)
+    logger.info(f'extracting {len(layers)} layers from {layer_list_file}')
+
+    # one connection pool, request rate and circuit breaker per host for all the layers
+    session = requests.session()
+    pool_size = layer_workers * params['concurrency']
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    rate_limiter = RateLimiter(params['requests_per_second'], params['burst'])
+    circuit_breaker = CircuitBreaker(rate_limiter,
+                                     threshold=params['breaker_threshold'],
+                                     cooldown=params['breaker_cooldown'])
+    host_limiter = HostConcurrencyLimiter(host_concurrency)
+
+    # and one set of parsing processes
+    parse_pool = None
+    if params['parse_workers'] > 0:
+        parse_pool = create_parse_pool(params['parse_workers'])
+
+    def run(layername):
+        try:
+            return extract_layer(layername, None,
+                                 session=session,
+                                 rate_limiter=rate_limiter,
+                                 circuit_breaker=circuit_breaker,
+                                 host_limiter=host_limiter,
+                                 parse_pool=parse_pool,
+                                 **params)
+        except Exception:
+            logger.exception(f'failed to extract {layername}')
+            return False
+
+    try:
+        with ThreadPoolExecutor(max_workers=layer_workers) as executor:
+            results = list(executor.map(run, layers))
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown(wait=True, cancel_futures=True)
+
+    failed = [ layer for layer, done in zip(layers, results) if not done ]
+    logger.info(f'extracted {len(layers) - len(failed)} of {len(layers)} layers')
+    for layer in failed:
+        logger.error(f'incomplete: {layer}')
+
 
        
@@ -0,0 +1,184 @@
+import os
+import mmap
+import struct
+import logging
+
+from hashlib import blake2b
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEDUP_SUFFIX = '.dedup'
+
+MAGIC = b'WMSDEDUP'
+VERSION = 1
+DIGEST_SIZE = 16
+# magic, version, digest size, number of slots, lines covered, bytes of the output covered
+HEADER = struct.Struct('<8sIIQQQ')
+HEADER_SIZE = 64
+# the digest followed by the line number plus one, zero for an empty slot
+SLOT = struct.Struct(f'<{DIGEST_SIZE}sQ')
+EMPTY = bytes(8)
+# small extractions get a small file, the table grows by doubling from there
+MIN_CAPACITY = 1024
+# the table is doubled once more than this fraction of the slots are taken
+MAX_LOAD = 0.5
+
+def get_dedup_path(output_file):
+    return Path(str(output_file) + DEDUP_SUFFIX)
+
+def get_digest(f_str):
+    return blake2b(f_str.encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+def get_start(digest, mask):
+    return int.from_bytes(digest[:8], 'little') & mask
+
+def insert(mm, mask, digest, idx):
+    pos = get_start(digest, mask)
+    while True:
+        off = HEADER_SIZE + pos * SLOT.size
+        if mm[off + DIGEST_SIZE:off + SLOT.size] == EMPTY:
+            SLOT.pack_into(mm, off, digest, idx + 1)
+            return
+        pos = (pos + 1) & mask
+
+
+class DigestIndex:
+    """
+    FeatureHashes keyed by a 128 bit blake2b digest, kept in a memory mapped
+    hash table with linear probing in a file next to the output. With digests
+    this long a match is taken as the same feature, without reading the line back.
+
+    The lines added are held back till sync() is called with the number of lines
+    and bytes in the output file, once those have been flushed, so the file never
+    has lines which are not in the output. Resuming only has to read the lines
+    after the ones it covers.
+    """
+    exact = True
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.mm = None
+        self.fh = None
+        self.capacity = 0
+        self.lines = 0
+        self.size = 0
+        self.pending = {}
+        self.pending_count = 0
+        # created with the first sync
+        if self.path.exists():
+            try:
+                self.open()
+            except Exception as ex:
+                # replaced by the first sync, with all of the lines read in again
+                logger.warning(f'unable to use {self.path}: {ex}')
+
+    def open(self):
+        fh = open(self.path, 'r+b')
+        header = fh.read(HEADER.size)
+        valid = False
+        if len(header) == HEADER.size:
+            magic, version, digest_size, capacity, lines, size = HEADER.unpack(header)
+            valid = magic == MAGIC and version == VERSION and digest_size == DIGEST_SIZE and \
+                    capacity >= MIN_CAPACITY and capacity & (capacity - 1) == 0 and \
+                    os.fstat(fh.fileno()).st_size == HEADER_SIZE + capacity * SLOT.size
+        if not valid:
+            fh.close()
+            raise Exception(f'{self.path} is not a dedup index')
+        self.fh = fh
+        self.mm = mmap.mmap(fh.fileno(), 0)
+        self.capacity = capacity
+        self.lines = lines
+        self.size = size
+
+    def create(self, path, capacity):
+        fh = open(path, 'w+b')
+        fh.truncate(HEADER_SIZE + capacity * SLOT.size)
+        mm = mmap.mmap(fh.fileno(), 0)
+        return fh, mm
+
+    def write_header(self, mm, capacity):
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, DIGEST_SIZE, capacity, self.lines, self.size)
+
+    def grow(self, count):
+        capacity = max(self.capacity, MIN_CAPACITY)
+        while count > capacity * MAX_LOAD:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+
+        # filled in a new file which replaces the old one once complete
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        fh, mm = self.create(tmp_path, capacity)
+        mask = capacity - 1
+        if self.mm is not None:
+            with memoryview(self.mm) as view, view[HEADER_SIZE:] as slots:
+                for digest, idx_plus in SLOT.iter_unpack(slots):
+                    if idx_plus != 0:
+                        insert(mm, mask, digest, idx_plus - 1)
+        self.write_header(mm, capacity)
+        mm.flush()
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.fh = fh
+        self.mm = mm
+        self.capacity = capacity
+
+    def hash(self, f_str):
+        return get_digest(f_str)
+
+    def get(self, digest):
+        idxs = []
+        if self.mm is not None:
+            mask = self.capacity - 1
+            pos = get_start(digest, mask)
+            while True:
+                found, idx_plus = SLOT.unpack_from(self.mm, HEADER_SIZE + pos * SLOT.size)
+                if idx_plus == 0:
+                    break
+                if found == digest:
+                    idxs.append(idx_plus - 1)
+                pos = (pos + 1) & mask
+        idxs.extend(self.pending.get(digest, ()))
+        return idxs
+
+    def add(self, digest, idx):
+        idxs = self.pending.get(digest, None)
+        if idxs is None:
+            self.pending[digest] = [ idx ]
+        else:
+            idxs.append(idx)
+        self.pending_count += 1
+
+    def sync(self, lines, size, fsync=False):
+        if self.mm is None and lines == 0:
+            return
+        self.grow(self.lines + self.pending_count)
+        mask = self.capacity - 1
+        for digest, idxs in self.pending.items():
+            for idx in idxs:
+                insert(self.mm, mask, digest, idx)
+        self.pending = {}
+        self.pending_count = 0
+        self.lines = lines
+        self.size = size
+        self.write_header(self.mm, self.capacity)
+        if fsync:
+            self.mm.flush()
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def remove(self):
+        self.close()
+        self.pending = {}
+        self.pending_count = 0
+        self.capacity = 0
+        self.lines = 0
+        self.size = 0
+        self.path.unlink(missing_ok=True)
@@ -1,7 +1,12 @@
 import math
 import time
-import json
+import random
 import logging
+import threading
+
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 from pprint import pformat
 
@@ -13,12 +18,28 @@ try:
 except ImportError:
     pyproj_available = False
 
+from . import json_codec
 from .state import State, Extent
-from .georss_helper import georss_extract_features
-from .kml_helper import kml_extract_features
+from .capabilities import (
+    LayerInfoParser, get_capabilities_params,
+    get_cached_layer_info, cache_layer_info, find_layer_info
+)
+from .batch_sizer import BatchSizer
+from .rate_limiter import RateLimiter, HostConcurrencyLimiter, get_retry_after
+from .circuit_breaker import CircuitBreaker
+from .props_helper import PropsExtractor
+from .parse_helper import (
+    PoolParser, create_parse_pool,
+    get_getmap_stream_parser, parse_getmap_response
+)
+from .hits_helper import get_hits_count, supports_hits
+from .split_helper import SPLIT_STRATEGIES, get_split_point
+from .geojson_helper import GeoJSONStreamParser
+from .precision_helper import truncate_geometries
+from .stream_helper import CHUNK_SIZE, BufferedParser, optionally_save_stream_to_file
 from .errors import (
     handle_error_xml, KnownException, ZeroAreaException,
-    optionally_save_to_file
+    RequestFailedException, UnknownServiceException, is_retryable
 )
 
 logger = logging.getLogger(__name__)
@@ -47,6 +68,62 @@ def get_global_bounds(crs_str):
     b = transformer.transform_bounds(*crs.area_of_use.bounds)
     return { 'xmin': b[0], 'ymin': b[1], 'xmax': b[2], 'ymax': b[3] } 
 
+# the advertised extent of a layer is padded by this fraction of its size,
+# for records right on its edges and for the rounding in the transforms
+LAYER_BOUNDS_MARGIN = 0.01
+# and by atleast this fraction of the CRS bounds, for layers with a single point
+LAYER_BOUNDS_MIN_MARGIN = 1e-7
+WEB_MERCATOR_RADIUS = 6378137.0
+WEB_MERCATOR_MAX_LAT = 85.06
+
+def lonlat_to_web_mercator(lon, lat):
+    lat = max(-WEB_MERCATOR_MAX_LAT, min(WEB_MERCATOR_MAX_LAT, lat))
+    x = WEB_MERCATOR_RADIUS * math.radians(lon)
+    y = WEB_MERCATOR_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+    return x, y
+
+def transform_lonlat_bounds(lonlat_bbox, crs_str):
+    if crs_str == 'EPSG:4326':
+        return list(lonlat_bbox)
+
+    if crs_str == 'EPSG:3857':
+        xmin, ymin = lonlat_to_web_mercator(lonlat_bbox[0], lonlat_bbox[1])
+        xmax, ymax = lonlat_to_web_mercator(lonlat_bbox[2], lonlat_bbox[3])
+        return [ xmin, ymin, xmax, ymax ]
+
+    if not pyproj_available:
+        return None
+
+    try:
+        transformer = Transformer.from_crs('EPSG:4326', crs_str, always_xy=True)
+        return list(transformer.transform_bounds(*lonlat_bbox))
+    except Exception:
+        logger.warning(f'Unable to transform layer extent to {crs_str}', exc_info=True)
+        return None
+
+def get_layer_bounds(lonlat_bbox, crs_str):
+    """
+    The extent of a layer as advertised in capabilities, in lon/lat,
+    as bounds in the given CRS. Returns None if it can't be worked out.
+    """
+    if lonlat_bbox is None:
+        return None
+
+    b = transform_lonlat_bounds(lonlat_bbox, crs_str)
+    if b is None or not all(math.isfinite(v) for v in b):
+        return None
+    if b[0] > b[2] or b[1] > b[3]:
+        return None
+
+    g = get_global_bounds(crs_str)
+    dx = max((b[2] - b[0]) * LAYER_BOUNDS_MARGIN, (g['xmax'] - g['xmin']) * LAYER_BOUNDS_MIN_MARGIN)
+    dy = max((b[3] - b[1]) * LAYER_BOUNDS_MARGIN, (g['ymax'] - g['ymin']) * LAYER_BOUNDS_MIN_MARGIN)
+    bounds = { 'xmin': max(b[0] - dx, g['xmin']), 'ymin': max(b[1] - dy, g['ymin']),
+               'xmax': min(b[2] + dx, g['xmax']), 'ymax': min(b[3] + dy, g['ymax']) }
+    if bounds['xmin'] >= bounds['xmax'] or bounds['ymin'] >= bounds['ymax']:
+        return None
+    return bounds
+
 
 DEFAULTS = {
     'retrieval_mode': 'OFFSET',
@@ -59,28 +136,31 @@ DEFAULTS = {
     'pause_seconds': 2,
     'max_attempts': 5,
     'retry_delay': 5,
+    'max_retry_delay': 300,
+    'breaker_threshold': 10,
+    'breaker_cooldown': 60,
     'geometry_precision': -1,
     'out_srs': 'EPSG:4326',
     'getmap_format': 'KML',
     'kml_strip_point': True,
     'kml_keep_original_props': False,
+    'concurrency': 1,
+    'adaptive_batch_size': False,
+    'min_batch_size': 100,
+    'max_batch_size': 10000,
+    'target_latency': 10,
+    'requests_per_second': None,
+    'burst': 1,
+    'probe_hits': False,
+    'split_strategy': 'QUAD',
+    'parse_workers': 0,
+    'state_durability': 'flush',
+    'state_backend': 'json',
+    'verify_dedup': False,
+    'dedup_key': None,
+    'layer_bounds': True,
 }
 
-def truncate_nested_coordinates(coords, precision):
-    if type(coords) is not list:
-        return round(float(coords), precision)
-
-    return [ truncate_nested_coordinates(c, precision) for c in coords ]
-
-def truncate_geometry(geom, precision):
-    if geom is None or precision == -1:
-        return 
-    if geom['type'] == 'GeometryCollection':
-        for subgeom in geom['geometries']:
-            truncate_geometry(subgeom, precision)
-    else:
-        geom['coordinates'] = truncate_nested_coordinates(geom['coordinates'], precision)
-
 def bbox_to_str(bounds, crs):
     b = bounds
 
@@ -98,19 +178,38 @@ class OGCServiceDumper:
                  operation=DEFAULTS['operation'],
                  flavor=DEFAULTS['flavor'],
                  batch_size=DEFAULTS['batch_size'],
+                 adaptive_batch_size=DEFAULTS['adaptive_batch_size'],
+                 min_batch_size=DEFAULTS['min_batch_size'],
+                 max_batch_size=DEFAULTS['max_batch_size'],
+                 target_latency=DEFAULTS['target_latency'],
                  out_srs=DEFAULTS['out_srs'],
                  sort_key=None,
                  state=None,
                  requests_to_pause=DEFAULTS['requests_to_pause'],
                  pause_seconds=DEFAULTS['pause_seconds'],
+                 requests_per_second=DEFAULTS['requests_per_second'],
+                 burst=DEFAULTS['burst'],
+                 rate_limiter=None,
                  retry_delay=DEFAULTS['retry_delay'],
+                 max_retry_delay=DEFAULTS['max_retry_delay'],
                  max_attempts=DEFAULTS['max_attempts'],
+                 breaker_threshold=DEFAULTS['breaker_threshold'],
+                 breaker_cooldown=DEFAULTS['breaker_cooldown'],
+                 circuit_breaker=None,
+                 host_limiter=None,
                  geometry_precision=DEFAULTS['geometry_precision'],
                  getmap_format=DEFAULTS['getmap_format'],
                  kml_strip_point=DEFAULTS['kml_strip_point'],
                  kml_keep_original_props=DEFAULTS['kml_keep_original_props'],
                  bounds=None,
+                 layer_bounds=DEFAULTS['layer_bounds'],
                  max_box_dims=None,
+                 probe_hits=DEFAULTS['probe_hits'],
+                 split_strategy=DEFAULTS['split_strategy'],
+                 tile_depth=None,
+                 concurrency=DEFAULTS['concurrency'],
+                 parse_workers=DEFAULTS['parse_workers'],
+                 parse_pool=None,
                  session=None,
                  get_nth=None,
                  req_params={}):
@@ -139,12 +238,26 @@ class OGCServiceDumper:
             retrieval_mode == 'EXTENT'
 
         self.out_srs = out_srs
-        if bounds is None:
-            bounds = get_global_bounds(out_srs)
-        self.bounds = bounds
 
         self.max_box_dims = max_box_dims
 
+        if probe_hits and service != 'WFS':
+            raise Exception('probing for hits is only supported with WFS')
+        if probe_hits and not supports_hits(self.service_version):
+            raise Exception('probing for hits needs WFS version 1.1.0 or later')
+        self.probe_hits = probe_hits
+
+        if split_strategy not in SPLIT_STRATEGIES:
+            raise Exception(f'split strategy should be one of {SPLIT_STRATEGIES}')
+        self.split_strategy = split_strategy
+
+        if tile_depth is not None:
+            if tile_depth < 0:
+                raise Exception('tile depth can\'t be negative')
+            if self.operation == 'GetFeatureInfo':
+                raise Exception('paging within tiles is not possible with GetFeatureInfo')
+        self.tile_depth = tile_depth
+
         self.retrieval_mode = retrieval_mode
 
         self.url = url
@@ -153,7 +266,8 @@ class OGCServiceDumper:
         self.getmap_format = getmap_format
         self.kml_strip_point = kml_strip_point
         self.kml_keep_original_props = kml_keep_original_props
-        self.initial_bounds = bounds
+        # shared across responses, to hold on to the layout of the descriptions
+        self.props_extractor = PropsExtractor()
         self.batch_size = batch_size
         self.sort_key = sort_key
         self.state = state
@@ -161,6 +275,7 @@ class OGCServiceDumper:
         self.pause_seconds = pause_seconds
         self.max_attempts = max_attempts
         self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
         self.req_params = req_params
         self.state = state
         if self.state is None:
@@ -177,13 +292,141 @@ class OGCServiceDumper:
 
         self.state.get_nth = get_nth
 
+        self.layer_bounds = layer_bounds
+        self.bounds = self.get_initial_bounds(bounds)
+        self.initial_bounds = self.bounds
+
         self.session = session
         if self.session is None:
             self.session = requests.session()
 
+        if concurrency < 1:
+            raise Exception('concurrency should be atleast 1')
+        self.concurrency = concurrency
+        self.executor = None
+
+        if parse_workers < 0:
+            raise Exception('parse workers can\'t be negative')
+        self.parse_workers = parse_workers
+        # GetMap responses get parsed in this process pool when there is one,
+        # a pool passed in is shared and left running
+        self.parse_pool = parse_pool
+        self.owns_parse_pool = False
+        # responses being parsed don't hold up the next downloads, upto concurrency
+        # requests are on the wire with upto parse_workers more being parsed
+        self.window = concurrency + parse_workers
+        self.fetch_slots = None
+        if parse_workers > 0:
+            self.fetch_slots = threading.BoundedSemaphore(concurrency)
+
+        self.sizer = None
+        if adaptive_batch_size:
+            # continue from the size tuned in a previous run if there is one
+            start_size = batch_size
+            if self.state.batch_size is not None:
+                start_size = self.state.batch_size
+            self.sizer = BatchSizer(start_size,
+                                    min_size=min(min_batch_size, batch_size),
+                                    max_size=max(max_batch_size, batch_size),
+                                    target_latency=target_latency,
+                                    confirmed=batch_size,
+                                    cap=self.state.batch_size_cap)
+            self.sync_batch_size()
+
+        # can be shared between dumpers hitting the same servers
+        self.rate_limiter = rate_limiter
+        if self.rate_limiter is None:
+            self.rate_limiter = RateLimiter(requests_per_second, burst)
+
+        self.circuit_breaker = circuit_breaker
+        if self.circuit_breaker is None:
+            self.circuit_breaker = CircuitBreaker(self.rate_limiter,
+                                                  threshold=breaker_threshold,
+                                                  cooldown=breaker_cooldown)
+
+        self.host_limiter = host_limiter
+        if self.host_limiter is None:
+            self.host_limiter = HostConcurrencyLimiter()
+
         self.req_count = 0
+        self.req_lock = threading.Lock()
+
+    def get_layer_info_parser(self):
+        return optionally_save_stream_to_file(LayerInfoParser(self.service))
+
+    def get_layer_info(self):
+        found, layer_info = get_cached_layer_info(self.url, self.service, self.service_version)
+        if found:
+            return layer_info
+
+        params = get_capabilities_params(self.service, self.service_version)
+        logger.info(f'getting capabilities from {self.url} for the extent of {self.layername}')
+        try:
+            layer_info = self.make_request(params, self.get_layer_info_parser)[0]
+        except Exception as ex:
+            logger.warning(f'Unable to read layer metadata from capabilities at {self.url}: {ex!r}')
+        return cache_layer_info(self.url, self.service, self.service_version, layer_info)
+
+    def get_layer_bounds(self, layer_info):
+        info = find_layer_info(layer_info, self.layername)
+        if info is None:
+            logger.info(f'extent of {self.layername} not found in capabilities')
+            return None
+
+        bounds = get_layer_bounds(info['bbox'], self.out_srs)
+        if bounds is None:
+            logger.info(f'extent of {self.layername} in capabilities is not usable with {self.out_srs}')
+        return bounds
+
+    def get_initial_bounds(self, bounds):
+        if self.retrieval_mode != 'EXTENT':
+            if bounds is None:
+                bounds = get_global_bounds(self.out_srs)
+            return bounds
+
+        # the explored tree is relative to the bounds it started from,
+        # so they are kept in the state and a resumed extraction sticks to them
+        state_bounds = self.state.bounds
+        if bounds is not None:
+            if state_bounds is not None and state_bounds != bounds:
+                raise Exception(f'bounds {bbox_to_str(bounds, None)} not the same '
+                                f'as the ones in state {bbox_to_str(state_bounds, None)}')
+        elif state_bounds is not None:
+            bounds = state_bounds
+        elif len(self.state.explored_tree) > 0:
+            # state from before the bounds were recorded, which started from the CRS bounds
+            bounds = get_global_bounds(self.out_srs)
+        else:
+            if self.layer_bounds:
+                # looked up from capabilities when the iteration starts
+                return None
+            bounds = get_global_bounds(self.out_srs)
 
-    def get_params_WFS(self, count, bounds, no_index, no_sort):
+        self.record_initial_bounds(bounds)
+        return bounds
+
+    def record_initial_bounds(self, bounds):
+        self.state.bounds = bounds
+        logger.info(f'working with bounds: {bbox_to_str(bounds, None)}')
+
+    def set_layer_bounds(self, layer_info):
+        bounds = self.get_layer_bounds(layer_info)
+        if bounds is None:
+            bounds = get_global_bounds(self.out_srs)
+        self.record_initial_bounds(bounds)
+        self.bounds = bounds
+        self.initial_bounds = bounds
+
+    def lookup_initial_bounds(self):
+        if self.initial_bounds is None:
+            self.set_layer_bounds(self.get_layer_info())
+
+    def get_start_index(self, start_index):
+        if start_index is None:
+            return self.state.index_done_till
+        return start_index
+
+    def get_params_WFS(self, count, bounds, no_index, no_sort, start_index=None):
 
         params = {
             'service': 'WFS',
@@ -194,7 +437,7 @@ class OGCServiceDumper:
             'srsName': self.out_srs,
         }
         if not no_index:
-            params['startIndex'] = self.state.index_done_till
+            params['startIndex'] = self.get_start_index(start_index)
 
         fc_key = 'count' if self.service_version == '2.0.0' else 'maxFeatures'
         params[fc_key] = count
@@ -207,7 +450,7 @@ class OGCServiceDumper:
 
         return params
 
-    def get_params_WMS_GetMap(self, count, bounds, no_index, no_sort):
+    def get_params_WMS_GetMap(self, count, bounds, no_index, no_sort, start_index=None):
         bbox_str =  bbox_to_str(bounds, None)
         fmt = 'application/atom xml' if self.getmap_format == 'GEORSS' else 'application/vnd.google-earth.kml+xml'
         params = {
@@ -224,7 +467,7 @@ class OGCServiceDumper:
             'bbox': bbox_str
         }
         if not no_index:
-            params['startIndex'] = self.state.index_done_till
+            params['startIndex'] = self.get_start_index(start_index)
         if not no_sort and self.sort_key is not None:
             params['sortBy'] = self.sort_key
 
@@ -270,12 +513,28 @@ class OGCServiceDumper:
 
 
 
-    def get_params(self, count, no_index, no_sort):
+    def get_params(self, count, no_index, no_sort, start_index=None):
         if self.service == 'WFS':
-            return self.get_params_WFS(count, None, no_index, no_sort)
+            return self.get_params_WFS(count, None, no_index, no_sort, start_index)
+
+        return self.get_params_WMS_GetMap(count, self.initial_bounds, no_index, no_sort, start_index)
 
-        return self.get_params_WMS_GetMap(count, self.initial_bounds, no_index, no_sort)
 
+    def get_tile_params(self, bounds, count, start_index):
+        if self.operation == 'GetFeature':
+            return self.get_params_WFS(count, bounds, False, False, start_index)
+
+        if self.operation == 'GetMap':
+            return self.get_params_WMS_GetMap(count, bounds, False, False, start_index)
+
+        raise Exception(f'Unexpected operation for paging: {self.operation}')
+
+    def get_hits_params(self, bounds, count):
+        params = self.get_params_WFS(count, bounds, True, True)
+        # the count comes back as attributes on the root element of the GML response
+        del params['outputFormat']
+        params['resultType'] = 'hits'
+        return params
 
     def get_bounded_params(self, bounds, count):
         if self.operation == 'GetFeature':
@@ -289,7 +548,57 @@ class OGCServiceDumper:
 
         raise Exception(f'Unexpected operation: {self.operation}')
 
-    def make_request(self, params):
+    def handle_failed_response(self, status_code, headers, text):
+        # error responses often carry a service exception report,
+        # which maps to one of the known, non retryable, exceptions
+        try:
+            handle_error_xml(text)
+        except KnownException:
+            raise
+        except Exception:
+            pass
+
+        retry_after = get_retry_after(status_code, headers)
+        if retry_after is not None:
+            # holds back every request to this host, not just this one
+            logger.info(f'server asked to retry after {retry_after:.1f} secs')
+            self.rate_limiter.defer(self.url, retry_after)
+        raise RequestFailedException(status_code, text, retry_after=retry_after)
+
+    def get_retry_delay(self, ex, attempt):
+        # waiting out a Retry-After is left to the rate limiter
+        if isinstance(ex, RequestFailedException) and ex.retry_after is not None:
+            return 0
+        # exponential backoff with jitter to keep parallel workers from retrying in lockstep
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (attempt - 1))
+        return round(random.uniform(delay / 2, delay), 2)
+
+    def is_retryable_error(self, ex):
+        return is_retryable(ex)
+
+    def handle_request_failure(self, ex, attempt, giveup):
+        # returns the time to wait before retrying, raises if there is no retrying
+        retryable = self.is_retryable_error(ex)
+        if retryable:
+            self.circuit_breaker.record_failure(self.url)
+
+        if giveup is not None and giveup(ex):
+            raise ex
+
+        if not retryable:
+            logger.info(f'request failed with a non retryable error - {ex!r}')
+            raise ex
+
+        delay = self.get_retry_delay(ex, attempt)
+        logger.info(f'request failed - attempt:{attempt}/{self.max_attempts}.. '
+                    f'retrying in {delay} secs')
+        if attempt >= self.max_attempts:
+            raise ex
+        return delay
+
+    def make_request(self, params, get_parser, giveup=None):
+        # the body is handed to a fresh parser from get_parser as it downloads,
+        # a response which breaks off midway is retried as a whole
         logger.debug(pformat(params))
         attempt = 0
 
@@ -297,134 +606,258 @@ class OGCServiceDumper:
             attempt += 1
 
             try:
-                resp = self.session.get(self.url, params=params, **self.req_params)
-                if not resp.ok:
-                    raise Exception(f'Request failed - status: {resp.status_code}, text: {resp.text}')
-            except Exception:
-                logger.info(f'request failed - attempt:{attempt}/{self.max_attempts}.. '
-                            f'retrying in {self.retry_delay*attempt} secs') 
-                if attempt >= self.max_attempts:
-                    raise
-                time.sleep(self.retry_delay * attempt)
+                self.rate_limiter.wait(self.url)
+                with self.fetch_slot(), self.host_limiter.slot(self.url), \
+                     self.session.get(self.url, params=params, stream=True, **self.req_params) as resp:
+                    if not resp.ok:
+                        self.handle_failed_response(resp.status_code, resp.headers, resp.text)
+
+                    parser = get_parser()
+                    feats = []
+                    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                        feats.extend(parser.feed(chunk))
+                # the connection is free for the next request while this one finishes parsing
+                feats.extend(parser.close())
+            except Exception as ex:
+                delay = self.handle_request_failure(ex, attempt, giveup)
+                time.sleep(delay)
                 continue
 
-            return resp.text
+            self.circuit_breaker.record_success(self.url)
+            return feats
 
     def parse_response_geojson(self, resp_text):
         try:
-            data = json.loads(resp_text)
+            data = json_codec.loads(resp_text)
         except ValueError:
             handle_error_xml(resp_text)
+            if isinstance(resp_text, bytes):
+                resp_text = resp_text.decode('utf-8', errors='replace')
             logger.info(f'resp: {resp_text}')
             raise
 
         return data['features']
 
-    def parse_response_georss(self, resp_text):
-        try:
-            feats = georss_extract_features(resp_text)
-        except KnownException:
-            raise
-        except Exception:
-            logger.error('Unable to process response')
-            logger.error(f'response: {resp_text}')
-            raise
-
-        return feats
-
-    def parse_response_kml(self, resp_text):
-        feats = kml_extract_features(resp_text,
-                                     self.kml_strip_point,
-                                     self.kml_keep_original_props)
-        return feats
-
-    def parse_response_getmap(self, resp_text):
-        if self.getmap_format == 'GEORSS':
-            return self.parse_response_georss(resp_text)
-        return self.parse_response_kml(resp_text)
-
-    def parse_response(self, resp_text):
-        optionally_save_to_file(resp_text)
+    def get_geojson_parser(self):
+        # the whole response only gets parsed in one go when it isn't json
+        return GeoJSONStreamParser(self.parse_response_geojson)
+
+    def get_getmap_parser(self):
+        if self.parse_pool is not None:
+            return PoolParser(self.parse_pool, parse_getmap_response,
+                              self.getmap_format,
+                              self.kml_strip_point,
+                              self.kml_keep_original_props)
+        return get_getmap_stream_parser(self.getmap_format,
+                                        self.kml_strip_point,
+                                        self.kml_keep_original_props,
+                                        self.props_extractor)
+
+    def get_response_parser(self):
         if self.service == 'WFS':
-            return self.parse_response_geojson(resp_text)
-
-        return self.parse_response_getmap(resp_text)
+            parser = self.get_geojson_parser()
+        else:
+            parser = self.get_getmap_parser()
+        return optionally_save_stream_to_file(parser)
 
-    def parse_bounded_response(self, resp_text):
-        optionally_save_to_file(resp_text)
+    def get_bounded_response_parser(self):
         if self.operation == 'GetMap':
-            return self.parse_response_getmap(resp_text)
+            parser = self.get_getmap_parser()
+        else:
+            parser = self.get_geojson_parser()
+        return optionally_save_stream_to_file(parser)
 
-        return self.parse_response_geojson(resp_text)
+    def get_hits_parser(self):
+        return BufferedParser(lambda xml_text: [ get_hits_count(xml_text) ])
 
     def pause_if_required(self):
-        self.req_count += 1
+        # an explicit request rate takes over from the pause schedule
+        if self.rate_limiter.is_limited(self.url):
+            return
 
-        if self.req_count == self.requests_to_pause:
-            logger.info(f'pausing for {self.pause_seconds} secs')
-            time.sleep(self.pause_seconds)
-            self.req_count = 0
+        # the lock is held while sleeping so that all the workers pause together
+        with self.req_lock:
+            self.req_count += 1
 
-    def get_features(self, count, no_index=False, no_sort=False):
+            if self.req_count == self.requests_to_pause:
+                logger.info(f'pausing for {self.pause_seconds} secs')
+                time.sleep(self.pause_seconds)
+                self.req_count = 0
+
+    def post_process(self, feats):
+        truncate_geometries([ feat.get('geometry', None) for feat in feats ],
+                            self.geometry_precision)
+
+    def get_features(self, count, no_index=False, no_sort=False, start_index=None, giveup=None):
         self.pause_if_required()
 
-        params = self.get_params(count, no_index, no_sort)
+        params = self.get_params(count, no_index, no_sort, start_index)
 
         logger.info(f'making a request for {count} records with '
-                    f'start_index: {self.state.index_done_till}, '
+                    f'start_index: {self.get_start_index(start_index)}, '
                     f'already_downloaded: {self.state.downloaded_count}')
-        resp_text = self.make_request(params)
-
-        feats = self.parse_response(resp_text)
-        for feat in feats:
-            truncate_geometry(feat.get('geometry', None),
-                              self.geometry_precision)
+        feats = self.make_request(params, self.get_response_parser, giveup)
+        self.post_process(feats)
         return feats
 
-    def get_bounded_features(self, bounds, count, key):
+    def get_bounded_features(self, bounds, count, key, giveup=None):
         self.pause_if_required()
 
         params = self.get_bounded_params(bounds, count)
 
         logger.info(f'making a request for {count} records with key={key}')
-        resp_text = self.make_request(params)
+        feats = self.make_request(params, self.get_bounded_response_parser, giveup)
+        self.post_process(feats)
+        return feats
+
+    def get_tile_features(self, bounds, count, key, start_index, giveup=None):
+        self.pause_if_required()
+
+        params = self.get_tile_params(bounds, count, start_index)
 
-        feats = self.parse_bounded_response(resp_text)
-        for feat in feats:
-            truncate_geometry(feat.get('geometry', None),
-                              self.geometry_precision)
+        logger.info(f'making a request for {count} records with key={key}, '
+                    f'start_index: {start_index}')
+        feats = self.make_request(params, self.get_bounded_response_parser, giveup)
+        self.post_process(feats)
         return feats
 
-    def split_envelope(self, envelope):
-        half_width = (envelope['xmax'] - envelope['xmin']) / 2.0
-        half_height = (envelope['ymax'] - envelope['ymin']) / 2.0
+    def is_probe_rejected(self, ex):
+        # servers not supporting resultType=hits tend to say so in an unmapped service exception,
+        # which isn't worth retrying
+        return isinstance(ex, UnknownServiceException)
+
+    def handle_probe_failure(self, ex):
+        # a server which can't answer the probe is dumped the usual way
+        if not self.is_probe_rejected(ex) and \
+           (isinstance(ex, KnownException) or self.is_retryable_error(ex)):
+            raise ex
+        logger.info(f'hits probe failed - {ex!r}')
+
+    def disable_probing(self):
+        if self.probe_hits:
+            logger.warning('server doesn\'t report the number of hits, '
+                           'falling back to fetching records')
+            self.probe_hits = False
+
+    def probe_envelope(self, envelope, count, key):
+        # returns the number of records in the envelope, which the server
+        # may cap at count, or None if the server couldn't tell
+        self.pause_if_required()
+
+        params = self.get_hits_params(envelope, count)
+
+        logger.info(f'probing the number of records for key={key}')
+        hits = None
+        try:
+            hits = self.make_request(params, self.get_hits_parser, self.is_probe_rejected)[0]
+        except ZeroAreaException:
+            return 0
+        except Exception as ex:
+            self.handle_probe_failure(ex)
+
+        if hits is None:
+            self.disable_probing()
+        return hits
+
+    def get_batch_size(self):
+        if self.sizer is None:
+            return self.batch_size
+        return self.sizer.size
+
+    def sync_batch_size(self):
+        self.state.batch_size = self.sizer.size
+        self.state.batch_size_cap = self.sizer.cap
+
+    def is_saturated(self, count, num_features):
+        if self.sizer is None:
+            return num_features >= count
+        return self.sizer.is_saturated(count, num_features)
+
+    def is_overload_error(self, ex):
+        if isinstance(ex, requests.exceptions.Timeout):
+            return True
+        if isinstance(ex, RequestFailedException) and ex.status_code >= 500:
+            return True
+        return False
+
+    def get_shrink_check(self, count):
+        def should_shrink(ex):
+            return self.is_overload_error(ex) and self.sizer.can_shrink_from(count)
+        return should_shrink
+
+    def sized_request(self, fetch):
+        # fetch is called with the record count and a giveup check for make_request,
+        # returns the count which was finally used along with the features
+        while True:
+            count = self.get_batch_size()
+            if self.sizer is None:
+                return count, fetch(count, None)
+
+            start = time.monotonic()
+            try:
+                feats = fetch(count, self.get_shrink_check(count))
+            except Exception as ex:
+                if self.is_overload_error(ex) and self.sizer.shrink(count):
+                    self.sync_batch_size()
+                    continue
+                raise
+            self.sizer.update(count, len(feats), time.monotonic() - start)
+            self.sync_batch_size()
+            return count, feats
+
+    def split_envelope(self, envelope, split_point=None):
+        if split_point is None:
+            mid_x = envelope['xmin'] + (envelope['xmax'] - envelope['xmin']) / 2.0
+            mid_y = envelope['ymin'] + (envelope['ymax'] - envelope['ymin']) / 2.0
+        else:
+            mid_x, mid_y = split_point
         return [
             dict(
                 xmin=envelope['xmin'],
                 ymin=envelope['ymin'],
-                xmax=envelope['xmin'] + half_width,
-                ymax=envelope['ymin'] + half_height,
+                xmax=mid_x,
+                ymax=mid_y,
             ),
             dict(
-                xmin=envelope['xmin'] + half_width,
-                ymin=envelope['ymin'] + half_height,
+                xmin=mid_x,
+                ymin=mid_y,
                 xmax=envelope['xmax'],
                 ymax=envelope['ymax'],
             ),
             dict(
-                xmin=envelope['xmin'] + half_width,
+                xmin=mid_x,
                 ymin=envelope['ymin'],
                 xmax=envelope['xmax'],
-                ymax=envelope['ymin'] + half_height,
+                ymax=mid_y,
             ),
             dict(
                 xmin=envelope['xmin'],
-                ymin=envelope['ymin'] + half_height,
-                xmax=envelope['xmin'] + half_width,
+                ymin=mid_y,
+                xmax=mid_x,
                 ymax=envelope['ymax'],
             ),
         ]
 
+    def open_envelope(self, envelope, key, features):
+        # features are the ones returned for the saturated envelope, if any were fetched
+        split_point = None
+        if self.split_strategy == 'MEDIAN' and features is not None:
+            split_point = get_split_point(envelope, features)
+        self.state.update_coverage(key, Extent.OPEN, split_point)
+
+    def is_tile(self, key):
+        # envelopes this deep are paged through instead of being split further
+        if self.tile_depth is None:
+            return False
+        return len(key) - 1 >= self.tile_depth
+
+    def get_child_envelopes(self, envelope, key):
+        # the split point is kept in the state so that a resumed run
+        # arrives at the same children for the same keys
+        envelopes = self.split_envelope(envelope, self.state.split_points.get(key, None))
+        keys = [ f'{key}{i}' for i in range(len(envelopes)) ]
+        return envelopes, keys
+
     def is_envelope_size_allowed(self, b):
         if self.max_box_dims is None:
             return True
@@ -439,53 +872,207 @@ class OGCServiceDumper:
 
         return True
 
-    def scrape_an_envelope(self, envelope, key):
+    def get_envelope_status(self, key):
         status = self.state.explored_tree.get(key, Extent.NOT_PRESENT.value)
-        status = Extent(status)
+        return Extent(status)
+
+    def fetch_envelope(self, envelope, key):
+        # the first page of a tile stands in for the envelope fetch
+        if self.is_tile(key):
+            return self.fetch_tile_page(envelope, key, 0)
+
+        # features come back as None when the envelope is known to need splitting
+        if self.probe_hits:
+            count = self.get_batch_size()
+            hits = self.probe_envelope(envelope, count, key)
+            if hits is not None and hits >= count:
+                logger.info(f'key={key} has atleast {hits} records, splitting without fetching')
+                return count, None
+            if hits == 0:
+                return count, []
+
+        def fetch(count, giveup):
+            try:
+                return self.get_bounded_features(envelope, count, key, giveup=giveup)
+            except ZeroAreaException:
+                return []
+        return self.sized_request(fetch)
+
+    def fetch_page(self, start_index):
+        def fetch(count, giveup):
+            return self.get_features(count, start_index=start_index, giveup=giveup)
+        return self.sized_request(fetch)
+
+    def fetch_tile_page(self, envelope, key, start_index):
+        def fetch(count, giveup):
+            try:
+                return self.get_tile_features(envelope, count, key, start_index, giveup=giveup)
+            except ZeroAreaException:
+                return []
+        return self.sized_request(fetch)
+
+    def prefetch_envelope(self, envelope, key):
+        if self.executor is None:
+            return None
+
+        if self.get_envelope_status(key) != Extent.NOT_PRESENT:
+            return None
+
+        if not self.is_envelope_size_allowed(envelope):
+            return None
+
+        return self.executor.submit(self.fetch_envelope, envelope, key)
+
+    def scrape_an_envelope(self, envelope, key, future=None):
+        status = self.get_envelope_status(key)
         if status == Extent.EXPLORED:
             return
 
-        max_records = self.batch_size
         if status == Extent.NOT_PRESENT:
+            features = None
             if self.is_envelope_size_allowed(envelope):
-                try:
-                    features = self.get_bounded_features(envelope, max_records, key)
-                except ZeroAreaException:
-                    features = []
-                logger.info(f'got {len(features)} records')
-
-                for feature in features:
-                    yield feature
-                num_features = len(features)
-                if num_features < max_records:
-                    self.state.update_coverage(key, Extent.EXPLORED)
-                    return
-            self.state.update_coverage(key, Extent.OPEN)
+                if future is not None:
+                    count, features = future.result()
+                else:
+                    count, features = self.fetch_envelope(envelope, key)
+
+                if features is not None:
+                    logger.info(f'got {len(features)} records for key={key}')
+
+                    for feature in features:
+                        yield feature
+                    if not self.is_saturated(count, len(features)):
+                        self.state.update_coverage(key, Extent.EXPLORED)
+                        return
+
+            if self.is_tile(key) and features is not None:
+                advance = self.get_page_advance(count, len(features), True)
+                self.state.update_coverage(key, Extent.OPEN, tile_index=advance)
+            else:
+                self.open_envelope(envelope, key, features)
             status = Extent.OPEN
 
+        if status == Extent.OPEN and key in self.state.tile_index:
+            yield from self.page_tile(envelope, key)
+            return
+
         if status == Extent.OPEN:
-            envelopes = self.split_envelope(envelope)
+            envelopes, keys = self.get_child_envelopes(envelope, key)
 
-            for i, child_envelope in enumerate(envelopes):
-                new_key = f'{key}{i}'
-                for feature in self.scrape_an_envelope(child_envelope, new_key):
+            # queue up the children with the worker pool before walking them in order,
+            # state updates and yields still happen depth first on the calling thread
+            futures = [ self.prefetch_envelope(e, k) for e, k in zip(envelopes, keys) ]
+
+            for child_envelope, new_key, child_future in zip(envelopes, keys, futures):
+                for feature in self.scrape_an_envelope(child_envelope, new_key, child_future):
                     yield feature
 
             self.state.update_coverage(key, Extent.EXPLORED)
 
+    def fetch_slot(self):
+        if self.fetch_slots is None:
+            return nullcontext()
+        return self.fetch_slots
+
+    def start_parse_pool(self):
+        if self.parse_pool is None and self.parse_workers > 0:
+            self.parse_pool = create_parse_pool(self.parse_workers)
+            self.owns_parse_pool = True
+
+    def stop_parse_pool(self):
+        if self.owns_parse_pool:
+            self.parse_pool.shutdown(wait=True, cancel_futures=True)
+            self.parse_pool = None
+            self.owns_parse_pool = False
+
+    @contextmanager
+    def worker_pool(self):
+        if self.window > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.window)
+        self.start_parse_pool()
+        try:
+            yield
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+            self.stop_parse_pool()
+
+    def iter_extent(self):
+        self.lookup_initial_bounds()
+        with self.worker_pool():
+            for feature in self.scrape_an_envelope(self.initial_bounds, "0"):
+                if self.state.add_feature(feature):
+                    yield feature
 
-    def __iter__(self):
-        if self.retrieval_mode == 'OFFSET':
-            while True:
-                feats = self.get_features(self.batch_size)
+    def get_page_advance(self, count, num_features, saturated):
+        # a page cut short by a server side cap only covers what was returned
+        if saturated and num_features < count:
+            return num_features
+        return count
+
+    def iter_pages(self, fetch_page, start_index):
+        # yields (feats, advance) for consecutive pages from start_index
+        # till one comes back short. fetch_page(start_index) returns (count, feats)
+        # window of page requests in flight, ordered by start index
+        pending = deque()
+        next_index = start_index
+        while True:
+            while self.executor is not None and len(pending) < self.window:
+                pending.append((next_index,
+                                self.executor.submit(fetch_page, next_index)))
+                next_index += self.get_batch_size()
+
+            if len(pending) > 0:
+                start_index, future = pending.popleft()
+                count, feats = future.result()
+            else:
+                count, feats = fetch_page(start_index)
+
+            saturated = self.is_saturated(count, len(feats))
+            advance = self.get_page_advance(count, len(feats), saturated)
+
+            yield feats, advance
+
+            if not saturated:
+                for _, future in pending:
+                    future.cancel()
+                break
+
+            # the batch size changed under the pages already in flight,
+            # throw them away and start again from where this page ended
+            if len(pending) > 0 and pending[0][0] != start_index + advance:
+                for _, future in pending:
+                    future.cancel()
+                pending.clear()
+                next_index = start_index + advance
+
+            start_index += advance
+
+    def page_tile(self, envelope, key):
+        def fetch_page(start_index):
+            return self.fetch_tile_page(envelope, key, start_index)
+
+        for feats, advance in self.iter_pages(fetch_page, self.state.tile_index[key]):
+            logger.info(f'got {len(feats)} records for key={key}')
+            for feat in feats:
+                yield feat
+            self.state.update_tile_index(key, advance)
+
+        self.state.update_coverage(key, Extent.EXPLORED)
+
+    def iter_offset(self):
+        with self.worker_pool():
+            for feats, advance in self.iter_pages(self.fetch_page, self.state.index_done_till):
                 for feat in feats:
                     yield feat
 
-                self.state.update(self.batch_size, len(feats))
+                # pages are consumed in order, so the state only ever
+                # moves over contiguous completed pages
+                self.state.update(advance, len(feats))
 
-                if len(feats) < self.batch_size:
-                    break
+    def __iter__(self):
+        if self.retrieval_mode == 'OFFSET':
+            yield from self.iter_offset()
         else:
-            for feature in self.scrape_an_envelope(self.initial_bounds, "0"):
-                if self.state.add_feature(feature):
-                    yield feature
+            yield from self.iter_extent()
@@ -3,6 +3,7 @@ import re
 
 from pathlib import Path
 
+import requests
 import xmltodict
 
 SORT_KEY_ERR_MSGS = [ 'Cannot do natural order without a primary key, ' + \
@@ -20,6 +21,7 @@ KML_NOT_SUPPORTED_MSGS = [ 'There is no support for creating maps in kml format'
                            'application/vnd.google-earth.kml+xml format' ]
 GEORSS_NOT_SUPPORTED_MSGS = [ 'Creating maps using application/atom xml is not allowed' ]
 LAYER_MISSING_MSGS = [ 'Could not find layer' ]
+RETRYABLE_STATUS_CODES = [ 408, 425, 429, 500, 502, 503, 504 ]
 
 class KnownException(Exception):
     pass
@@ -48,6 +50,17 @@ class GeoRSSUnsupportedException(KnownException):
 class LayerMissingException(KnownException):
     pass
 
+class UnknownServiceException(Exception):
+    # a service exception report which isn't in the mappings,
+    # often the server having trouble of its own, like a database timeout
+    pass
+
+class RequestFailedException(Exception):
+    def __init__(self, status_code, text, retry_after=None):
+        super().__init__(f'Request failed - status: {status_code}, text: {text}')
+        self.status_code = status_code
+        self.retry_after = retry_after
+
 ERROR_MAPPINGS = [
     (SORT_KEY_ERR_MSGS, SortKeyRequiredException),
     (INVALID_PROP_NAME_ERR_MSGS, InvalidSortKeyException),
@@ -84,7 +97,7 @@ def check_error_msg(err_msg):
             if matches is not None:
                 raise ExceptopnClass()
 
-    raise Exception(err_msg)
+    raise UnknownServiceException(err_msg)
 
 
 def handle_error(data):
@@ -99,11 +112,33 @@ def handle_error_xml(xml_text):
     handle_error(data)
 
 
-def optionally_save_to_file(txt):
+def is_retryable(ex):
+    # known service exceptions are going to come back the same way on a retry
+    if isinstance(ex, KnownException):
+        return False
+
+    if isinstance(ex, RequestFailedException):
+        return ex.status_code in RETRYABLE_STATUS_CODES
+
+    if isinstance(ex, UnknownServiceException):
+        return True
+
+    # connection errors, timeouts, responses broken off midway etc,
+    # a response which doesn't parse is going to fail the same way again
+    return isinstance(ex, (requests.exceptions.RequestException, OSError))
+
+
+def get_response_save_path():
     to_file = os.environ.get('WMSDUMP_SAVE_RESPONSE_TO_FILE', None)
     if to_file is None or to_file.strip() == '':
+        return None
+    return Path(to_file)
+
+
+def optionally_save_to_file(txt):
+    p = get_response_save_path()
+    if p is None:
         return
-    p = Path(to_file)
     try:
         p.write_text(txt)
     except Exception:
@@ -0,0 +1,213 @@
+import re
+import json
+import codecs
+
+from . import json_codec
+
+# characters which change the nesting or start a string
+STRUCTURE_RE = re.compile(r'["{}\[\]]')
+# rest of a string after the opening quote, escapes included
+STRING_REST_RE = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+WHITESPACE_RE = re.compile(r'[ \t\r\n]*')
+SEPARATOR_RE = re.compile(r'[ \t\r\n,]*')
+# how features usually follow one another, compact like geoserver or python spaced
+FEATURE_BOUNDARIES = [ ',{"type":"Feature"', ', {"type": "Feature"' ]
+
+class GeoJSONStreamParser:
+    """
+    Pulls the features out of a GeoJSON FeatureCollection as the response
+    streams in, without holding the whole document. Only the text of the
+    features not yet completed is kept around.
+    Anything which doesn't look like a JSON object, like an xml exception
+    report, is buffered and handed over to fallback_fn at the end.
+    """
+    def __init__(self, fallback_fn):
+        self.fallback_fn = fallback_fn
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json_decoder = json.JSONDecoder()
+        self.raw = []
+        self.buf = ''
+        self.pos = 0
+        # one of START, OBJECT, FEATURES, DONE or FALLBACK
+        self.mode = 'START'
+        self.depth = 0
+        self.seen_features = False
+        # amount of pending text to wait for before trying to decode
+        # a feature again, keeps huge features from being decoded over and over
+        self.retry_size = 0
+        self.use_boundary = True
+
+    def feed(self, chunk):
+        if self.mode in ['START', 'FALLBACK']:
+            self.raw.append(chunk)
+            if self.mode == 'FALLBACK':
+                return []
+
+        self.buf += self.decoder.decode(chunk)
+        feats = []
+
+        while True:
+            if self.mode == 'START':
+                progressed = self.read_start()
+            elif self.mode == 'OBJECT':
+                progressed = self.read_object()
+            elif self.mode == 'FEATURES':
+                progressed = self.read_features(feats) or self.read_feature(feats)
+            else:
+                progressed = False
+
+            if not progressed:
+                break
+
+        if self.mode != 'FALLBACK':
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        return feats
+
+    def read_start(self):
+        self.pos = WHITESPACE_RE.match(self.buf, self.pos).end()
+        if self.pos >= len(self.buf):
+            return False
+
+        if self.buf[self.pos] != '{':
+            self.mode = 'FALLBACK'
+            return False
+
+        self.raw = []
+        self.pos += 1
+        self.depth = 1
+        self.mode = 'OBJECT'
+        return True
+
+    def find_string_end(self, start):
+        # start is the position of the opening quote, returns the position
+        # after the closing quote or None if it hasn't arrived yet
+        m = STRING_REST_RE.match(self.buf, start + 1)
+        if m is None:
+            return None
+        return m.end()
+
+    def read_object(self):
+        m = STRUCTURE_RE.search(self.buf, self.pos)
+        if m is None:
+            self.pos = len(self.buf)
+            return False
+
+        c = m.group()
+        if c == '"':
+            end = self.find_string_end(m.start())
+            if end is None:
+                self.pos = m.start()
+                return False
+
+            if self.depth != 1:
+                self.pos = end
+                return True
+
+            # strings directly inside the top level object are keys if a colon follows
+            after = WHITESPACE_RE.match(self.buf, end).end()
+            if after >= len(self.buf):
+                self.pos = m.start()
+                return False
+            if self.buf[after] != ':':
+                self.pos = end
+                return True
+
+            key = json.loads(self.buf[m.start():end])
+            value_start = WHITESPACE_RE.match(self.buf, after + 1).end()
+            if key != 'features':
+                self.pos = value_start
+                return True
+
+            if value_start >= len(self.buf):
+                self.pos = m.start()
+                return False
+            if self.buf[value_start] != '[':
+                raise Exception('features in response is not a list')
+
+            self.seen_features = True
+            self.pos = value_start + 1
+            self.mode = 'FEATURES'
+            return True
+
+        self.pos = m.end()
+        if c in '{[':
+            self.depth += 1
+        else:
+            self.depth -= 1
+            if self.depth == 0:
+                self.mode = 'DONE'
+        return True
+
+    def read_features(self, feats):
+        # decoding all the complete features in one call is a lot cheaper than
+        # going one at a time, the garbage collector doesn't get to run in between
+        if not self.use_boundary:
+            return False
+
+        self.pos = SEPARATOR_RE.match(self.buf, self.pos).end()
+        cut = max(self.buf.rfind(b, self.pos) for b in FEATURE_BOUNDARIES)
+        if cut <= self.pos:
+            return False
+
+        try:
+            batch = json_codec.loads('[' + self.buf[self.pos:cut] + ']')
+        except ValueError:
+            # the boundary turned up inside a nested object, go one at a time from here
+            self.use_boundary = False
+            return False
+
+        feats.extend(batch)
+        self.pos = cut + 1
+        self.retry_size = 0
+        return True
+
+    def read_feature(self, feats):
+        self.pos = SEPARATOR_RE.match(self.buf, self.pos).end()
+        if self.pos >= len(self.buf):
+            return False
+
+        if self.buf[self.pos] == ']':
+            self.pos += 1
+            self.mode = 'OBJECT'
+            return True
+
+        if len(self.buf) - self.pos < self.retry_size:
+            return False
+
+        try:
+            feat, end = self.json_decoder.raw_decode(self.buf, self.pos)
+        except ValueError:
+            # most likely the rest of the feature is yet to arrive
+            self.retry_size = 2 * (len(self.buf) - self.pos)
+            return False
+
+        feats.append(feat)
+        self.pos = end
+        self.retry_size = 0
+        return True
+
+    def close(self):
+        if self.mode in ['START', 'FALLBACK']:
+            data = b''.join(self.raw)
+            self.raw = []
+            return self.fallback_fn(data)
+
+        self.buf += self.decoder.decode(b'', final=True)
+        if self.mode == 'FEATURES':
+            # a feature which never completed raises its decoding error here
+            feats = []
+            self.retry_size = 0
+            while self.mode == 'FEATURES' and self.read_feature(feats):
+                pass
+            if self.mode == 'FEATURES':
+                self.pos = SEPARATOR_RE.match(self.buf, self.pos).end()
+                if self.pos < len(self.buf):
+                    self.json_decoder.raw_decode(self.buf, self.pos)
+                raise Exception('response ended before the list of features did')
+            return feats
+
+        if not self.seen_features:
+            raise Exception('no features in response')
+
+        return []
@@ -1,45 +1,64 @@
-import re
+numpy_available = True
+try:
+    import numpy as np
+except ImportError:
+    numpy_available = False
 
-import xmltodict
+from .stream_helper import XMLStreamParser, local_name
+from .props_helper import PropsExtractor
 
+def get_points_py(vals):
+    it = iter([ float(c) for c in vals.split(' ') ])
+    return [ [lon, lat] for lat, lon in zip(it, it) ]
 
-from .errors import handle_error
-from .props_helper import get_props_from_html
+def get_points_np(vals):
+    # georss has the coordinates as 'lat lon lat lon ..', a trailing odd value is dropped
+    arr = np.array(vals.split(' '), dtype=np.float64)
+    arr = arr[:len(arr) // 2 * 2].reshape(-1, 2)
+    return arr[:, ::-1].tolist()
 
 def get_points(vals):
-    points = []
-    curr_p = []
-    for c in vals.split(' '):
-        if len(curr_p) == 2:
-            curr_p.reverse()
-            points.append(curr_p)
-            curr_p = []
-        curr_p.append(float(c))
-    if len(curr_p) == 2:
-        curr_p.reverse()
-        points.append(curr_p)
-        curr_p = []
-    return points
-
-
-
-def extract_feature(entry):
-    title = entry.get('title', None)
-    content = entry.get('content', {}).get('#text', '')
-    props = get_props_from_html(content)
-
-    where = entry['georss:where']
-    if 'georss:polygon' in where:
-        points = get_points(where['georss:polygon'])
+    if numpy_available:
+        return get_points_np(vals)
+    return get_points_py(vals)
+
+
+def get_child(elem, name):
+    for child in elem:
+        if local_name(child.tag) == name:
+            return child
+    return None
+
+def get_text(elem):
+    # stripped text, or None if there isn't any.. the way xmltodict reports it
+    if elem is None or elem.text is None:
+        return None
+    txt = elem.text.strip()
+    return txt if txt != '' else None
+
+def extract_feature(entry, props_extractor):
+    title = get_text(get_child(entry, 'title'))
+    content = get_text(get_child(entry, 'content'))
+    props = props_extractor.extract(content if content is not None else '')
+
+    where = get_child(entry, 'where')
+    if where is None:
+        raise Exception('no georss:where in entry')
+
+    polygon = get_child(where, 'polygon')
+    line = get_child(where, 'line')
+    point = get_child(where, 'point')
+    if polygon is not None:
+        points = get_points(get_text(polygon))
         geom = { 'type': 'Polygon', 'coordinates': [points] }
-    elif 'georss:line' in where:
-        points = get_points(where['georss:line'])
+    elif line is not None:
+        points = get_points(get_text(line))
         geom = { 'type': 'LineString', 'coordinates': points }
-    elif 'georss:point' in where:
-        points = get_points(where['georss:point'])
+    elif point is not None:
+        points = get_points(get_text(point))
         geom = { 'type': 'Point', 'coordinates': points[0] }
     else:
-        raise Exception(f'unexpected content in {where}')
+        raise Exception(f'unexpected content in {[ child.tag for child in where ]}')
 
     return { 'type': 'Feature', 'id': title, 'geometry': geom, 'properties': props }
 
@@ -94,34 +113,41 @@ def combine_features(feats):
     return new_feats
 
 
-def georss_extract_features(xml_text):
-    # deal with some xml/unicode messups
-    xml_text = re.sub(r'&#([a-zA-Z0-9]+);?', r'[#\1;]', xml_text)
-
-    data = xmltodict.parse(xml_text)
-
-    handle_error(data)
-
-    if 'feed' not in data:
-       raise Exception('no feed in data')
-
-    feed = data['feed']
-    if 'entry' not in feed:
+class GeoRSSStreamParser(XMLStreamParser):
+    """
+    Converts the entries of a GeoRSS feed to features as they complete.
+    The features are only handed out at the end, once the pieces of split
+    up geometries have all turned up and can be combined.
+    """
+    def __init__(self, props_extractor=None):
+        super().__init__()
+        self.props_extractor = props_extractor if props_extractor is not None else PropsExtractor()
+        self.feats = []
+
+    def handle_end(self, elem, parent):
+        # entries directly under the feed
+        if self.root_tag != 'feed' or len(self.stack) != 1 or local_name(elem.tag) != 'entry':
+            return []
+
+        self.feats.append(extract_feature(elem, self.props_extractor))
+        parent.remove(elem)
         return []
 
-    entries = feed['entry']
-    if type(entries) is not list:
-        entries = [ entries ]
+    def handle_close(self):
+        if self.root_tag != 'feed':
+            raise Exception('no feed in data')
 
-    feats = []
-    for entry in entries:
-        feat = extract_feature(entry)
-        feats.append(feat)
+        feats = self.feats
+        self.feats = []
+        # sometimes multipolygons show up as multiple seperate polygon features with the same id
+        # combine them into one feature where possible
+        # the assumption here is that.. they show up in the same batch and that
+        # the properties dict for the split pieces is empty
+        return combine_features(feats)
 
-    # sometimes multipolygons show up as multiple seperate polygon features with the same id
-    # combine them into one feature where possible
-    # the assumption here is that.. they show up in the same batch and that
-    # the properties dict for the split pieces is empty
-    feats = combine_features(feats)
 
+def georss_extract_features(xml_text):
+    parser = GeoRSSStreamParser()
+    feats = parser.feed(xml_text)
+    feats.extend(parser.close())
     return feats
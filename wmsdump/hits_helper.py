@@ -0,0 +1,40 @@
+import xml.etree.ElementTree as ET
+
+from .errors import handle_error_xml
+
+# WFS 2.0.0 reports the count in numberMatched, 1.1.0 in numberOfFeatures
+HITS_ATTRS = [ 'numberMatched', 'numberOfFeatures' ]
+# resultType=hits came in with WFS 1.1.0, older servers ignore it and return the features
+MIN_HITS_VERSION = (1, 1, 0)
+EXCEPTION_REPORT_TAGS = [ 'ServiceExceptionReport', 'ExceptionReport' ]
+
+def supports_hits(service_version):
+    try:
+        version = tuple(int(part) for part in service_version.split('.'))
+    except ValueError:
+        return False
+    return version >= MIN_HITS_VERSION
+
+def get_hits_count(xml_text):
+    # returns None if the response doesn't carry a usable count
+    try:
+        root = ET.fromstring(xml_text)
+    except ET.ParseError:
+        return None
+
+    tag = root.tag.rsplit('}', 1)[-1]
+    if tag in EXCEPTION_REPORT_TAGS:
+        handle_error_xml(xml_text)
+        return None
+
+    for attr in HITS_ATTRS:
+        val = root.get(attr, None)
+        if val is None:
+            continue
+        # 2.0.0 servers are allowed to say 'unknown'
+        try:
+            return int(val)
+        except ValueError:
+            return None
+
+    return None
@@ -12,6 +12,7 @@ from shapely.geometry import shape, mapping
 from shapely import unary_union
 from geoindex_rs import rtree as rt
 
+from wmsdump import json_codec
 from wmsdump.logging import setup_logging
 
 logger = logging.getLogger(__name__)
@@ -53,12 +54,12 @@ class FileReader:
             line = f.readline()
             if line == '':
                 break
-            feat = json.loads(line)
+            feat = json_codec.loads(line)
             self.count += 1
             yield feat, f.tell()
 
     def __iter__(self):
-        with open(self.file, 'r') as f:
+        with open(self.file, 'r', encoding='utf-8') as f:
             for feat, _ in self.iter_features(f):
                 yield feat
 
@@ -68,7 +69,7 @@ class FileReader:
         ymin = []
         xmax = []
         ymax = []
-        with open(self.file, 'r') as f:
+        with open(self.file, 'r', encoding='utf-8') as f:
             if self.maintain_map and self.use_offset:
                 self.offset_map[self.count] = 0
             for feat, pos in self.iter_features(f):
@@ -126,10 +127,10 @@ class FileReader:
         if not self.use_offset:
             return self.idx_map[(n,pi)]
 
-        with open(self.file, 'r') as f:
+        with open(self.file, 'r', encoding='utf-8') as f:
             f.seek(self.offset_map[n])
             line = f.readline()
-            feat = json.loads(line)
+            feat = json_codec.loads(line)
 
             ps = get_polygons(feat)
             if ps is None:
@@ -295,7 +296,7 @@ def get_replacements(enclosing_map, pmap):
 
 def write_fixed_file(outp_fname, inp_fname, replacements):
     logger.info(f'writing features to {outp_fname}')
-    with open(outp_fname, 'w') as f:
+    with open(outp_fname, 'w', encoding='utf-8') as f:
         r3 = FileReader(inp_fname, maintain_map=False)
         count = 0
         for feat in r3:
@@ -318,7 +319,7 @@ def write_fixed_file(outp_fname, inp_fname, replacements):
             count += 1
             if count % BSIZE == 0:
                 logger.info(f'wrote {count} features')
-            f.write(json.dumps(feat))
+            f.write(json_codec.dumps(feat))
             f.write('\n')
 
 
@@ -0,0 +1,86 @@
+import os
+import json
+import logging
+
+orjson_available = True
+try:
+    import orjson
+except ImportError:
+    orjson_available = False
+
+logger = logging.getLogger(__name__)
+
+# Features are encoded once per record for deduplication and again for writing,
+# so the encoder in use matters. orjson is used when it is installed.
+#
+# The two backends don't produce the same text for the same feature:
+#   - orjson is compact, '{"a":1,"b":[1,2]}' instead of '{"a": 1, "b": [1, 2]}'
+#   - orjson writes non-ascii characters as utf-8 instead of \uXXXX escapes
+#   - orjson writes exponents as 1e-7 and 1e16 instead of 1e-07 and 1e+16
+#   - orjson writes NaN and Infinity as null
+#   - orjson reads integers beyond 64 bits as floats
+# Values which orjson refuses to encode, like integers beyond 64 bits,
+# go through the stdlib instead.
+#
+# As duplicate detection compares the encoded text against the lines already
+# in the output file, the backend used is recorded in the state file and
+# a resumed extraction sticks to it, or re-encodes the existing lines with the
+# one in use if it isn't installed anymore. So loads and dumps take the backend
+# to use, falling back to the default one.
+
+JSON_BACKENDS = [ 'orjson', 'json' ]
+BACKEND_ENV_VAR = 'WMSDUMP_JSON_BACKEND'
+
+def is_available(name):
+    if name == 'orjson':
+        return orjson_available
+    return name == 'json'
+
+def get_default_backend():
+    name = os.environ.get(BACKEND_ENV_VAR, None)
+    if name is not None:
+        if name not in JSON_BACKENDS:
+            logger.warning(f'{BACKEND_ENV_VAR} should be one of {JSON_BACKENDS}, got {name}.. using json')
+            return 'json'
+        if not is_available(name):
+            logger.warning(f'{BACKEND_ENV_VAR} is set to {name}, which is not installed.. using json')
+            return 'json'
+        return name
+
+    return 'orjson' if orjson_available else 'json'
+
+# worked out on first use, so that a bad environment variable
+# gets reported through the logging setup of the command
+default_backend = None
+
+def get_backend():
+    global default_backend
+    if default_backend is None:
+        default_backend = get_default_backend()
+    return default_backend
+
+def loads(s, backend=None):
+    if backend is None:
+        backend = get_backend()
+    if backend == 'orjson':
+        try:
+            return orjson.loads(s)
+        except ValueError:
+            # let the stdlib have a go at things orjson is strict about,
+            # like a byte order mark or NaN, it raises the error otherwise
+            pass
+    return json.loads(s)
+
+def dumps(obj, backend=None):
+    if backend is None:
+        backend = get_backend()
+    if backend == 'orjson':
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(obj)
+
+def normalize(line, backend=None):
+    # re-encode a line written by the other backend the way this one would
+    return dumps(loads(line, backend), backend)
@@ -1,12 +1,12 @@
-import io
-import re
+from kml2geojson.main import coords, coords1, gx_coords1, build_rgb_and_opacity
 
-import kml2geojson
+from .stream_helper import XMLStreamParser, local_name
+from .props_helper import PropsExtractor
 
-from .errors import handle_error_xml
-from .props_helper import get_props_from_html
+# in the order kml2geojson collects them
+GEOMETRY_TAGS = [ 'Polygon', 'LineString', 'Point', 'Track' ]
 
-def convert_kml_props(feat, keep_original):
+def convert_kml_props(feat, keep_original, props_extractor=None):
     if 'properties' not in feat:
         return 
 
@@ -17,7 +17,9 @@ def convert_kml_props(feat, keep_original):
     desc = props['description']
     del props['description']
 
-    new_props = get_props_from_html(desc)
+    if props_extractor is None:
+        props_extractor = PropsExtractor()
+    new_props = props_extractor.extract(desc)
 
     if keep_original:
         for k, v in feat['properties'].items():
@@ -74,19 +76,183 @@ def tranform_geo_collection(geom,
     return merge_same_type_geoms(other_type, tmap[other_type])
 
 
+# the following mirror kml2geojson's handling of a Placemark, with elements
+# matched by their local name instead of their name with the prefix
+
+def find_all(node, name):
+    return [ e for e in node.iter() if e is not node and local_name(e.tag) == name ]
+
+def find_first(node, name):
+    for e in node.iter():
+        if e is not node and local_name(e.tag) == name:
+            return e
+    return None
+
+def val(node):
+    if node is None or node.text is None:
+        return ''
+    return node.text.strip()
+
+def valf(node):
+    try:
+        return float(val(node))
+    except ValueError:
+        return None
+
+def build_geometry(node):
+    for multi_tag in [ 'MultiGeometry', 'MultiTrack' ]:
+        multi = find_first(node, multi_tag)
+        if multi is not None:
+            return build_geometry(multi)
+
+    geoms = []
+    times = []
+    for geotype in GEOMETRY_TAGS:
+        for geonode in find_all(node, geotype):
+            if geotype == 'Point':
+                geoms.append({
+                    'type': 'Point',
+                    'coordinates': coords1(val(find_first(geonode, 'coordinates')))
+                })
+            elif geotype == 'LineString':
+                geoms.append({
+                    'type': 'LineString',
+                    'coordinates': coords(val(find_first(geonode, 'coordinates')))
+                })
+            elif geotype == 'Polygon':
+                rings = find_all(geonode, 'LinearRing')
+                geoms.append({
+                    'type': 'Polygon',
+                    'coordinates': [ coords(val(find_first(ring, 'coordinates'))) for ring in rings ]
+                })
+            else:
+                geoms.append({
+                    'type': 'LineString',
+                    'coordinates': [ gx_coords1(val(e)) for e in find_all(geonode, 'coord') ]
+                })
+                track_times = [ val(e) for e in find_all(geonode, 'when') ]
+                if track_times:
+                    times.append(track_times)
+
+    return geoms, times
+
+def build_style_props(node, props):
+    x = find_first(node, 'PolyStyle')
+    if x is not None:
+        color = val(find_first(x, 'color'))
+        if color:
+            rgb, opacity = build_rgb_and_opacity(color)
+            props['fill'] = rgb
+            props['fill-opacity'] = opacity
+            props['stroke'] = rgb
+            props['stroke-opacity'] = opacity
+            props['stroke-width'] = 1
+        fill = valf(find_first(x, 'fill'))
+        if fill == 0:
+            props['fill-opacity'] = fill
+        elif fill == 1 and 'fill-opacity' not in props:
+            props['fill-opacity'] = fill
+        outline = valf(find_first(x, 'outline'))
+        if outline == 0:
+            props['stroke-opacity'] = outline
+        elif outline == 1 and 'stroke-opacity' not in props:
+            props['stroke-opacity'] = outline
+
+    x = find_first(node, 'LineStyle')
+    if x is not None:
+        color = val(find_first(x, 'color'))
+        if color:
+            rgb, opacity = build_rgb_and_opacity(color)
+            props['stroke'] = rgb
+            props['stroke-opacity'] = opacity
+        width = valf(find_first(x, 'width'))
+        if width:
+            props['stroke-width'] = width
+
+def build_feature(node):
+    geoms, times = build_geometry(node)
+    if not geoms:
+        return None
+
+    props = {}
+    name = val(find_first(node, 'name'))
+    if name:
+        props['name'] = name
+    desc = val(find_first(node, 'description'))
+    if desc:
+        props['description'] = desc
+    x = find_first(node, 'styleUrl')
+    if x is not None:
+        style_url = val(x)
+        if style_url[0] != '#':
+            style_url = '#' + style_url
+        props['styleUrl'] = style_url
+
+    build_style_props(node, props)
+
+    x = find_first(node, 'ExtendedData')
+    if x is not None:
+        for data in find_all(x, 'Data'):
+            props[data.get('name', '')] = val(find_first(data, 'value'))
+        for simple_data in find_all(x, 'SimpleData'):
+            props[simple_data.get('name', '')] = val(simple_data)
+    x = find_first(node, 'TimeSpan')
+    if x is not None:
+        props['timeSpan'] = { 'begin': val(find_first(x, 'begin')),
+                              'end': val(find_first(x, 'end')) }
+    if times:
+        props['times'] = times[0] if len(times) == 1 else times
+
+    feature = {
+        'type': 'Feature',
+        'properties': props,
+    }
+    if len(geoms) == 1:
+        feature['geometry'] = geoms[0]
+    else:
+        feature['geometry'] = {
+            'type': 'GeometryCollection',
+            'geometries': geoms,
+        }
+
+    if node.get('id', ''):
+        feature['id'] = node.get('id')
+
+    return feature
+
+
+class KMLStreamParser(XMLStreamParser):
+    """
+    Converts the Placemarks in a KML response to GeoJSON features as they
+    complete, dropping each one from the tree once it is done with.
+    """
+    def __init__(self, strip_singular_points_from_multi_geoms, keep_original_props,
+                 props_extractor=None):
+        super().__init__()
+        self.strip_singular_points_from_multi_geoms = strip_singular_points_from_multi_geoms
+        self.keep_original_props = keep_original_props
+        self.props_extractor = props_extractor if props_extractor is not None else PropsExtractor()
+
+    def handle_end(self, elem, parent):
+        if local_name(elem.tag) != 'Placemark':
+            return []
+
+        feat = build_feature(elem)
+        if parent is not None:
+            parent.remove(elem)
+        if feat is None:
+            return []
+
+        convert_kml_props(feat, self.keep_original_props, self.props_extractor)
+        feat['geometry'] = tranform_geo_collection(feat['geometry'],
+                                                   self.strip_singular_points_from_multi_geoms)
+        return [ feat ]
+
+
 def kml_extract_features(xml_text,
                          strip_singular_points_from_multi_geoms,
                          keep_original_props):
-    xml_text = re.sub(r'&#([a-zA-Z0-9]+);?', r'[#\1;]', xml_text)
-    handle_error_xml(xml_text)
-    fh = io.StringIO(xml_text)
-    feature_collections = kml2geojson.main.convert(fh)
-    data = feature_collections[0]
-    feats = data['features']
-    for feat in feats:
-        convert_kml_props(feat, keep_original_props)
-        feat['geometry'] = tranform_geo_collection(feat['geometry'],
-                                                   strip_singular_points_from_multi_geoms)
-
+    parser = KMLStreamParser(strip_singular_points_from_multi_geoms, keep_original_props)
+    feats = parser.feed(xml_text)
+    feats.extend(parser.close())
     return feats
-
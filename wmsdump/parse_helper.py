@@ -0,0 +1,55 @@
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .kml_helper import KMLStreamParser
+from .georss_helper import GeoRSSStreamParser
+from .props_helper import PropsExtractor
+
+# one per worker process, holds on to the description layout across responses
+props_extractor = None
+
+def get_getmap_stream_parser(getmap_format, kml_strip_point, kml_keep_original_props, extractor):
+    if getmap_format == 'GEORSS':
+        return GeoRSSStreamParser(extractor)
+    return KMLStreamParser(kml_strip_point, kml_keep_original_props, extractor)
+
+def parse_getmap_response(data, getmap_format, kml_strip_point, kml_keep_original_props):
+    # runs in the worker processes, so it sticks to picklable arguments and results
+    global props_extractor
+
+    if props_extractor is None:
+        props_extractor = PropsExtractor()
+
+    parser = get_getmap_stream_parser(getmap_format, kml_strip_point,
+                                      kml_keep_original_props, props_extractor)
+    feats = parser.feed(data)
+    feats.extend(parser.close())
+    return feats
+
+def create_parse_pool(workers):
+    # spawned instead of forked, the dumpers have threads running by the time this is called
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+class PoolParser:
+    """
+    Collects the response body and hands it over to a process pool to parse,
+    for formats which are too heavy to parse on the fetching threads.
+    The fetching thread waits for the result in close().
+    """
+    def __init__(self, pool, parse_fn, *args):
+        self.pool = pool
+        self.parse_fn = parse_fn
+        self.args = args
+        self.chunks = []
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+        return []
+
+    def close(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return self.pool.submit(self.parse_fn, data, *self.args).result()
@@ -0,0 +1,149 @@
+from itertools import chain
+
+numpy_available = True
+try:
+    import numpy as np
+except ImportError:
+    numpy_available = False
+
+# nesting depth of the positions in the coordinates of each geometry type
+POSITION_DEPTH = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 1,
+    'Polygon': 2,
+    'MultiLineString': 2,
+    'MultiPolygon': 3,
+}
+
+# below this many coordinate values numpy doesn't pay for the conversions
+MIN_BATCH_VALUES = 64
+# 10**precision is exact in float64 only up to here
+MAX_BATCH_PRECISION = 22
+# scaled values are integers beyond this, and can't be rounded by scaling
+MAX_SCALED_VALUE = 2.0 ** 52
+# the scaled values are off by half an ulp, those this close to a tie
+# could round either way and are left to round() to settle
+TIE_TOLERANCE = 8 * 2.0 ** -52
+
+
+def truncate_nested_coordinates(coords, precision):
+    if type(coords) is not list:
+        return round(float(coords), precision)
+
+    return [ truncate_nested_coordinates(c, precision) for c in coords ]
+
+def truncate_geometry(geom, precision):
+    if geom is None or precision == -1:
+        return
+    if geom['type'] == 'GeometryCollection':
+        for subgeom in geom['geometries']:
+            truncate_geometry(subgeom, precision)
+    else:
+        geom['coordinates'] = truncate_nested_coordinates(geom['coordinates'], precision)
+
+def flatten_geometries(geoms, out):
+    # GeometryCollections are expanded in place
+    for geom in geoms:
+        if geom is None:
+            continue
+        if geom['type'] == 'GeometryCollection':
+            flatten_geometries(geom['geometries'], out)
+        else:
+            out.append(geom)
+    return out
+
+def collect_rings(coords, depth, rings):
+    # the innermost lists of positions, a point is taken as a ring of one
+    if depth == 0:
+        rings.append([coords])
+    elif depth == 1:
+        rings.append(coords)
+    else:
+        for c in coords:
+            collect_rings(c, depth - 1, rings)
+
+def rebuild_coordinates(coords, depth, new_rings):
+    if depth == 0:
+        return next(new_rings)[0]
+    if depth == 1:
+        return next(new_rings)
+    return [ rebuild_coordinates(c, depth - 1, new_rings) for c in coords ]
+
+def round_array(arr, precision):
+    # rounds like round(), which rounds the exact decimal value of each
+    # float, scaling by 10**precision only differs from it close to ties
+    scale = 10.0 ** precision
+    scaled = arr * scale
+    rounded = np.rint(scaled) / scale
+
+    mag = np.abs(scaled)
+    frac = mag - np.floor(mag)
+    unsure = (np.abs(frac - 0.5) <= mag * TIE_TOLERANCE) | (mag >= MAX_SCALED_VALUE)
+    if unsure.any():
+        idxs = np.nonzero(unsure)
+        rounded[idxs] = [ round(float(v), precision) for v in arr[idxs] ]
+    return rounded
+
+def truncate_geometries_np(geoms, precision):
+    # returns False if the geometries don't fit in one array
+    rings = []
+    for geom in geoms:
+        depth = POSITION_DEPTH.get(geom['type'], None)
+        if depth is None:
+            return False
+        try:
+            collect_rings(geom['coordinates'], depth, rings)
+        except TypeError:
+            # coordinates not nested the way the type says
+            return False
+
+    positions = [ p for ring in rings for p in ring ]
+    if len(positions) == 0:
+        return True
+    if len(positions) * 2 < MIN_BATCH_VALUES:
+        return False
+
+    try:
+        dim = len(positions[0])
+        if any(len(p) != dim for p in positions):
+            return False
+        arr = np.fromiter(chain.from_iterable(positions), dtype=np.float64,
+                          count=len(positions) * dim)
+    except (ValueError, TypeError):
+        # positions which aren't lists, or values which aren't numbers
+        return False
+    # numpy reads None as nan, round() doesn't take it
+    if np.isnan(arr).any():
+        return False
+
+    flat = round_array(arr, precision).reshape(len(positions), dim).tolist()
+
+    new_rings = []
+    start = 0
+    for ring in rings:
+        end = start + len(ring)
+        new_rings.append(flat[start:end])
+        start = end
+
+    it = iter(new_rings)
+    for geom in geoms:
+        depth = POSITION_DEPTH[geom['type']]
+        geom['coordinates'] = rebuild_coordinates(geom['coordinates'], depth, it)
+    return True
+
+def truncate_geometries(geoms, precision):
+    """
+    Same as calling truncate_geometry on each of the geometries, but with numpy
+    all the positions of the batch are rounded in one go.
+    """
+    if precision == -1:
+        return
+
+    if numpy_available and 0 <= precision <= MAX_BATCH_PRECISION:
+        flat_geoms = flatten_geometries(geoms, [])
+        if truncate_geometries_np(flat_geoms, precision):
+            return
+
+    for geom in geoms:
+        truncate_geometry(geom, precision)
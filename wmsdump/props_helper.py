@@ -1,5 +1,20 @@
+import re
+import html
+
 from bs4 import BeautifulSoup
 
+# the description template geoserver uses for kml and georss,
+# any other markup goes through BeautifulSoup
+LI_PATTERN = r'<li><strong><span class="atr-name">{}</span>:</strong> <span class="atr-value">([^<]*)</span></li>'
+DOC_PREFIX = r'\s*(?:<h4>[^<]*</h4>\s*)?<ul class="textattributes">'
+DOC_SUFFIX = r'\s*</ul>\s*'
+
+TEMPLATE_RE = re.compile(DOC_PREFIX + r'((?:\s*' + LI_PATTERN.format(r'[^<]*') + r')*)' + DOC_SUFFIX)
+TEMPLATE_LI_RE = re.compile(LI_PATTERN.format(r'([^<]*)'))
+# BeautifulSoup has its own take on unknown or unterminated entities,
+# the text is only decoded here when all of them are the common ones
+UNCOMMON_ENTITY_RE = re.compile(r'&(?!(?:amp|lt|gt|quot|apos|#[0-9]+|#[xX][0-9a-fA-F]+);)')
+
 def get_props_from_html(content):
     # TODO: check that the data is indeed in html
     soup = BeautifulSoup(content, 'html.parser')
@@ -13,3 +28,63 @@ def get_props_from_html(content):
         props[parts[0]] = parts[1].strip()
     return props
 
+def has_uncommon_entities(content):
+    return '&' in content and UNCOMMON_ENTITY_RE.search(content) is not None
+
+def get_items_from_template(content):
+    # returns None if the content is not in the expected template
+    m = TEMPLATE_RE.fullmatch(content)
+    if m is None:
+        return None
+
+    items = []
+    for name, value in TEMPLATE_LI_RE.findall(m.group(1)):
+        name = html.unescape(name)
+        # the key is whatever comes before the first colon in the text of the <li>
+        if ':' in name:
+            return None
+        items.append((name.lstrip(), html.unescape(value).strip()))
+    return items
+
+
+class PropsExtractor:
+    """
+    Pulls the properties out of the html descriptions in KML and GeoRSS.
+    Features of a layer come with the same keys in the same order, so the
+    keys seen last are remembered and the next description is matched
+    against a pattern with just the values left to capture. Descriptions
+    which don't fit the geoserver template are parsed with BeautifulSoup.
+    """
+    def __init__(self):
+        # (keys, compiled pattern) of the last description matched
+        self.layout = None
+
+    def get_layout_re(self, keys):
+        pattern = ''.join(r'\s*' + LI_PATTERN.format(re.escape(html.escape(k, quote=False)))
+                          for k in keys)
+        return re.compile(DOC_PREFIX + pattern + DOC_SUFFIX)
+
+    def extract(self, content):
+        if '<' not in content:
+            return {}
+
+        if has_uncommon_entities(content):
+            return get_props_from_html(content)
+
+        layout = self.layout
+        if layout is not None:
+            keys, layout_re = layout
+            m = layout_re.fullmatch(content)
+            if m is not None:
+                return { k: html.unescape(v).strip() for k, v in zip(keys, m.groups()) }
+
+        items = get_items_from_template(content)
+        if items is None:
+            return get_props_from_html(content)
+
+        props = dict(items)
+        keys = tuple(props.keys())
+        # repeated keys would have the later values win, which the layout can't capture
+        if len(keys) == len(items) and (layout is None or layout[0] != keys):
+            self.layout = (keys, self.get_layout_re(keys))
+        return props
@@ -0,0 +1,145 @@
+import time
+import asyncio
+import logging
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_STATUS_CODES = [ 429, 503 ]
+
+def get_retry_after(status_code, headers):
+    if status_code not in RETRY_AFTER_STATUS_CODES:
+        return None
+
+    val = headers.get('Retry-After', None)
+    if val is None:
+        return None
+    val = val.strip()
+
+    try:
+        return max(0.0, float(val))
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(val)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        # tokens are not refilled before this time
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        if now <= self.updated:
+            return
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        # takes a token right away and returns how long the caller has to wait
+        # before using it, the token count going negative queues up the callers
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            wait = max(0.0, self.updated - now)
+            if self.rate is None:
+                return wait
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait += -self.tokens / self.rate
+            return wait
+
+    def defer(self, secs):
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.updated = max(self.updated, now + secs)
+            self.tokens = min(self.tokens, 0)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiting of requests, kept per host.
+    per_host maps a host to a (requests_per_second, burst) tuple to override
+    the defaults. A rate of None means no limit, the bucket then only holds
+    back requests when a server has asked to back off with Retry-After.
+    Safe to share between threads and between asyncio tasks.
+    """
+    def __init__(self, requests_per_second=None, burst=1, per_host=None):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.per_host = per_host if per_host is not None else {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def is_limited(self, url):
+        rate, _ = self.per_host.get(urlparse(url).netloc,
+                                    (self.requests_per_second, self.burst))
+        return rate is not None
+
+    def get_bucket(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                rate, burst = self.per_host.get(host, (self.requests_per_second, self.burst))
+                self.buckets[host] = TokenBucket(rate, burst)
+            return self.buckets[host]
+
+    def wait(self, url):
+        secs = self.get_bucket(url).reserve()
+        if secs > 0:
+            logger.debug(f'rate limiting, waiting for {secs:.2f} secs')
+            time.sleep(secs)
+
+    async def async_wait(self, url):
+        secs = self.get_bucket(url).reserve()
+        if secs > 0:
+            logger.debug(f'rate limiting, waiting for {secs:.2f} secs')
+            await asyncio.sleep(secs)
+
+    def defer(self, url, secs):
+        self.get_bucket(url).defer(secs)
+
+
+class HostConcurrencyLimiter:
+    """
+    Caps the number of requests in flight to each host across all the
+    dumpers sharing it. A limit of None means no limit.
+    Blocks the calling thread, so it is only meant for threaded dumpers.
+    """
+    def __init__(self, max_per_host=None):
+        self.max_per_host = max_per_host
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def get_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.semaphores[host]
+
+    @contextmanager
+    def slot(self, url):
+        if self.max_per_host is None:
+            yield
+            return
+
+        with self.get_semaphore(url):
+            yield
@@ -0,0 +1,68 @@
+from statistics import median
+
+SPLIT_STRATEGIES = [ 'QUAD', 'MEDIAN' ]
+
+# split lines are kept this fraction of the width/height away from the edges
+# so that a lopsided sample can't produce slivers
+MIN_SPLIT_RATIO = 0.05
+# fewer features than this are not a useful sample of where the data is
+MIN_SAMPLE_SIZE = 4
+
+def iter_positions(coords):
+    if len(coords) > 0 and not isinstance(coords[0], list):
+        yield coords
+        return
+
+    for c in coords:
+        yield from iter_positions(c)
+
+def get_geometry_bounds(geom):
+    if geom is None:
+        return None
+
+    if geom['type'] == 'GeometryCollection':
+        parts = [ get_geometry_bounds(g) for g in geom['geometries'] ]
+        parts = [ p for p in parts if p is not None ]
+        if len(parts) == 0:
+            return None
+        return [ min(p[0] for p in parts), min(p[1] for p in parts),
+                 max(p[2] for p in parts), max(p[3] for p in parts) ]
+
+    xs = []
+    ys = []
+    for pos in iter_positions(geom.get('coordinates', [])):
+        xs.append(pos[0])
+        ys.append(pos[1])
+    if len(xs) == 0:
+        return None
+    return [ min(xs), min(ys), max(xs), max(ys) ]
+
+def clamp_split(val, lower, upper):
+    margin = (upper - lower) * MIN_SPLIT_RATIO
+    return min(max(val, lower + margin), upper - margin)
+
+def get_split_point(envelope, features):
+    # median of the centers of the features seen in the envelope,
+    # None if there isn't enough to go on
+    xs = []
+    ys = []
+    for feat in features:
+        bounds = get_geometry_bounds(feat.get('geometry', None))
+        if bounds is None:
+            continue
+
+        cx = (bounds[0] + bounds[2]) / 2.0
+        cy = (bounds[1] + bounds[3]) / 2.0
+        # geometries can come back in a different CRS from the envelope, like with KML
+        if cx < envelope['xmin'] or cx > envelope['xmax'] or \
+           cy < envelope['ymin'] or cy > envelope['ymax']:
+            continue
+
+        xs.append(cx)
+        ys.append(cy)
+
+    if len(xs) < MIN_SAMPLE_SIZE:
+        return None
+
+    return [ clamp_split(median(xs), envelope['xmin'], envelope['xmax']),
+             clamp_split(median(ys), envelope['ymin'], envelope['ymax']) ]
@@ -1,4 +1,6 @@
+import os
 import json
+import time
 import logging
 
 from enum import Enum
@@ -6,6 +8,9 @@ from pathlib import Path
 
 import jsonschema
 
+from . import json_codec
+from .dedup_helper import DigestIndex, get_dedup_path
+
 logger = logging.getLogger(__name__)
 
 COMMON_PROPS = {
@@ -32,6 +37,31 @@ COMMON_PROPS = {
         "description": "the ogc operation used.. one of GetMap, GetFeatureInfo or GetFeature",
         "type": "string",
         "pattern": "GetMap|GetFeatureInfo|GetFeature"
+    },
+    "batch_size": {
+        "description": "batch size arrived at when adapting the batch size",
+        "type": ["integer", "null"],
+        "minimum": 1
+    },
+    "batch_size_cap": {
+        "description": "limit on records per request discovered while adapting the batch size",
+        "type": ["integer", "null"],
+        "minimum": 1
+    },
+    "json_backend": {
+        "description": "json library used to write the output file.. json if missing",
+        "type": "string",
+        "enum": json_codec.JSON_BACKENDS
+    },
+    "mixed_json_backends": {
+        "description": "whether some of the output was written with another json library, "
+                     "when json_backend wasn't available.. false if missing",
+        "type": "boolean"
+    },
+    "journal_seq": {
+        "description": "sequence number of the last journal record included in this checkpoint",
+        "type": "integer",
+        "minimum": 0
     }
 }
 
@@ -62,6 +92,29 @@ EXTENT_SCHEMA = {
     "type" : "object",
     "required": COMMON_REQUIRED + [ "explored_tree" ],
     "properties": COMMON_PROPS | {
+        "bounds": {
+            "type": "object",
+            "description": "bounds the explored tree starts from.. the CRS bounds if missing",
+            "required": [ "xmin", "ymin", "xmax", "ymax" ],
+            "properties": {
+                "xmin": { "type": "number" },
+                "ymin": { "type": "number" },
+                "xmax": { "type": "number" },
+                "ymax": { "type": "number" }
+            }
+        },
+        "dedup_key": {
+            "description": "feature id, or the property, records are deduplicated on.. "
+                           "their contents if missing",
+            "type": "string"
+        },
+        "tree_version": {
+            "description": "layout of the explored tree.. 2 drops the subtrees of explored bounds, "
+                           "1 if missing, which keeps every bounds ever visited",
+            "type": "integer",
+            "minimum": 1,
+            "maximum": 2
+        },
         "explored_tree": {
             "type": "object",
             "description": "bounds tree and their exploration status",
@@ -72,6 +125,28 @@ EXTENT_SCHEMA = {
                     "maximum": 3
                 }
             }
+        },
+        "split_points": {
+            "type": "object",
+            "description": "points at which open bounds were split, for the ones not split down the middle",
+            "patternProperties": {
+                "^[0-3]+$": {
+                    "type": "array",
+                    "items": { "type": "number" },
+                    "minItems": 2,
+                    "maxItems": 2
+                }
+            }
+        },
+        "tile_index": {
+            "type": "object",
+            "description": "offset till which the tiles being paged through have been explored",
+            "patternProperties": {
+                "^[0-3]+$": {
+                    "type": "integer",
+                    "minimum": 0
+                }
+            }
         }
     }
 }
@@ -95,6 +170,9 @@ def validate_state_dict(state_data):
     return True, None
 
 
+# version of the explored tree layout written out
+TREE_VERSION = 2
+
 class Extent(Enum):
     NOT_PRESENT = 0
     OPEN = 1
@@ -107,13 +185,30 @@ class State:
                  service=None,
                  version=None,
                  operation=None,
+                 batch_size=None,
+                 batch_size_cap=None,
+                 json_backend=None,
+                 mixed_json_backends=False,
+                 journal_seq=0,
                  **params):
         self.url = url
         self.layername = layername
         self.service = service
         self.version = version
         self.operation = operation
-        self.updatecb = None
+        self.batch_size = batch_size
+        self.batch_size_cap = batch_size_cap
+        # the json library the output file was written with, and the one
+        # records get encoded with now, which differ when it isn't available anymore
+        self.json_backend = json_backend if json_backend is not None else json_codec.get_backend()
+        self.encode_backend = self.json_backend
+        self.mixed_json_backends = mixed_json_backends
+        # set when the existing lines have to be re-encoded to compare them
+        self.normalize_lines = mixed_json_backends
+        self.journal_seq = journal_seq
+        # where the updates are recorded, a StateJournal or a SQLiteStore
+        self.store = None
+        self.recorded_batch_size = (batch_size, batch_size_cap)
         self.mode = None
 
     def from_dict(**params):
@@ -125,6 +220,37 @@ class State:
 
         raise Exception(f'Unsupported mode: {mode}')
 
+    def check_json_backend(self):
+        if not json_codec.is_available(self.json_backend):
+            logger.warning(f'{self.json_backend} used for writing the output file is not available.. '
+                           'existing records will be re-encoded for comparisons')
+            self.encode_backend = json_codec.get_backend()
+            self.mixed_json_backends = True
+        # once lines from another library are in, they stay in
+        self.normalize_lines = self.mixed_json_backends
+
+    def record_update(self, record):
+        # records hold the values after the update, so replaying them twice is harmless
+        if self.store is None:
+            return
+        batch_size = (self.batch_size, self.batch_size_cap)
+        if batch_size != self.recorded_batch_size:
+            record['batch_size'], record['batch_size_cap'] = batch_size
+            self.recorded_batch_size = batch_size
+        self.store.record(record)
+
+    def apply_record(self, record):
+        if 'batch_size' in record:
+            self.batch_size = record['batch_size']
+            self.batch_size_cap = record['batch_size_cap']
+            self.recorded_batch_size = (self.batch_size, self.batch_size_cap)
+
+    def encode_feature(self, feature):
+        return json_codec.dumps(feature, self.encode_backend)
+
+    def get_encoded(self, feature):
+        # the encoded form of the feature if it was already encoded during deduplication
+        return None
 
     def is_in_sync(self,
                    url=None,
@@ -154,7 +280,7 @@ class State:
         return True, None
 
     def get_dict(self):
-        return {
+        d = {
             "url": self.url,
             "layername": self.layername,
             "service": self.service,
@@ -162,50 +288,232 @@ class State:
             "operation": self.operation,
             "mode": self.mode
         }
+        if self.batch_size is not None:
+            d['batch_size'] = self.batch_size
+        if self.batch_size_cap is not None:
+            d['batch_size_cap'] = self.batch_size_cap
+        d['json_backend'] = self.json_backend
+        if self.mixed_json_backends:
+            d['mixed_json_backends'] = True
+        if self.journal_seq > 0:
+            d['journal_seq'] = self.journal_seq
+        return d
+
+def get_key_str(feature, dedup_key):
+    # None when the feature doesn't have the key, the feature's contents are compared then
+    if dedup_key == 'id':
+        value = feature.get('id', None)
+    else:
+        props = feature.get('properties', None)
+        value = props.get(dedup_key, None) if props is not None else None
+    if value is None:
+        return None
+    # can't be mistaken for an encoded feature, which starts with a "{"
+    return f'{dedup_key}={value!r}'
+
+def get_line_size(f_str):
+    # in bytes, with the newline
+    if f_str.isascii():
+        return len(f_str) + 1
+    return len(f_str.encode('utf-8')) + 1
+
+
+class FeatureHashes:
+    """
+    Line numbers of the features in the output file by the hash of their
+    encoded form, to find the lines to compare a new feature against.
+    """
+    # whether a match can be taken as the same feature without comparing the lines
+    exact = False
+
+    def __init__(self):
+        self.hashes = {}
+
+    def hash(self, f_str):
+        return hash(f_str)
+
+    def get(self, hashed):
+        return self.hashes.get(hashed, ())
+
+    def add(self, hashed, idx):
+        idxs = self.hashes.get(hashed, None)
+        if idxs is None:
+            self.hashes[hashed] = [ idx ]
+        else:
+            idxs.append(idx)
+
 
 class ExtentState(State):
-    def __init__(self, explored_tree={}, **params):
+    def __init__(self, explored_tree=None, split_points=None, tile_index=None, bounds=None,
+                 tree_version=1, dedup_key=None, **params):
         super().__init__(**params)
         self.mode = 'EXTENT'
-        self.explored_tree = explored_tree
-        self.done = {}
+        self.bounds = bounds
+        self.dedup_key = dedup_key
+        # records dropped for having a key already seen, in this run
+        self.key_duplicates = 0
+        self.explored_tree = explored_tree if explored_tree is not None else {}
+        self.split_points = split_points if split_points is not None else {}
+        self.tile_index = tile_index if tile_index is not None else {}
+        if tree_version < TREE_VERSION:
+            self.compact_tree()
+        self.done = FeatureHashes()
+        # compare the lines even when the hashes are exact
+        self.verify_dedup = False
         self.current_count = 0
+        # bytes in the output file
+        self.current_size = 0
+        self.last_feature = None
+        self.last_feature_str = None
         self.get_nth = None
 
-    def update_coverage(self, key, status):
+    def set_coverage(self, key, status, split_point=None, tile_index=None):
         self.explored_tree[key] = status.value
-        if self.updatecb is not None:
-            self.updatecb(self.get_dict())
-
-    def add_raw_feature_no_dedup(self, f_str):
-        hashed = hash(f_str)
-        if hashed not in self.done:
-            self.done[hashed] = []
-        self.done[hashed].append(self.current_count)
+        if split_point is not None:
+            self.split_points[key] = split_point
+        if tile_index is not None:
+            self.tile_index[key] = tile_index
+        if status == Extent.EXPLORED:
+            # nothing under explored bounds is looked at again
+            self.tile_index.pop(key, None)
+            self.split_points.pop(key, None)
+            self.drop_subtree(key)
+
+    def drop_subtree(self, key):
+        # the children are explored before their parent, and had their
+        # subtrees dropped then, so this rarely goes beyond one level
+        for digit in '0123':
+            child = key + digit
+            if self.explored_tree.pop(child, None) is None:
+                continue
+            self.split_points.pop(child, None)
+            self.tile_index.pop(child, None)
+            self.drop_subtree(child)
+
+    def compact_tree(self):
+        # trees from before explored subtrees were dropped
+        explored = [ key for key, status in self.explored_tree.items()
+                     if status == Extent.EXPLORED.value ]
+        before = len(self.explored_tree)
+        for key in sorted(explored, key=len):
+            if key in self.explored_tree:
+                self.set_coverage(key, Extent.EXPLORED)
+        if len(self.explored_tree) < before:
+            logger.info(f'dropped {before - len(self.explored_tree)} entries under '
+                        'explored bounds from the explored tree')
+
+    def update_coverage(self, key, status, split_point=None, tile_index=None):
+        self.set_coverage(key, status, split_point, tile_index)
+        record = { 'op': 'coverage', 'key': key, 'status': status.value }
+        if split_point is not None:
+            record['split_point'] = split_point
+        if tile_index is not None:
+            record['tile_index'] = tile_index
+        self.record_update(record)
+
+    def update_tile_index(self, key, index_delta):
+        self.tile_index[key] += index_delta
+        self.record_update({ 'op': 'tile_index', 'key': key, 'value': self.tile_index[key] })
+
+    def apply_record(self, record):
+        super().apply_record(record)
+        op = record.get('op', None)
+        if op == 'coverage':
+            self.set_coverage(record['key'], Extent(record['status']),
+                              record.get('split_point', None), record.get('tile_index', None))
+        elif op == 'tile_index':
+            self.tile_index[record['key']] = record['value']
+
+    def is_in_sync(self, dedup_key=None, **invocation_params):
+        valid, reason = super().is_in_sync(**invocation_params)
+        if not valid:
+            return valid, reason
+
+        if self.dedup_key != dedup_key:
+            return False, f'dedup_key in state({self.dedup_key}) ' + \
+                          f'doesn\'t match invocation dedup_key({dedup_key})'
+        return True, None
+
+    def get_existing(self, idx):
+        existing = self.get_nth(idx)
+        if existing is not None and self.normalize_lines:
+            existing = json_codec.normalize(existing, self.encode_backend)
+        return existing
+
+    def get_existing_key(self, idx):
+        existing = self.get_nth(idx)
+        if existing is None:
+            return None
+        return get_key_str(json_codec.loads(existing, self.encode_backend), self.dedup_key)
+
+    def add_line(self, hashed, size):
+        self.done.add(hashed, self.current_count)
         self.current_count += 1
+        self.current_size += size
+
+    def add_raw_feature_no_dedup(self, f_str, size=None):
+        if size is None:
+            size = get_line_size(f_str)
+        key_str = None
+        if self.dedup_key is not None:
+            key_str = get_key_str(json_codec.loads(f_str, self.encode_backend), self.dedup_key)
+        if key_str is not None:
+            hashed = self.done.hash(key_str)
+        else:
+            if self.normalize_lines:
+                f_str = json_codec.normalize(f_str, self.encode_backend)
+            hashed = self.done.hash(f_str)
+        self.add_line(hashed, size)
+
+    def get_encoded(self, feature):
+        if feature is self.last_feature:
+            return self.last_feature_str
+        return None
 
-    def add_feature(self, feature):
-        f_str = json.dumps(feature)
-        hashed = hash(f_str)
-        if hashed in self.done:
-            for idx in self.done[hashed]:
-                existing = self.get_nth(idx)
-                if existing == f_str:
-                    return False
-            self.done[hashed].append(self.current_count)
-            self.current_count += 1
+    def is_duplicate(self, hashed, matches):
+        idxs = self.done.get(hashed)
+        if len(idxs) > 0 and self.done.exact and not self.verify_dedup:
             return True
+        return any(matches(idx) for idx in idxs)
 
-        self.done[hashed] = [ self.current_count ]
-        self.current_count += 1
+    def add_feature(self, feature):
+        key_str = None
+        if self.dedup_key is not None:
+            key_str = get_key_str(feature, self.dedup_key)
+
+        if key_str is not None:
+            # duplicates are dropped without being encoded
+            hashed = self.done.hash(key_str)
+            if self.is_duplicate(hashed, lambda idx: self.get_existing_key(idx) == key_str):
+                self.key_duplicates += 1
+                return False
+            f_str = self.encode_feature(feature)
+        else:
+            f_str = self.encode_feature(feature)
+            hashed = self.done.hash(f_str)
+            if self.is_duplicate(hashed, lambda idx: self.get_existing(idx) == f_str):
+                return False
+
+        self.last_feature = feature
+        self.last_feature_str = f_str
+        self.add_line(hashed, get_line_size(f_str))
         return True
 
     def get_dict(self):
         d = super().get_dict()
 
         d.update({
-            'explored_tree': self.explored_tree 
+            'tree_version': TREE_VERSION,
+            'explored_tree': self.explored_tree
         })
+        if self.bounds is not None:
+            d['bounds'] = self.bounds
+        if self.dedup_key is not None:
+            d['dedup_key'] = self.dedup_key
+        if len(self.split_points) > 0:
+            d['split_points'] = self.split_points
+        if len(self.tile_index) > 0:
+            d['tile_index'] = self.tile_index
         return d
 
 
@@ -243,8 +551,15 @@ class OffsetState(State):
     def update(self, index_delta, downloaded_count_delta):
         self.index_done_till += index_delta
         self.downloaded_count += downloaded_count_delta
-        if self.updatecb is not None:
-            self.updatecb(self.get_dict())
+        self.record_update({ 'op': 'offset',
+                             'index_done_till': self.index_done_till,
+                             'downloaded_count': self.downloaded_count })
+
+    def apply_record(self, record):
+        super().apply_record(record)
+        if record.get('op', None) == 'offset':
+            self.index_done_till = record['index_done_till']
+            self.downloaded_count = record['downloaded_count']
 
     def get_dict(self):
         d = super().get_dict()
@@ -257,7 +572,275 @@ class OffsetState(State):
         return d
 
 
-def get_state_from_files(state_file, output_file, **params):
+JOURNAL_SUFFIX = '.journal'
+STATE_DURABILITY = [ 'fsync', 'flush', 'lazy' ]
+STATE_BACKENDS = [ 'json', 'sqlite' ]
+STATE_SUFFIXES = { 'json': '.state', 'sqlite': '.state.db' }
+# a checkpoint is taken once the journal grows past the size of the last one,
+# or this size, which keeps the cost of checkpoints in line with the updates
+MIN_JOURNAL_SIZE = 1024 * 1024
+# records are held back in lazy mode till there are this many bytes of them,
+# or for this many seconds
+LAZY_BUFFER_SIZE = 64 * 1024
+LAZY_INTERVAL = 1.0
+
+def get_state_path(output_file, backend='json'):
+    return str(output_file) + STATE_SUFFIXES[backend]
+
+def get_journal_path(state_file):
+    return Path(str(state_file) + JOURNAL_SUFFIX)
+
+def sync_dir(path):
+    # for a rename to survive a power failure
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class StateJournal:
+    """
+    Keeps the state on disk as a checkpoint with the full state and a journal
+    of the updates since, a json record per line. The checkpoint is rewritten
+    by writing a temporary file and renaming it over the old one, once the
+    journal grows to its size, after which the journal starts afresh.
+
+    durability is one of
+      fsync - every record is synced to disk
+      flush - every record is handed over to the OS, which survives the process dying
+      lazy  - records are buffered, and written out every LAZY_INTERVAL seconds and on close
+
+    flush_output, when set, is called with whether to sync before any record
+    reaches the disk, so that the state never gets ahead of the output file.
+
+    In EXTENT mode the hashes of the features written are kept in a DigestIndex
+    next to the output file, which is synced along with the records.
+    """
+    def __init__(self, state, state_file, output_file, durability='flush'):
+        if durability not in STATE_DURABILITY:
+            raise Exception(f'state durability should be one of {STATE_DURABILITY}')
+        self.state = state
+        self.state_file = Path(state_file)
+        self.journal_file = get_journal_path(state_file)
+        self.output_file = Path(output_file)
+        self.durability = durability
+        self.flush_output = None
+        # FileWriter keeps its own
+        self.line_offsets = None
+        self.feature_hashes = None
+        if state.mode == 'EXTENT':
+            self.feature_hashes = DigestIndex(get_dedup_path(output_file))
+            state.done = self.feature_hashes
+            state.current_count = self.feature_hashes.lines
+            state.current_size = self.feature_hashes.size
+        self.seq = state.journal_seq
+        # opened with the first record after a checkpoint
+        self.fh = None
+        self.pending = []
+        self.pending_size = 0
+        self.last_write = time.monotonic()
+        self.journal_size = 0
+        self.checkpoint_size = 0
+        self.has_checkpoint = False
+        state.store = self
+
+        # a resumed state is compacted right away, a new one
+        # is written out with the first update
+        if self.state_file.exists():
+            self.checkpoint()
+
+    def sync_output(self):
+        fsync = self.durability == 'fsync'
+        if self.flush_output is not None:
+            self.flush_output(fsync)
+        if self.feature_hashes is not None:
+            self.feature_hashes.sync(self.state.current_count, self.state.current_size, fsync)
+
+    def record(self, record):
+        self.seq += 1
+        if not self.has_checkpoint:
+            self.checkpoint()
+            return
+
+        record['seq'] = self.seq
+        line = json.dumps(record) + '\n'
+        self.journal_size += len(line)
+        self.pending.append(line)
+        self.pending_size += len(line)
+        if self.durability != 'lazy' or self.pending_size >= LAZY_BUFFER_SIZE or \
+           time.monotonic() - self.last_write >= LAZY_INTERVAL:
+            self.write_pending()
+
+        if self.journal_size >= max(self.checkpoint_size, MIN_JOURNAL_SIZE):
+            self.checkpoint()
+
+    def write_pending(self):
+        if len(self.pending) == 0:
+            return
+        self.sync_output()
+        if self.fh is None:
+            self.fh = open(self.journal_file, 'a')
+        self.fh.write(''.join(self.pending))
+        self.fh.flush()
+        if self.durability == 'fsync':
+            os.fsync(self.fh.fileno())
+        self.pending = []
+        self.pending_size = 0
+        self.last_write = time.monotonic()
+
+    def checkpoint(self):
+        self.sync_output()
+        self.state.journal_seq = self.seq
+        data = json.dumps(self.state.get_dict())
+        tmp_file = self.state_file.with_name(self.state_file.name + '.tmp')
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+            if self.durability != 'lazy':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+        if self.durability == 'fsync':
+            sync_dir(self.state_file.parent)
+        self.checkpoint_size = len(data)
+        self.has_checkpoint = True
+
+        # the records so far are in the checkpoint, those left behind
+        # by a crash right here are skipped by their sequence numbers
+        self.pending = []
+        self.pending_size = 0
+        self.close_journal()
+        open(self.journal_file, 'w').close()
+        self.journal_size = 0
+
+        # to avoid state being written without a output file being present
+        # as the resumption checks don't allow for it
+        if not self.output_file.exists():
+            self.output_file.write_text('')
+
+    def sync_lines(self):
+        """
+        Reads the lines of the output file after the ones the dedup index
+        covers into it, and returns the number of lines in the file.
+        The index is built afresh if it doesn't match the file.
+        """
+        index = self.feature_hashes
+        # hashes of lines written with a json library which isn't around
+        # anymore don't match the normalized lines, they are worked out again
+        rebuild = self.state.normalize_lines
+        if not rebuild and not ends_with_line(self.output_file, index.size):
+            logger.warning(f'{index.path} doesn\'t match {self.output_file}.. building it again')
+            rebuild = True
+        if rebuild:
+            index.remove()
+            self.state.current_count = 0
+            self.state.current_size = 0
+
+        start = self.state.current_size
+        if start == 0:
+            logger.info(f'Reading existing records in {self.output_file}')
+        with open(self.output_file, 'r+b') as f:
+            f.seek(start)
+            for line in iter_complete_lines(f, self.output_file):
+                self.state.add_raw_feature_no_dedup(line.decode('utf-8').strip('\n'), len(line))
+        index.sync(self.state.current_count, self.state.current_size)
+        return self.state.current_count
+
+    def close_journal(self):
+        self.write_pending()
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def close(self):
+        self.close_journal()
+        if self.feature_hashes is not None:
+            # the output file is closed by now
+            self.feature_hashes.sync(self.state.current_count, self.state.current_size)
+            self.feature_hashes.close()
+
+    def remove(self):
+        self.pending = []
+        self.close_journal()
+        if self.feature_hashes is not None:
+            self.feature_hashes.remove()
+            self.feature_hashes = None
+        for path in [ self.state_file, self.journal_file ]:
+            path.unlink(missing_ok=True)
+
+
+def replay_journal(state, journal_file):
+    journal_file = Path(journal_file)
+    if not journal_file.exists():
+        return 0
+
+    count = 0
+    with open(journal_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f'{journal_file} ends in an incomplete record.. ignoring it')
+                break
+            seq = record.get('seq', 0)
+            if seq <= state.journal_seq:
+                continue
+            if seq != state.journal_seq + 1:
+                logger.warning(f'{journal_file} has records missing.. ignoring the rest')
+                break
+            state.apply_record(record)
+            state.journal_seq = seq
+            count += 1
+    return count
+
+
+def ends_with_line(path, size):
+    # whether a line ends at size bytes into the file
+    if size == 0:
+        return True
+    if Path(path).stat().st_size < size:
+        return False
+    with open(path, 'rb') as f:
+        f.seek(size - 1)
+        return f.read(1) == b'\n'
+
+def count_lines(path, keep_count):
+    """
+    Returns the number of complete lines in the file, and the size of
+    the first keep_count of them, without changing the file.
+    """
+    logger.info(f'Counting existing records in {path}')
+    count = 0
+    size = 0
+    keep_size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            count += 1
+            size += len(line)
+            if count <= keep_count:
+                keep_size = size
+    return count, keep_size
+
+def iter_complete_lines(f, path):
+    # the lines from where f is, with an incomplete last line dropped from the file
+    for line in f:
+        if not line.endswith(b'\n'):
+            # cut short by the last run stopping, the record will be fetched again
+            logger.warning(f'dropping the incomplete record at the end of {path}')
+            f.truncate(f.tell() - len(line))
+            return
+        yield line
+
+
+def check_state_files(state_file, output_file):
+    # returns whether to resume, None if the files don't allow either
     output_file_exists = Path(output_file).exists()
     state_file_exists = Path(state_file).exists()
 
@@ -271,10 +854,19 @@ def get_state_from_files(state_file, output_file, **params):
                       'Can\'t continue.. delete the existing file to proceed')
         return None
 
-
     if state_file_exists and output_file_exists:
         logger.info('Both the output file and state file exists..'
                     'trying to resume extraction')
+        return True
+    return False
+
+
+def get_state_from_files(state_file, output_file, durability='flush', **params):
+    resume = check_state_files(state_file, output_file)
+    if resume is None:
+        return None
+
+    if resume:
         try:
             state_data = json.loads(Path(state_file).read_text())
         except Exception:
@@ -286,36 +878,47 @@ def get_state_from_files(state_file, output_file, **params):
             logger.error(f'state in file is invalid. Reason: {reason}')
             return None
 
+        # state files from before the json backend was recorded were written with json
+        state_data.setdefault('json_backend', 'json')
         state = State.from_dict(**state_data)
+        state.check_json_backend()
 
+        replayed = replay_journal(state, get_journal_path(state_file))
+        if replayed > 0:
+            logger.info(f'Replayed {replayed} updates from the state journal')
+
+        # the files are only read till the state is known to be in sync
         if state.mode == 'OFFSET':
-            logger.info(f'Counting existing records in {output_file}')
-            seen_count = 0
-            with open(output_file, 'r') as f:
-                for line in f:
-                    seen_count += 1
-            params['downloaded_count'] = seen_count
+            seen_count, keep_size = count_lines(output_file, state.downloaded_count)
+            params['downloaded_count'] = min(seen_count, state.downloaded_count)
+            params.pop('dedup_key', None)
         else:
             del params['sort_key']
-            logger.info(f'Reading existing records in {output_file}')
-            with open(output_file, 'r') as f:
-                for line in f:
-                    state.add_raw_feature_no_dedup(line.strip('\n'))
 
         in_sync, reason = state.is_in_sync(**params)
         if not in_sync:
             logger.error(f'state not in sync. Reason: {reason}')
             return None
+
+        store = StateJournal(state, state_file, output_file, durability)
+        if state.mode == 'OFFSET':
+            if Path(output_file).stat().st_size > keep_size:
+                if seen_count > state.downloaded_count:
+                    # from pages written out after the last of the journal which got to
+                    # the disk, like with lazy durability
+                    logger.warning(f'dropping {seen_count - state.downloaded_count} records at the end of '
+                                   f'{output_file} which the state doesn\'t account for')
+                else:
+                    logger.warning(f'dropping the incomplete record at the end of {output_file}')
+                with open(output_file, 'r+b') as f:
+                    f.truncate(keep_size)
+        else:
+            store.sync_lines()
     else:
         state = State.from_dict(**params)
-    
-    def update_file(s):
-        Path(state_file).write_text(json.dumps(s))
-        # to avoid state being written without a output file being present
-        # as the above condition doesn't allow resumption
-        if not Path(output_file).exists():
-            Path(output_file).write_text('')
-    state.updatecb = update_file
+        # left behind by an extraction whose files were deleted
+        get_journal_path(state_file).unlink(missing_ok=True)
+        get_dedup_path(output_file).unlink(missing_ok=True)
+        StateJournal(state, state_file, output_file, durability)
 
     return state
-
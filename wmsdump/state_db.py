@@ -0,0 +1,408 @@
+import json
+import time
+import logging
+
+from hashlib import blake2b
+from pathlib import Path
+
+sqlite_available = True
+try:
+    import sqlite3
+except ImportError:
+    sqlite_available = False
+
+from .state import (
+    State, Extent, STATE_DURABILITY, LAZY_INTERVAL, TREE_VERSION,
+    validate_state_dict, check_state_files, iter_complete_lines
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    # json encoded values of everything but the explored tree
+    'CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS tiles (key TEXT PRIMARY KEY, status INTEGER NOT NULL, '
+    'split_x REAL, split_y REAL, tile_index INTEGER) WITHOUT ROWID',
+    # where each line of the output file starts, the last one is where the file ends
+    'CREATE TABLE IF NOT EXISTS lines (idx INTEGER PRIMARY KEY, offset INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS hashes (hash INTEGER NOT NULL, idx INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS hashes_hash ON hashes (hash)',
+]
+
+SYNCHRONOUS = { 'fsync': 'FULL', 'flush': 'NORMAL', 'lazy': 'OFF' }
+# in KiB, keeps the upper levels of the hash index in memory
+CACHE_SIZE = 64 * 1024
+# the fields updated by the records, the tiles are saved separately
+RECORD_FIELDS = [ 'index_done_till', 'downloaded_count', 'batch_size', 'batch_size_cap' ]
+TILE_FIELDS = [ 'explored_tree', 'split_points', 'tile_index' ]
+
+def get_db_files(state_file):
+    return [ Path(str(state_file) + suffix) for suffix in [ '', '-wal', '-shm' ] ]
+
+def connect(state_file, durability):
+    conn = sqlite3.connect(state_file)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={SYNCHRONOUS[durability]}')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE}')
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    conn.commit()
+    return conn
+
+def has_state(state_file):
+    conn = sqlite3.connect(state_file)
+    try:
+        return conn.execute('SELECT count(*) FROM state').fetchone()[0] > 0
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+def hash_line(f_str):
+    # unlike hash() this stays the same across runs
+    digest = blake2b(f_str.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+class DBFeatureHashes:
+    """
+    FeatureHashes kept in the hashes table, the ones added
+    are held back and inserted together by flush().
+    """
+    exact = False
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pending = {}
+
+    def hash(self, f_str):
+        return hash_line(f_str)
+
+    def get(self, hashed):
+        rows = self.conn.execute('SELECT idx FROM hashes WHERE hash = ?', (hashed,))
+        idxs = [ row[0] for row in rows ]
+        idxs.extend(self.pending.get(hashed, ()))
+        return idxs
+
+    def add(self, hashed, idx):
+        idxs = self.pending.get(hashed, None)
+        if idxs is None:
+            self.pending[hashed] = [ idx ]
+        else:
+            idxs.append(idx)
+
+    def flush(self):
+        self.conn.executemany('INSERT INTO hashes VALUES (?, ?)',
+                              [ (hashed, idx) for hashed, idxs in self.pending.items() for idx in idxs ])
+        self.pending = {}
+
+
+class DBLineOffsets:
+    """
+    The line number to file offset map of FileWriter kept in the lines table,
+    with the ones set held back and inserted together by flush().
+    count is the number of lines, the offset of which is where the file ends.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.pending = {}
+        row = conn.execute('SELECT max(idx) FROM lines').fetchone()
+        self.count = row[0] if row[0] is not None else 0
+
+    def __getitem__(self, n):
+        offset = self.pending.get(n, None)
+        if offset is not None:
+            return offset
+        row = self.conn.execute('SELECT offset FROM lines WHERE idx = ?', (n,)).fetchone()
+        if row is None:
+            raise KeyError(n)
+        return row[0]
+
+    def __setitem__(self, n, offset):
+        self.pending[n] = offset
+        self.count = max(self.count, n)
+
+    def flush(self):
+        self.conn.executemany('INSERT OR REPLACE INTO lines VALUES (?, ?)', self.pending.items())
+        self.pending = {}
+
+    def truncate(self, count):
+        self.flush()
+        self.conn.execute('DELETE FROM lines WHERE idx > ?', (count,))
+        self.count = count
+
+
+class SQLiteStore:
+    """
+    Keeps the state in a SQLite database in WAL mode. Each record updates the
+    rows it touches, the tiles of the explored tree are rows of their own.
+
+    The hashes of the features written, and where each line of the output file
+    starts, are kept in the database too, so that resuming doesn't have to read
+    through the output file, only the lines written after the last commit.
+
+    durability and flush_output are as with StateJournal, with the records
+    committed in lazy mode every LAZY_INTERVAL seconds.
+    """
+    def __init__(self, state, conn, state_file, output_file, durability='flush', resumed=False):
+        if durability not in STATE_DURABILITY:
+            raise Exception(f'state durability should be one of {STATE_DURABILITY}')
+        self.state = state
+        self.conn = conn
+        self.state_file = Path(state_file)
+        self.output_file = Path(output_file)
+        self.durability = durability
+        self.flush_output = None
+        self.last_commit = time.monotonic()
+        # a new database is written out with the first update,
+        # and dropped if there never was one
+        self.has_checkpoint = resumed
+        self.line_offsets = DBLineOffsets(conn)
+        self.feature_hashes = None
+        if state.mode == 'EXTENT':
+            self.feature_hashes = DBFeatureHashes(conn)
+            state.done = self.feature_hashes
+        state.store = self
+
+    def record(self, record):
+        if not self.has_checkpoint:
+            self.checkpoint()
+            return
+
+        key = record.get('key', None)
+        if key is not None:
+            self.save_tile(key)
+        self.save_fields([ name for name in RECORD_FIELDS if name in record ])
+        self.commit()
+
+    def save_fields(self, names):
+        if len(names) == 0:
+            return
+        values = self.state.get_dict()
+        self.conn.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                              [ (name, json.dumps(values.get(name, None))) for name in names ])
+
+    def get_tile_row(self, key):
+        split_point = self.state.split_points.get(key, [ None, None ])
+        return (key, self.state.explored_tree[key],
+                split_point[0], split_point[1],
+                self.state.tile_index.get(key, None))
+
+    def save_tile(self, key):
+        row = self.get_tile_row(key)
+        self.conn.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)', row)
+        if row[1] == Extent.EXPLORED.value:
+            # the keys under it are the ones which start with it and a digit from 0 to 3
+            self.conn.execute('DELETE FROM tiles WHERE key >= ? AND key < ?',
+                              (f'{key}0', f'{key}4'))
+
+    def commit(self, force=False):
+        if not force and self.durability == 'lazy' and \
+           time.monotonic() - self.last_commit < LAZY_INTERVAL:
+            return
+        if self.flush_output is not None:
+            self.flush_output(self.durability == 'fsync')
+        self.line_offsets.flush()
+        if self.feature_hashes is not None:
+            self.feature_hashes.flush()
+        self.conn.commit()
+        self.last_commit = time.monotonic()
+
+    def checkpoint(self):
+        # to avoid state being written without a output file being present
+        # as the resumption checks don't allow for it
+        if not self.output_file.exists():
+            self.output_file.write_text('')
+
+        # writes out all of the state
+        values = self.state.get_dict()
+        self.conn.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                              [ (name, json.dumps(value)) for name, value in values.items()
+                                if name not in TILE_FIELDS ])
+        if self.state.mode == 'EXTENT':
+            self.conn.execute('DELETE FROM tiles')
+            self.conn.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?, ?)',
+                                  [ self.get_tile_row(key) for key in self.state.explored_tree ])
+        self.commit(force=True)
+        self.has_checkpoint = True
+
+    def sync_lines(self):
+        """
+        Brings the line offsets, and the feature hashes in EXTENT mode, in line
+        with the output file and returns the number of lines in it. Lines written
+        after the last commit are read in, the ones which never made it to the file
+        are dropped. Returns None if the file doesn't match the database.
+        """
+        offsets = self.line_offsets
+        extent = self.state.mode == 'EXTENT'
+        count = offsets.count
+        end = offsets[count] if count > 0 else 0
+        size = self.output_file.stat().st_size
+        if end > size:
+            logger.warning(f'{self.output_file} is missing records the state has.. '
+                           'they will be fetched again')
+            row = self.conn.execute('SELECT max(idx) FROM lines WHERE offset <= ?', (size,)).fetchone()
+            count = row[0] if row[0] is not None else 0
+            end = offsets[count] if count > 0 else 0
+            offsets.truncate(count)
+            self.conn.execute('DELETE FROM hashes WHERE idx >= ?', (count,))
+
+        # hashes of lines written with a json library which isn't around
+        # anymore don't match the normalized lines, they are worked out again
+        rehash = extent and self.state.normalize_lines
+        if rehash:
+            logger.info(f'Reading existing records in {self.output_file}')
+            self.conn.execute('DELETE FROM hashes')
+
+        with open(self.output_file, 'r+b') as f:
+            if end > 0:
+                f.seek(end - 1)
+                if f.read(1) != b'\n':
+                    logger.error(f'lines in {self.output_file} are not where '
+                                 f'{self.state_file} has them')
+                    return None
+            f.seek(0 if rehash else end)
+            idx = 0 if rehash else count
+            if extent:
+                self.state.current_count = idx
+            offsets[count] = end
+            for line in iter_complete_lines(f, self.output_file):
+                if extent:
+                    self.state.add_raw_feature_no_dedup(line.decode('utf-8').strip('\n'), len(line))
+                idx += 1
+                if idx > count:
+                    end += len(line)
+                    count = idx
+                    offsets[count] = end
+        self.commit(force=True)
+        return count
+
+    def truncate_output(self, count):
+        offset = self.line_offsets[count] if count > 0 else 0
+        with open(self.output_file, 'r+b') as f:
+            f.truncate(offset)
+        self.line_offsets.truncate(count)
+        self.commit(force=True)
+        return count
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.has_checkpoint:
+            self.commit(force=True)
+            self.conn.close()
+            self.conn = None
+        else:
+            self.remove()
+
+    def remove(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        for path in get_db_files(self.state_file):
+            path.unlink(missing_ok=True)
+
+
+def read_state_data(conn):
+    state_data = { name: json.loads(value)
+                   for name, value in conn.execute('SELECT name, value FROM state') }
+    # validated without the tiles, which are typed by the table
+    valid, reason = validate_state_dict(state_data | { 'explored_tree': {} })
+    if not valid:
+        return None, reason
+
+    if state_data['mode'] == 'EXTENT':
+        explored_tree = {}
+        split_points = {}
+        tile_index = {}
+        rows = conn.execute('SELECT key, status, split_x, split_y, tile_index FROM tiles')
+        for key, status, split_x, split_y, index in rows:
+            explored_tree[key] = status
+            if split_x is not None:
+                split_points[key] = [ split_x, split_y ]
+            if index is not None:
+                tile_index[key] = index
+        state_data['explored_tree'] = explored_tree
+        if len(split_points) > 0:
+            state_data['split_points'] = split_points
+        if len(tile_index) > 0:
+            state_data['tile_index'] = tile_index
+    return state_data, None
+
+
+def get_state_from_db(state_file, output_file, durability='flush', **params):
+    if not sqlite_available:
+        logger.error('sqlite3 is not available in this python installation.. '
+                     'use the json state backend')
+        return None
+
+    if Path(state_file).exists() and not Path(output_file).exists() and \
+       not has_state(state_file):
+        # left behind by an extraction which stopped before its first update
+        for path in get_db_files(state_file):
+            path.unlink(missing_ok=True)
+
+    resume = check_state_files(state_file, output_file)
+    if resume is None:
+        return None
+
+    if not resume:
+        # left behind by an extraction whose files were deleted
+        for path in get_db_files(state_file):
+            path.unlink(missing_ok=True)
+
+    conn = None
+    try:
+        conn = connect(state_file, durability)
+        state_data = None
+        if resume:
+            state_data, reason = read_state_data(conn)
+            if state_data is None:
+                logger.error(f'state in file is invalid. Reason: {reason}')
+                conn.close()
+                return None
+    except (sqlite3.Error, ValueError):
+        logger.exception(f'Unable to read {state_file}')
+        if conn is not None:
+            conn.close()
+        return None
+
+    if not resume:
+        state = State.from_dict(**params)
+        SQLiteStore(state, conn, state_file, output_file, durability)
+        return state
+
+    state = State.from_dict(**state_data)
+    state.check_json_backend()
+    store = SQLiteStore(state, conn, state_file, output_file, durability, resumed=True)
+    if state.mixed_json_backends and not state_data.get('mixed_json_backends', False):
+        # the records written from here on are encoded by another json library,
+        # goes in with the first update
+        store.save_fields([ 'mixed_json_backends' ])
+    if state.mode == 'EXTENT' and state_data.get('tree_version', 1) < TREE_VERSION:
+        # the tiles table is rewritten with the compacted tree
+        store.checkpoint()
+
+    logger.info(f'Checking for records in {output_file} not in the state')
+    count = store.sync_lines()
+    if count is None:
+        store.close()
+        return None
+
+    if state.mode == 'OFFSET':
+        if count > state.downloaded_count:
+            # from pages which were being written out when the last run stopped
+            logger.warning(f'dropping {count - state.downloaded_count} records at the end of '
+                           f'{output_file} which the state doesn\'t account for')
+            count = store.truncate_output(state.downloaded_count)
+        params['downloaded_count'] = count
+        params.pop('dedup_key', None)
+    else:
+        del params['sort_key']
+
+    in_sync, reason = state.is_in_sync(**params)
+    if not in_sync:
+        logger.error(f'state not in sync. Reason: {reason}')
+        store.close()
+        return None
+    return state
@@ -0,0 +1,171 @@
+import re
+import xml.etree.ElementTree as ET
+
+from .errors import get_response_save_path, handle_error_xml
+
+# size of the pieces in which response bodies are handed to the parsers
+CHUNK_SIZE = 64 * 1024
+
+CHAR_REF_PATTERN = r'&#([a-zA-Z0-9]+);?'
+CHAR_REF_REPLACEMENT = r'[#\1;]'
+# a character reference which could still be continued by the next chunk
+PARTIAL_CHAR_REF_PATTERN = r'&(#[a-zA-Z0-9]*)?'
+PARTIAL_CHAR_REF_RE = re.compile(PARTIAL_CHAR_REF_PATTERN)
+PARTIAL_CHAR_REF_BYTES_RE = re.compile(PARTIAL_CHAR_REF_PATTERN.encode())
+
+EXCEPTION_REPORT_TAGS = [ 'ServiceExceptionReport', 'ExceptionReport' ]
+
+def fix_char_refs(data):
+    # deal with some xml/unicode messups
+    if isinstance(data, bytes):
+        return re.sub(CHAR_REF_PATTERN.encode(), CHAR_REF_REPLACEMENT.encode(), data)
+    return re.sub(CHAR_REF_PATTERN, CHAR_REF_REPLACEMENT, data)
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class BufferedParser:
+    """
+    Response parsers are fed the body as it downloads with feed(chunk)
+    and finished off with close(), both return the features completed so far.
+    This one holds on to the raw bytes and parses them in one go at the end,
+    for formats which can't be parsed incrementally.
+    """
+    def __init__(self, parse_fn):
+        self.parse_fn = parse_fn
+        self.chunks = []
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+        return []
+
+    def close(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return self.parse_fn(data)
+
+
+class SavingParser:
+    """
+    Passes the body through to another parser while writing it out to a file.
+    """
+    def __init__(self, parser, path):
+        self.parser = parser
+        self.fh = None
+        try:
+            self.fh = open(path, 'wb')
+        except Exception:
+            pass
+
+    def feed(self, chunk):
+        if self.fh is not None:
+            try:
+                self.fh.write(chunk)
+            except Exception:
+                pass
+        return self.parser.feed(chunk)
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+        return self.parser.close()
+
+
+class XMLStreamParser:
+    """
+    Base for parsers which pull features out of an xml response as its
+    elements complete. Subclasses implement handle_end(elem, parent), returning
+    the features completed with elem, and optionally handle_close().
+    If the root element turns out to be an exception report, the response
+    is buffered and handed over to handle_error_xml at the end.
+    """
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.stack = []
+        self.pending = None
+        self.raw = []
+        self.root_tag = None
+        # one of START, DOC or ERROR
+        self.mode = 'START'
+
+    def fix_chunk(self, chunk):
+        # char references are fixed a chunk at a time, holding back
+        # any which might run on into the next chunk.
+        # str chunks are passed on as str, for the declared encoding not to apply
+        data = chunk if self.pending is None else self.pending + chunk
+        self.pending = None
+        if isinstance(data, bytes):
+            pos = data.rfind(b'&')
+            partial_re = PARTIAL_CHAR_REF_BYTES_RE
+        else:
+            pos = data.rfind('&')
+            partial_re = PARTIAL_CHAR_REF_RE
+        if pos != -1 and partial_re.fullmatch(data, pos) is not None:
+            self.pending = data[pos:]
+            data = data[:pos]
+        return fix_char_refs(data)
+
+    def feed(self, chunk):
+        return self.process(self.fix_chunk(chunk))
+
+    def process(self, data):
+        if len(data) == 0:
+            return []
+
+        if self.mode == 'ERROR':
+            self.raw.append(data)
+            return []
+
+        if self.mode == 'START':
+            self.raw.append(data)
+
+        self.parser.feed(data)
+        feats = []
+        for event, elem in self.parser.read_events():
+            if event == 'start':
+                if self.mode == 'START':
+                    self.root_tag = local_name(elem.tag)
+                    self.mode = 'ERROR' if self.root_tag in EXCEPTION_REPORT_TAGS else 'DOC'
+                    if self.mode == 'DOC':
+                        self.raw = []
+                self.stack.append(elem)
+                continue
+
+            self.stack.pop()
+            if self.mode != 'DOC':
+                continue
+
+            parent = self.stack[-1] if len(self.stack) > 0 else None
+            feats.extend(self.handle_end(elem, parent))
+
+        return feats
+
+    def handle_end(self, elem, parent):
+        raise NotImplementedError()
+
+    def handle_close(self):
+        return []
+
+    def close(self):
+        feats = []
+        if self.pending is not None:
+            feats = self.process(fix_char_refs(self.pending))
+            self.pending = None
+        if self.mode == 'ERROR':
+            data = self.raw[0][:0].join(self.raw)
+            self.raw = []
+            handle_error_xml(data)
+            return feats
+
+        self.parser.close()
+        feats.extend(self.handle_close())
+        return feats
+
+
+def optionally_save_stream_to_file(parser):
+    path = get_response_save_path()
+    if path is None:
+        return parser
+    return SavingParser(parser, path)